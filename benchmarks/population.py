@@ -0,0 +1,151 @@
+"""
+Синтетические данные для бенчмарков.
+
+Все генераторы детерминированы по seed: участники с интересами
+из словаря тем (популярность по Ципфу) и статусами участия, а также
+история еженедельных встреч за несколько недель. load_population
+записывает их в файл базы массовыми INSERT в обход Database, поэтому
+даже сотни тысяч анкет загружаются за секунды.
+"""
+
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from database import to_epoch
+from migrate_db import apply_migrations
+from models import ParticipationStatus, User
+
+TOPICS = [
+    "кофе", "книги", "программирование", "путешествия", "дизайн", "музыка",
+    "фотография", "бег", "велосипед", "йога", "шахматы", "кино", "театр",
+    "маркетинг", "психология", "математика", "история", "философия",
+    "кулинария", "вино", "горы", "сноуборд", "футбол", "теннис", "плавание",
+    "стартапы", "инвестиции", "машинное обучение", "python", "go", "rust",
+    "фронтенд", "бэкенд", "devops", "продуктовый менеджмент", "аналитика",
+    "настольные игры", "видеоигры", "аниме", "комиксы", "рисование",
+    "гитара", "джаз", "опера", "языки", "английский", "испанский", "японский",
+]
+
+# Доли статусов участия по умолчанию
+DEFAULT_STATUSES = {
+    ParticipationStatus.ALWAYS: 0.5,
+    ParticipationStatus.ASK_EACH_TIME: 0.3,
+    ParticipationStatus.NEVER: 0.2,
+}
+
+class HistoryRound(NamedTuple):
+    """Одна прошедшая неделя мэтчинга"""
+    created_at: datetime
+    groups: List[Tuple[int, ...]]
+
+
+def make_population(count: int, seed: int = 42, extra_topics: int = 2000,
+                    statuses: Optional[Dict[ParticipationStatus, float]] = None) -> List[User]:
+    """Синтетические участники: 2-6 интересов, популярность по Ципфу.
+
+    Без statuses все участники со статусом "всегда".
+    """
+    rng = random.Random(seed)
+    topics = TOPICS + [f"тема{i}" for i in range(extra_topics)]
+    weights = [1 / (rank + 1) for rank in range(len(topics))]
+    status_choices = list(statuses) if statuses else [ParticipationStatus.ALWAYS]
+    status_weights = list(statuses.values()) if statuses else [1]
+
+    users = []
+    for user_id in range(1, count + 1):
+        interests = set(rng.choices(topics, weights, k=rng.randint(2, 6)))
+        users.append(User(
+            user_id=user_id,
+            username=f"user{user_id}",
+            first_name=f"User{user_id}",
+            last_name=None,
+            bio=None,
+            interests=", ".join(sorted(interests)),
+            participation_status=rng.choices(status_choices, status_weights)[0]
+        ))
+    return users
+
+
+def make_history(users: List[User], weeks: int, seed: int = 42,
+                 confirm_rate: float = 0.6,
+                 now: Optional[datetime] = None) -> List[HistoryRound]:
+    """Случайные пары за weeks прошедших недель, от старых к новым.
+
+    Каждую неделю участвуют все "всегда" и доля confirm_rate
+    "спрашивать каждый раз"; повторы встреч не исключаются.
+    """
+    rng = random.Random(seed)
+    now = now or datetime.now()
+    always = [user.user_id for user in users
+              if user.participation_status == ParticipationStatus.ALWAYS]
+    ask = [user.user_id for user in users
+           if user.participation_status == ParticipationStatus.ASK_EACH_TIME]
+
+    rounds = []
+    for week in range(weeks, 0, -1):
+        participants = always + [user_id for user_id in ask if rng.random() < confirm_rate]
+        rng.shuffle(participants)
+        groups = [
+            (participants[i], participants[i + 1])
+            for i in range(0, len(participants) - 1, 2)
+        ]
+        rounds.append(HistoryRound(now - timedelta(weeks=week), groups))
+    return rounds
+
+
+def history_pairs(history: List[HistoryRound]) -> set:
+    """Все пары (меньший ID, больший ID), встречавшиеся в истории"""
+    pairs = set()
+    for history_round in history:
+        for group in history_round.groups:
+            for i, user1_id in enumerate(group):
+                for user2_id in group[i + 1:]:
+                    pairs.add((min(user1_id, user2_id), max(user1_id, user2_id)))
+    return pairs
+
+
+def load_population(db_path: str, users: List[User],
+                    history: List[HistoryRound] = ()) -> int:
+    """Создать схему и массово записать анкеты и историю встреч.
+
+    Триггеры счетчиков статистики срабатывают как обычно; индекс
+    интересов нужно перестроить через Database.rebuild_interest_index.
+    Возвращает число записанных встреч.
+    """
+    apply_migrations(db_path)
+
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.executemany("""
+                INSERT INTO users (user_id, username, first_name, last_name,
+                                   bio, interests, participation_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (user.user_id, user.username, user.first_name, user.last_name,
+                 user.bio, user.interests, user.participation_status.value)
+                for user in users
+            ])
+
+            match_id = 0
+            matches, members = [], []
+            for history_round in history:
+                created_at = to_epoch(history_round.created_at)
+                for group in history_round.groups:
+                    match_id += 1
+                    matches.append((match_id, group[0], group[1], created_at))
+                    members.extend((match_id, user_id) for user_id in group)
+
+            conn.executemany("""
+                INSERT INTO matches (id, user1_id, user2_id, created_at, is_completed)
+                VALUES (?, ?, ?, ?, 1)
+            """, matches)
+            conn.executemany(
+                "INSERT INTO match_members (match_id, user_id) VALUES (?, ?)", members
+            )
+    finally:
+        conn.close()
+
+    return match_id
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Проверка планов горячих запросов Database.
+
+Горячие методы Database выполняются на временной базе с трассировкой
+SQLite, и EXPLAIN QUERY PLAN строится по тем самым запросам, которые
+они отправили: отдельной копии SQL, которая расходится с кодом, нет.
+Планы строятся на проверяемой базе (по умолчанию — из конфига), потому
+что полное сканирование или нет, решают ее индексы.
+
+    python -m benchmarks.query_plans
+    python -m benchmarks.query_plans --db random_coffee.db
+"""
+
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+from typing import List, Optional
+
+from config import load_config
+from database import Database, user_page_key
+from matching import MatchingService
+from migrate_db import check_query_plans
+from models import ParticipationStatus, User
+
+
+async def record_hot_queries(db: Database) -> List[str]:
+    """Выполнить горячие методы на пустой базе db и вернуть их SQL"""
+    statements: List[str] = []
+    await db.set_trace_callback(statements.append)
+    try:
+        # Анкеты и кэш
+        for user_id in range(1, 9):
+            status = (ParticipationStatus.ASK_EACH_TIME if user_id % 3 == 0
+                      else ParticipationStatus.ALWAYS)
+            await db.create_or_update_user(User(
+                user_id, f"user{user_id}", f"User{user_id}", None, None,
+                "кофе, книги", status
+            ))
+        await db.get_user(1)
+        await db.get_cached_user(2)
+        await db.get_users_by_ids([1, 2, 3])
+        await db.get_tag_postings([1, 2])
+        await db.get_participants()
+        await db.get_users_by_participation_status(ParticipationStatus.ALWAYS)
+
+        # Фаза 1: сессия и ответы участников
+        session_id = await db.create_matching_session()
+        await db.create_pending_matches(session_id)
+        await db.get_current_matching_session()
+        await db.get_pending_participants()
+        await db.confirm_pending_participation(3)
+        await db.decline_pending_participation(6)
+        await db.record_participation_responses({3: True})
+
+        # Фаза 2: участники, история пар, сохранение встреч с outbox
+        await db.get_session_participants(session_id)
+        await db.get_confirmed_participants()
+        result = await MatchingService(db).create_weekly_matches(session_id)
+        await db.check_recent_match(1, 2)
+        await db.get_recent_pairs()
+
+        # Доставка outbox
+        rows = await db.get_pending_outbox(2)
+        rows += await db.get_pending_outbox(100, rows[-1]['id'])
+        await db.mark_outbox_sent([rows[0]['id']])
+        await db.mark_outbox_failed([rows[1]['id']])
+        await db.mark_outbox_undeliverable([(rows[2]['id'], "recipient_deleted")])
+
+        # Отзывы и встречи пользователя
+        match_id, user_id = result.match_ids[0], result.pairs[0][0]
+        await db.get_user_recent_matches(user_id)
+        await db.record_meeting_feedback(match_id, user_id, "met")
+
+        # Админка: страницы списка и статистика
+        page = await db.get_users_page(3)
+        await db.get_users_page(3, after=user_page_key(page[-1]))
+        await db.get_users_page(3, before=user_page_key(page[-1]))
+        await db.get_users_count()
+        await db.get_matching_statistics()
+
+        # Состояния FSM
+        await db.save_fsm_states([("42:1:1", None, {}, 1)])
+        await db.get_fsm_state("42:1:1")
+        await db.purge_fsm_states(0)
+
+        await db.delete_user(8)
+    finally:
+        await db.set_trace_callback(None)
+    return statements
+
+
+async def collect_hot_queries() -> List[str]:
+    """SQL горячих методов, выполненных на временной базе"""
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "plans.db"))
+        try:
+            await db.init_db()
+            return await record_hot_queries(db)
+        finally:
+            await db.close()
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="проверяемая база (по умолчанию из конфига)")
+    args = parser.parse_args(argv)
+
+    statements = asyncio.run(collect_hot_queries())
+    conn = sqlite3.connect(args.db or load_config().database_path)
+    try:
+        problems = check_query_plans(conn, statements)
+    finally:
+        conn.close()
+
+    if problems:
+        print("❌ Запросы без индекса:")
+        for problem in problems:
+            print(f"  • {problem}")
+        return 1
+
+    print("✅ Горячие запросы и триггеры используют индексы")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Воспроизведение еженедельных циклов мэтчинга на копии базы.
+
+Еженедельный цикл MatchingService — сессия с запросами участия,
+ответы участников, пары с outbox уведомлений (create_weekly_matches)
+и обратная связь о встречах — прогоняется weeks раз подряд по
+виртуальным часам. Исходная база не меняется: работа идет с ее копией,
+а без --db генерируется синтетическая база. В отчете время фаз по
+неделям, доля повторных встреч и справедливость распределения пар.
+
+Для сравнения стратегий уведомления не нужны, поэтому строки outbox
+по умолчанию остаются неотправленными. С --deliver их каждую неделю
+доставляет OutboxDrainer через фиктивного бота, который только
+запоминает адресатов и кнопки.
+
+    python -m benchmarks.replay --db random_coffee.db --weeks 52 --strategy interests
+    python -m benchmarks.replay --users 20000 --weeks 52 --output replay.json
+    python -m benchmarks.replay --users 20000 --weeks 4 --deliver
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.population import DEFAULT_STATUSES, load_population, make_history, make_population
+from database import Database
+from matching import MATCHING_STRATEGIES, RECENT_MATCH_DAYS, MatchingResult, MatchingService
+
+# Фиктивный бот не ограничен лимитами Telegram
+_UNLIMITED_RATE = 1e9
+# Вся история встреч из исходной базы
+_ALL_HISTORY_DAYS = 100 * 365
+
+
+class VirtualClock:
+    """Часы, которые двигаются только явно"""
+
+    def __init__(self, start: datetime):
+        self.now = start
+
+    def __call__(self) -> datetime:
+        return self.now
+
+    def advance(self, delta: timedelta):
+        self.now += delta
+
+
+class FakeBot:
+    """Бот, который запоминает адресатов и кнопки вместо отправки"""
+
+    def __init__(self):
+        self.messages: List[Tuple[int, Optional[str]]] = []
+
+    async def send_message(self, chat_id: int, text: str, reply_markup=None, **kwargs):
+        callback_data = None
+        if reply_markup is not None:
+            callback_data = reply_markup.inline_keyboard[0][0].callback_data
+        self.messages.append((chat_id, callback_data))
+
+    def take(self) -> List[Tuple[int, Optional[str]]]:
+        """Забрать накопленные сообщения"""
+        messages, self.messages = self.messages, []
+        return messages
+
+
+def _pair_key(user1_id: int, user2_id: int) -> int:
+    """Неупорядоченная пара одним целым, как в RecentPairIndex"""
+    if user1_id > user2_id:
+        user1_id, user2_id = user2_id, user1_id
+    return (user1_id << 64) | user2_id
+
+
+def _jain_index(values: List[float]) -> float:
+    """Индекс справедливости Джайна: 1 — всем поровну, 1/n — все одному"""
+    total = sum(values)
+    squares = sum(value * value for value in values)
+    return total * total / (len(values) * squares) if squares else 1.0
+
+
+class Replay:
+    """Прогон weeks еженедельных циклов на копии базы по виртуальным часам.
+
+    Участники "спрашивать каждый раз" соглашаются с личной вероятностью
+    из [0.3, 0.9], встреча состоялась с вероятностью met_rate, отзыв
+    оставляет feedback_rate участников встреч. С deliver строки outbox
+    недели доставляются фиктивному боту.
+    """
+
+    def __init__(self, db_path: str, strategy: str = "maximum", triads: bool = False,
+                 start: Optional[datetime] = None, seed: int = 42,
+                 met_rate: float = 0.7, feedback_rate: float = 0.5,
+                 deliver: bool = False):
+        self.clock = VirtualClock(start or datetime.now())
+        self.db = Database(db_path, clock=self.clock)
+        self.service = MatchingService(
+            self.db, strategy=MATCHING_STRATEGIES[strategy](rng=random.Random(seed)),
+            triads=triads
+        )
+        self.bot = FakeBot()
+        self.dispatcher = None
+        self.outbox = None
+        if deliver:
+            # aiogram нужен только доставке: без него куча процесса в разы
+            # меньше, и полные сборки мусора каждую неделю обходятся дешевле
+            from dispatcher import NotificationDispatcher
+            from outbox import OutboxDrainer
+
+            self.dispatcher = NotificationDispatcher(
+                self.bot, concurrency=1, rate=_UNLIMITED_RATE, per_chat_interval=0
+            )
+            self.outbox = OutboxDrainer(self.db, self.dispatcher)
+        self.rng = random.Random(seed)
+        self.met_rate = met_rate
+        self.feedback_rate = feedback_rate
+        self._propensity: Dict[int, float] = {}
+        # Когда пара встречалась в последний раз
+        self._last_met: Dict[int, datetime] = {}
+        self._participations: Dict[int, int] = defaultdict(int)
+        self._matched: Dict[int, int] = defaultdict(int)
+
+    async def _load_history(self):
+        for user1_id, user2_id in await self.db.get_recent_pairs(_ALL_HISTORY_DAYS):
+            # Точные даты старых встреч не важны: они старше окна блокировки
+            self._last_met[_pair_key(user1_id, user2_id)] = datetime.min
+
+    def _respond(self, user_ids: List[int]) -> Dict[int, bool]:
+        """Ответы на запросы участия"""
+        responses = {}
+        for user_id in user_ids:
+            propensity = self._propensity.get(user_id)
+            if propensity is None:
+                propensity = self._propensity[user_id] = self.rng.uniform(0.3, 0.9)
+            responses[user_id] = self.rng.random() < propensity
+        return responses
+
+    @staticmethod
+    def _week_groups(result: MatchingResult) -> Tuple[Dict[int, Tuple[int, ...]], List[int]]:
+        """Состав встреч недели по ID встреч и список оставшихся без пары"""
+        groups = dict(zip(result.match_ids + result.triad_ids,
+                          result.pairs + result.triples))
+        return groups, result.unmatched_ids + result.conflicted_ids
+
+    def _score_week(self, groups: Dict[int, Tuple[int, ...]], unmatched: List[int]) -> dict:
+        now = self.clock()
+        recent_threshold = now - timedelta(days=RECENT_MATCH_DAYS)
+        pairs = repeats = recent_repeats = 0
+
+        for members in groups.values():
+            for i, user1_id in enumerate(members):
+                self._participations[user1_id] += 1
+                self._matched[user1_id] += 1
+                for user2_id in members[i + 1:]:
+                    key = _pair_key(user1_id, user2_id)
+                    last_met = self._last_met.get(key)
+                    pairs += 1
+                    if last_met is not None:
+                        repeats += 1
+                        if last_met > recent_threshold:
+                            recent_repeats += 1
+                    self._last_met[key] = now
+
+        for user_id in unmatched:
+            self._participations[user_id] += 1
+
+        participants = sum(len(members) for members in groups.values()) + len(unmatched)
+        return {
+            "participants": participants,
+            "meetings": len(groups),
+            "unmatched": len(unmatched),
+            "repeat_pair_rate": repeats / pairs if pairs else 0.0,
+            "recent_repeat_pairs": recent_repeats,
+        }
+
+    def _feedback(self, groups: Dict[int, Tuple[int, ...]]) -> List[Tuple[int, int, str]]:
+        entries = []
+        for match_id, members in groups.items():
+            met = self.rng.random() < self.met_rate
+            for user_id in members:
+                if self.rng.random() < self.feedback_rate:
+                    entries.append((match_id, user_id,
+                                    "meeting_confirmed" if met else "meeting_not_confirmed"))
+        return entries
+
+    async def run_week(self) -> dict:
+        """Один цикл: понедельник — фаза 1, вторник — фаза 2, далее отзывы"""
+        timings = {}
+
+        started = time.perf_counter()
+        session_id = await self.service.start_weekly_matching_session(24)
+        pending = await self.db.get_pending_participants(session_id)
+        timings["start_session"] = time.perf_counter() - started
+
+        responses = self._respond([user.user_id for user in pending])
+        started = time.perf_counter()
+        await self.db.record_participation_responses(responses, session_id)
+        timings["responses"] = time.perf_counter() - started
+
+        self.clock.advance(timedelta(days=1))
+        started = time.perf_counter()
+        result = await self.service.create_weekly_matches(session_id)
+        timings["create_matches"] = time.perf_counter() - started
+
+        if self.outbox is not None:
+            started = time.perf_counter()
+            await self.outbox.drain()
+            timings["deliver"] = time.perf_counter() - started
+            self.bot.take()
+
+        groups, unmatched = self._week_groups(result)
+        week = self._score_week(groups, unmatched)
+
+        self.clock.advance(timedelta(days=2))
+        started = time.perf_counter()
+        await self.db.record_meetings_feedback(self._feedback(groups))
+        timings["feedback"] = time.perf_counter() - started
+
+        self.clock.advance(timedelta(days=4))
+        week["timings"] = timings
+        return week
+
+    def fairness(self) -> dict:
+        """Насколько равномерно участники получают пары"""
+        rates = [
+            self._matched[user_id] / count
+            for user_id, count in self._participations.items()
+        ]
+        misses = [
+            count - self._matched[user_id]
+            for user_id, count in self._participations.items()
+        ]
+        return {
+            "users": len(rates),
+            "jain_index": _jain_index(rates) if rates else 1.0,
+            "min_match_rate": min(rates, default=1.0),
+            "max_unmatched_weeks": max(misses, default=0),
+        }
+
+    async def run(self, weeks: int, log=print) -> dict:
+        """Прогнать weeks циклов и собрать отчет"""
+        await self.db.init_db()
+        try:
+            await self._load_history()
+            started = time.perf_counter()
+            report_weeks = []
+            for number in range(1, weeks + 1):
+                week = await self.run_week()
+                week["week"] = number
+                report_weeks.append(week)
+                log(format_week(week))
+            total = time.perf_counter() - started
+        finally:
+            if self.dispatcher is not None:
+                await self.dispatcher.close()
+            await self.db.close()
+
+        repeat_rates = [week["repeat_pair_rate"] for week in report_weeks]
+        return {
+            "weeks": report_weeks,
+            "total_time": total,
+            "mean_repeat_pair_rate": sum(repeat_rates) / len(repeat_rates) if repeat_rates else 0.0,
+            "recent_repeat_pairs": sum(week["recent_repeat_pairs"] for week in report_weeks),
+            "fairness": self.fairness(),
+        }
+
+
+def format_week(week: dict) -> str:
+    """Строка отчета по одной неделе"""
+    timings = " ".join(
+        f"{name} {seconds * 1000:7.1f} мс" for name, seconds in week["timings"].items()
+    )
+    return (f"неделя {week['week']:>3}: участников {week['participants']:>6}, "
+            f"встреч {week['meetings']:>6}, без пары {week['unmatched']:>4}, "
+            f"повторов {week['repeat_pair_rate']:6.2%} | {timings}")
+
+
+def copy_database(source: str, target: str):
+    """Согласованная копия базы, в том числе с незакрытым WAL"""
+    src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _next_monday(moment: datetime) -> datetime:
+    """Ближайший понедельник 10:00 после moment"""
+    days = (7 - moment.weekday()) % 7 or 7
+    return (moment + timedelta(days=days)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+
+def _generate_database(db_path: str, users: int, history_weeks: int, seed: int,
+                       now: datetime):
+    """Синтетическая база; анкеты популяции не держатся в памяти во время прогона"""
+    population = make_population(users, seed, statuses=DEFAULT_STATUSES)
+    load_population(db_path, population, make_history(population, history_weeks, seed, now=now))
+
+
+async def _run(replay: Replay, weeks: int, rebuild_index: bool) -> dict:
+    if rebuild_index:
+        # В синтетической базе индекс интересов еще не построен
+        await replay.db.rebuild_interest_index()
+    return await replay.run(weeks)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--db", help="база для копирования; без нее — синтетическая")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--history-weeks", type=int, default=4)
+    parser.add_argument("--weeks", type=int, default=52)
+    parser.add_argument("--strategy", default="maximum", choices=list(MATCHING_STRATEGIES))
+    parser.add_argument("--triads", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--deliver", action="store_true",
+                        help="доставлять уведомления фиктивному боту")
+    parser.add_argument("--output", help="куда сохранить отчет в JSON")
+    args = parser.parse_args(argv)
+
+    start = _next_monday(datetime.now())
+
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "replay.db")
+        if args.db:
+            copy_database(args.db, db_path)
+        else:
+            _generate_database(db_path, args.users, args.history_weeks, args.seed, start)
+
+        replay = Replay(db_path, args.strategy, args.triads, start, args.seed,
+                        deliver=args.deliver)
+        report = asyncio.run(_run(replay, args.weeks, rebuild_index=not args.db))
+
+    fairness = report["fairness"]
+    print(f"Всего {report['total_time']:.1f} с, средняя доля повторов "
+          f"{report['mean_repeat_pair_rate']:.2%}, повторов внутри окна "
+          f"{report['recent_repeat_pairs']}")
+    print(f"Справедливость: индекс Джайна {fairness['jain_index']:.3f}, "
+          f"минимальная доля недель с парой {fairness['min_match_rate']:.2f}, "
+          f"максимум недель без пары {fairness['max_unmatched_weeks']}")
+
+    if args.output:
+        report["params"] = vars(args)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Отчет сохранен в {args.output}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Набор бенчмарков еженедельного мэтчинга.
+
+Для каждой стратегии и размера базы на одинаковых синтетических данных
+(участники, статусы, история встреч за несколько недель) прогоняются обе
+фазы сессии и измеряются время, число SQL-запросов, пик памяти Python
+и качество результата: доля участников с парой и доля пар, которые уже
+встречались в истории. Результаты сохраняются в JSON; с --compare
+сравниваются с прошлым запуском, и при регрессии код выхода ненулевой.
+
+    python -m benchmarks.suite --users 1000 10000 --output results.json
+    python -m benchmarks.suite --compare baseline.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from benchmarks.population import (
+    DEFAULT_STATUSES, history_pairs, load_population, make_history, make_population
+)
+from database import Database
+from interests import HAS_NUMPY
+from matching import MATCHING_STRATEGIES, MatchingService
+from models import ParticipationStatus
+
+STAGES = ("start_session", "create_matches")
+# Чем меньше, тем лучше; для остальных метрик — чем больше
+LOWER_IS_BETTER = {"wall_time", "queries", "peak_memory", "repeat_pair_rate"}
+# Доли сравниваются по абсолютной разнице, остальное — по относительной
+FRACTION_METRICS = {"matched_fraction", "repeat_pair_rate"}
+
+
+class QueryCounter:
+    """Обработчик трассировки SQLite, считающий выполненные запросы"""
+
+    def __init__(self):
+        self.count = 0
+        self.enabled = False
+        self._last: Optional[str] = None
+
+    def __call__(self, statement: str):
+        # Срабатывания триггеров приходят текстом запроса, который их
+        # вызвал (с подставленными параметрами), поэтому подряд идущие
+        # повторы не считаем
+        if self.enabled and statement != self._last:
+            self.count += 1
+        self._last = statement
+
+
+def default_strategies() -> List[str]:
+    """Стратегии, доступные в текущем окружении"""
+    names = list(MATCHING_STRATEGIES)
+    if not HAS_NUMPY:
+        names.remove("weighted")
+    return names
+
+
+def build_template(path: str, users: int, weeks: int, seed: int,
+                   confirm_rate: float) -> set:
+    """Создать эталонную базу и вернуть пары из истории встреч"""
+    population = make_population(users, seed, statuses=DEFAULT_STATUSES)
+    history = make_history(population, weeks, seed, confirm_rate)
+    load_population(path, population, history)
+
+    async def rebuild_index():
+        db = Database(path)
+        try:
+            await db.rebuild_interest_index()
+        finally:
+            await db.close()
+
+    asyncio.run(rebuild_index())
+    return history_pairs(history)
+
+
+async def _run_case(db_path: str, strategy: str, seed: int, confirm_rate: float,
+                    triads: bool, trace_memory: bool) -> dict:
+    db = Database(db_path)
+    counter = QueryCounter()
+    await db.set_trace_callback(counter)
+    service = MatchingService(
+        db, strategy=MATCHING_STRATEGIES[strategy](rng=random.Random(seed)), triads=triads
+    )
+
+    stages = {}
+
+    async def measure(name, operation):
+        counter.count = 0
+        counter.enabled = True
+        if trace_memory:
+            tracemalloc.start()
+        started = time.perf_counter()
+        try:
+            return await operation()
+        finally:
+            stages[name] = {
+                "wall_time": time.perf_counter() - started,
+                "queries": counter.count,
+            }
+            if trace_memory:
+                stages[name]["peak_memory"] = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            counter.enabled = False
+
+    try:
+        session_id = await measure("start_session", service.start_weekly_matching_session)
+
+        # Ответы участников в измерения не входят
+        rng = random.Random(seed)
+        for user in await db.get_pending_participants():
+            if rng.random() < confirm_rate:
+                await db.confirm_pending_participation(user.user_id)
+
+        result = await measure(
+            "create_matches", lambda: service.create_weekly_matches(session_id)
+        )
+    finally:
+        await db.close()
+
+    return {"stages": stages, "result": result}
+
+
+def _quality(result, seen_pairs: set) -> dict:
+    groups = MatchingService.group_ids(result)
+    new_pairs = [
+        (min(user1_id, user2_id), max(user1_id, user2_id))
+        for group in groups
+        for i, user1_id in enumerate(group)
+        for user2_id in group[i + 1:]
+    ]
+    matched = sum(len(group) for group in groups)
+    participants = matched + len(result.unmatched_ids) + len(result.conflicted_ids)
+    repeats = sum(1 for pair in new_pairs if pair in seen_pairs)
+
+    return {
+        "participants": participants,
+        "pairs": len(result.pairs),
+        "triads": len(result.triples),
+        "matched_fraction": matched / participants if participants else 0.0,
+        "repeat_pair_rate": repeats / len(new_pairs) if new_pairs else 0.0,
+    }
+
+
+def run_case(template: str, strategy: str, seen_pairs: set, seed: int = 42,
+             confirm_rate: float = 0.6, triads: bool = False,
+             trace_memory: bool = True) -> dict:
+    """Прогнать обе фазы сессии одной стратегией на копии эталонной базы.
+
+    Время и число запросов измеряются отдельным прогоном без tracemalloc,
+    чтобы трассировка памяти не искажала время.
+    """
+    runs = []
+    with tempfile.TemporaryDirectory() as directory:
+        for traced in ((False, True) if trace_memory else (False,)):
+            db_path = os.path.join(directory, f"run{len(runs)}.db")
+            shutil.copyfile(template, db_path)
+            runs.append(asyncio.run(_run_case(
+                db_path, strategy, seed, confirm_rate, triads, traced
+            )))
+
+    stages = runs[0]["stages"]
+    if trace_memory:
+        for name, metrics in runs[1]["stages"].items():
+            stages[name]["peak_memory"] = metrics["peak_memory"]
+
+    case = {"strategy": strategy, "triads": triads, "stages": stages}
+    case.update(_quality(runs[0]["result"], seen_pairs))
+    return case
+
+
+def run_suite(sizes: List[int], strategies: List[str], weeks: int = 8,
+              seed: int = 42, confirm_rate: float = 0.6, triads: bool = False,
+              trace_memory: bool = True, log=print) -> dict:
+    """Прогнать все стратегии на всех размерах базы"""
+    cases = []
+    with tempfile.TemporaryDirectory() as directory:
+        for users in sizes:
+            template = os.path.join(directory, f"template{users}.db")
+            started = time.perf_counter()
+            seen_pairs = build_template(template, users, weeks, seed, confirm_rate)
+            log(f"База на {users} анкет за {weeks} недель: "
+                f"{time.perf_counter() - started:.1f} с")
+
+            for strategy in strategies:
+                case = run_case(template, strategy, seen_pairs, seed,
+                                confirm_rate, triads, trace_memory)
+                case["users"] = users
+                cases.append(case)
+                log(format_case(case))
+
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "params": {"weeks": weeks, "seed": seed, "confirm_rate": confirm_rate,
+                   "triads": triads},
+        "cases": cases,
+    }
+
+
+def format_case(case: dict) -> str:
+    """Строка отчета по одному прогону"""
+    parts = [f"{case['strategy']:<10} {case['users']:>8}"]
+    for name, metrics in case["stages"].items():
+        part = f"{name}: {metrics['wall_time'] * 1000:8.1f} мс {metrics['queries']:>6} запр."
+        if "peak_memory" in metrics:
+            part += f" {metrics['peak_memory'] / 2**20:6.1f} МБ"
+        parts.append(part)
+    parts.append(f"с парой {case['matched_fraction']:.1%}, "
+                 f"повторов {case['repeat_pair_rate']:.2%}")
+    return " | ".join(parts)
+
+
+def _case_metrics(case: dict) -> Dict[str, float]:
+    metrics = {
+        f"{stage}.{name}": value
+        for stage, stage_metrics in case["stages"].items()
+        for name, value in stage_metrics.items()
+    }
+    metrics["matched_fraction"] = case["matched_fraction"]
+    metrics["repeat_pair_rate"] = case["repeat_pair_rate"]
+    return metrics
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.2,
+            fraction_tolerance: float = 0.01) -> List[str]:
+    """Найти ухудшения метрик относительно прошлого запуска.
+
+    Время, запросы и память считаются регрессией при росте больше чем
+    на tolerance (доля), доли качества — при изменении больше чем на
+    fraction_tolerance в худшую сторону.
+    """
+    previous = {
+        (case["strategy"], case["users"]): _case_metrics(case)
+        for case in baseline["cases"]
+    }
+
+    regressions = []
+    for case in current["cases"]:
+        old = previous.get((case["strategy"], case["users"]))
+        if old is None:
+            continue
+
+        for name, value in _case_metrics(case).items():
+            if name not in old:
+                continue
+            metric = name.rsplit(".", 1)[-1]
+            sign = 1 if metric in LOWER_IS_BETTER else -1
+            if metric in FRACTION_METRICS:
+                worse = sign * (value - old[name]) > fraction_tolerance
+            else:
+                worse = sign * (value - old[name]) > tolerance * old[name]
+            if worse:
+                regressions.append(
+                    f"{case['strategy']}/{case['users']} {name}: "
+                    f"{old[name]:.4g} -> {value:.4g}"
+                )
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--strategies", nargs="+", default=default_strategies(),
+                        choices=list(MATCHING_STRATEGIES))
+    parser.add_argument("--weeks", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--confirm-rate", type=float, default=0.6)
+    parser.add_argument("--triads", action="store_true")
+    parser.add_argument("--no-memory", action="store_true",
+                        help="не измерять пик памяти (вдвое быстрее)")
+    parser.add_argument("--output", help="куда сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.users, args.strategies, args.weeks, args.seed,
+                        args.confirm_rate, args.triads, not args.no_memory)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.tolerance)
+        for line in regressions:
+            print(f"РЕГРЕССИЯ {line}")
+        if regressions:
+            return 1
+        print("Регрессий нет")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк взвешенного мэтчинга по интересам.
+
+Генерирует синтетических участников с интересами из словаря тем
+с распределением популярности по Ципфу и печатает время каждого этапа
+WeightedMatchingStrategy.
+
+    python -m benchmarks.weighted_matching --users 50000
+"""
+
+import argparse
+import random
+import time
+
+from benchmarks.population import make_population
+from matching import RecentPairIndex, WeightedMatchingStrategy
+
+
+def make_recent_pairs(users, per_user: int = 3, seed: int = 7) -> RecentPairIndex:
+    """Несколько недавних встреч у каждого участника"""
+    rng = random.Random(seed)
+    ids = [user.user_id for user in users]
+    recent = RecentPairIndex()
+    for user_id in ids:
+        for _ in range(per_user):
+            other_id = rng.choice(ids)
+            if other_id != user_id:
+                recent.add(user_id, other_id)
+    return recent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=50000)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    users = make_population(args.users, args.seed)
+    recent = make_recent_pairs(users)
+    profiles = {user.user_id: user for user in users}
+
+    strategy = WeightedMatchingStrategy(rng=random.Random(args.seed), top_k=args.top_k)
+
+    started = time.perf_counter()
+    outcome = strategy.pair(list(profiles), recent, profiles)
+    total = time.perf_counter() - started
+
+    print(f"Участников: {args.users}, top-k: {args.top_k}")
+    for stage, seconds in strategy.timings.items():
+        print(f"  {stage:<12} {seconds * 1000:9.1f} мс")
+    print(f"  {'всего':<12} {total * 1000:9.1f} мс")
+    print(f"Пар: {len(outcome.pairs)}, без пары: {len(outcome.unmatched)}, "
+          f"конфликтов: {len(outcome.conflicted)}")
+
+
+if __name__ == "__main__":
+    main()
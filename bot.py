@@ -1,15 +1,19 @@
 import asyncio
 import logging
+from typing import Optional
+
 from aiogram import Bot, Dispatcher
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import CommandStart, Command
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.fsm.context import FSMContext
 
 from config import load_config
 from database import Database
+from fsm_storage import SQLiteStorage
 from keyboards import get_main_menu
+from models import User
 from scheduler import MatchingScheduler
+from webhook import run_webhook
 from handlers import profile, participation, matching, admin, feedback
 from handlers.profile import force_create_profile
 import shared
@@ -24,14 +28,17 @@ logger = logging.getLogger(__name__)
 # Инициализация
 config = load_config()
 bot = Bot(token=config.bot_token)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
 
 # Создаем экземпляр базы данных без инициализации
-db = Database(config.database_path)
+db = Database(config.database_path, config.database_pool_size)
+
+# Состояния FSM хранятся в той же базе и переживают перезапуск
+storage = SQLiteStorage(db)
+dp = Dispatcher(storage=storage)
 
 # Создаем планировщик
-scheduler = MatchingScheduler(bot, db)
+scheduler = MatchingScheduler(bot, db, config.matching_strategy,
+                              config.matching_triads)
 
 
 # Регистрация роутеров
@@ -43,11 +50,9 @@ dp.include_router(feedback.router)
 
 
 @dp.message(CommandStart())
-async def start_command(message: Message, db: Database, state: FSMContext):
+async def start_command(message: Message, state: FSMContext, user: Optional[User]):
     """Обработчик команды /start"""
-    # Проверяем, есть ли пользователь в базе данных
-    user = await db.get_user(message.from_user.id)
-
+    # Анкету пользователя подгружает DatabaseMiddleware
     if user is None:
         # Новый пользователь - принудительно отправляем в создание анкеты
         await force_create_profile(message, state)
@@ -144,13 +149,22 @@ async def main_menu_callback(callback: CallbackQuery):
     )
 
 
-# Middleware для передачи database в хендлеры
+# Middleware для передачи database и анкеты пользователя в хендлеры
 class DatabaseMiddleware:
     def __init__(self, database: Database):
         self.database = database
 
     async def __call__(self, handler, event, data):
         data['db'] = self.database
+
+        # Анкета загружается один раз на апдейт и берется из кэша
+        if 'user' not in data:
+            from_user = data.get('event_from_user')
+            data['user'] = (
+                await self.database.get_cached_user(from_user.id)
+                if from_user else None
+            )
+
         return await handler(event, data)
 
 
@@ -170,16 +184,24 @@ async def main():
 
         # Запускаем планировщик
         scheduler.start()
+        await scheduler.resume_interrupted_matching()
 
         logger.info("🤖 Бот запущен!")
         logger.info("📅 Планировщик мэтчинга активен")
 
-        await dp.start_polling(bot)
+        if config.mode == "webhook":
+            await run_webhook(dp, bot, config)
+        else:
+            await dp.start_polling(bot)
 
     except Exception as e:
         logger.error(f"❌ Ошибка при запуске: {e}")
     finally:
         scheduler.stop()
+        await scheduler.outbox.stop()
+        await scheduler.dispatcher.close()
+        await storage.close()
+        await db.close()
         await bot.session.close()
 
 if __name__ == "__main__":
@@ -0,0 +1,65 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterator, Optional, Tuple
+
+
+_MISSING = object()
+
+
+class LRUCache:
+    """Ограниченный по размеру кэш с вытеснением LRU и временем жизни записей.
+
+    Записи старше ttl секунд считаются отсутствующими и удаляются при
+    обращении. Размер кэша никогда не превышает maxsize.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._clock = clock
+        self._items: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and self._clock() - stored_at > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Получить значение и отметить его как недавно использованное"""
+        item = self._items.get(key)
+        if item is None or self._expired(item[1]):
+            if item is not None:
+                del self._items[key]
+            self.misses += 1
+            return default
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key: Hashable, value: Any):
+        """Сохранить значение, при переполнении вытеснить самое старое"""
+        self._items[key] = (value, self._clock())
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Удалить значение из кэша"""
+        item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        """Очистить кэш"""
+        self._items.clear()
+
+    def keys(self) -> Iterator[Hashable]:
+        """Ключи от давно использованных к недавним"""
+        return iter(list(self._items))
@@ -1,16 +1,42 @@
 import os
 from dataclasses import dataclass
+from typing import Optional
 
 
 @dataclass
 class Config:
     bot_token: str
     database_path: str = "bot.db"
+    # Размер пула соединений-читателей SQLite
+    database_pool_size: int = 4
     admin_ids: list = None
+    # Стратегия мэтчинга: "maximum" (максимальное паросочетание), "random",
+    # "weighted" (по сходству интересов, нужны numpy и scipy) или
+    # "interests" (пары с общими тегами интересов)
+    matching_strategy: str = "maximum"
+    # Оставшихся без пары (нечетное число, конфликты) добавлять в пары третьими
+    matching_triads: bool = True
+    # Способ получения апдейтов: "polling" или "webhook"
+    mode: str = "polling"
+    # Публичный адрес, на который Telegram шлет апдейты (без пути)
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    webhook_secret: Optional[str] = None
+    # Сколько апдейтов обрабатывается параллельно в режиме вебхука
+    webhook_workers: int = 8
 
 
 def load_config() -> Config:
     return Config(
         bot_token=os.getenv("BOT_TOKEN", "YOUR_BOT_TOKEN_HERE"),
-        admin_ids=[561189061]  # Замените на ваш Telegram ID
+        admin_ids=[561189061],  # Замените на ваш Telegram ID
+        matching_strategy=os.getenv("MATCHING_STRATEGY", "maximum"),
+        matching_triads=os.getenv("MATCHING_TRIADS", "1").lower() not in ("0", "false", "no"),
+        mode=os.getenv("BOT_MODE", "polling"),
+        webhook_url=os.getenv("WEBHOOK_URL", ""),
+        webhook_secret=os.getenv("WEBHOOK_SECRET"),
+        webhook_port=int(os.getenv("WEBHOOK_PORT", "8080")),
+        webhook_workers=int(os.getenv("WEBHOOK_WORKERS", "8"))
     )
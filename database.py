@@ -1,613 +1,1174 @@
-import sqlite3
-from typing import Optional, List
+import asyncio
+import dataclasses
+import json
+from array import array
+from contextlib import asynccontextmanager
+from typing import Callable, Dict, NamedTuple, Optional, List, Tuple
 from datetime import datetime, timedelta
-from models import User, ParticipationStatus
-
-
-class Database:
-    def __init__(self, db_path: str):
-        self.db_path = db_path
-        self._initialized = False
-
-    async def init_db(self):
-        """Инициализация базы данных"""
-        if self._initialized:
-            return
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT NOT NULL,
-                last_name TEXT,
-                bio TEXT,
-                interests TEXT,
-                participation_status TEXT DEFAULT 'ask_each_time',
-                is_active BOOLEAN DEFAULT 1,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS matches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user1_id INTEGER,
-                user2_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                is_completed BOOLEAN DEFAULT 0,
-                meeting_feedback TEXT DEFAULT NULL,
-                FOREIGN KEY (user1_id) REFERENCES users (user_id),
-                FOREIGN KEY (user2_id) REFERENCES users (user_id)
-            )
-        """)
-
-        # Новая таблица для ожидающих подтверждения участников
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS pending_matches (
-                user_id INTEGER PRIMARY KEY,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                confirmed BOOLEAN DEFAULT NULL,
-                FOREIGN KEY (user_id) REFERENCES users (user_id)
-            )
-        """)
-
-        # Таблица для отслеживания сессий матчинга
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS matching_sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                status TEXT DEFAULT 'collecting',
-                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                deadline TIMESTAMP,
-                completed_at TIMESTAMP DEFAULT NULL,
-                forced_completion BOOLEAN DEFAULT 0
-            )
-        """)
-
-        conn.commit()
-        conn.close()
-        self._initialized = True
-
-    async def _ensure_initialized(self):
-        """Убедиться, что база данных инициализирована"""
-        if not self._initialized:
-            await self.init_db()
+import aiosqlite
 
-    # ... (предыдущие методы остаются без изменений)
-    async def create_or_update_user(self, user: User) -> bool:
-        """Создать или обновить пользователя"""
-        await self._ensure_initialized()
+from cache import LRUCache
+from interests import tokenize_interests
+from models import User, ParticipationStatus
+from migrate_db import ACTIVE_SESSION_STATUSES, STATS_REBUILD_SQL, apply_migrations
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
 
-        cursor.execute("""
-            INSERT OR REPLACE INTO users
-            (user_id, username, first_name, last_name, bio, interests, participation_status, is_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            user.user_id, user.username, user.first_name, user.last_name,
-            user.bio, user.interests, user.participation_status.value, user.is_active
-        ))
+# Сколько пар вставляется одним INSERT (ограничение на число параметров)
+MATCH_INSERT_CHUNK = 500
+# Сколько ID передается в одном запросе WHERE user_id IN (...)
+USER_SELECT_CHUNK = 500
+# Сколько строк участников читается за один fetchmany
+PARTICIPANT_FETCH_SIZE = 1000
+# Кэш анкет для горячих путей хендлеров
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 300.0
 
-        conn.commit()
-        result = cursor.rowcount > 0
-        conn.close()
-        return result
+# Отметка в кэше для пользователей без анкеты
+_NO_USER = object()
 
-    async def get_user(self, user_id: int) -> Optional[User]:
-        """Получить пользователя по ID"""
-        await self._ensure_initialized()
+_ACTIVE_SESSIONS_SQL = (
+    f"SELECT id FROM matching_sessions WHERE status IN {ACTIVE_SESSION_STATUSES}"
+)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
 
-        cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
+def _session_filter(column: str, session_id: Optional[int]) -> Tuple[str, tuple]:
+    """Условие на сессию: заданную или любую активную"""
+    if session_id is None:
+        return f"{column} IN ({_ACTIVE_SESSIONS_SQL})", ()
+    return f"{column} = ?", (session_id,)
 
-        if row:
-            return User(
-                user_id=row[0],
-                username=row[1],
-                first_name=row[2],
-                last_name=row[3],
-                bio=row[4],
-                interests=row[5],
-                participation_status=ParticipationStatus(row[6]),
-                is_active=bool(row[7]),
-                created_at=row[8]
-            )
-        return None
 
-    async def delete_user(self, user_id: int) -> bool:
-        """Удалить пользователя"""
-        await self._ensure_initialized()
+# Компактные коды статусов участия для массивов участников
+PARTICIPATION_STATUSES = list(ParticipationStatus)
+_STATUS_CODES = {status.value: code for code, status in enumerate(PARTICIPATION_STATUSES)}
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
 
-        cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+class ParticipantArrays(NamedTuple):
+    """Участники мэтчинга в типизированных массивах, по возрастанию ID.
 
-        conn.commit()
-        result = cursor.rowcount > 0
-        conn.close()
-        return result
+    Вместо анкет — только то, что нужно стратегиям: ID и коды статусов
+    (индексы в PARTICIPATION_STATUSES). Теги, если загружены, хранятся
+    подряд: теги участника i — tag_ids[tag_offsets[i]:tag_offsets[i + 1]].
+    """
+    user_ids: array
+    status_codes: array
+    tag_offsets: Optional[array] = None
+    tag_ids: Optional[array] = None
 
-    async def get_participants(self) -> List[User]:
-        """Получить всех активных участников"""
-        await self._ensure_initialized()
+    def status(self, index: int) -> ParticipationStatus:
+        """Статус участия участника с номером index"""
+        return PARTICIPATION_STATUSES[self.status_codes[index]]
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT * FROM users
-            WHERE is_active = 1 AND participation_status IN ('always', 'ask_each_time')
-        """)
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        users = []
-        for row in rows:
-            users.append(User(
-                user_id=row[0],
-                username=row[1],
-                first_name=row[2],
-                last_name=row[3],
-                bio=row[4],
-                interests=row[5],
-                participation_status=ParticipationStatus(row[6]),
-                is_active=bool(row[7]),
-                created_at=row[8]
-            ))
+    def postings(self) -> Dict[int, List[int]]:
+        """Списки участников по тегам, общим хотя бы для двоих"""
+        if self.tag_ids is None:
+            return {}
 
-        return users
+        postings: Dict[int, List[int]] = {}
+        for index, user_id in enumerate(self.user_ids):
+            for position in range(self.tag_offsets[index], self.tag_offsets[index + 1]):
+                postings.setdefault(self.tag_ids[position], []).append(user_id)
+        return {
+            tag_id: members for tag_id, members in postings.items()
+            if len(members) > 1
+        }
 
-    # Новые методы для мэтчинга
-    async def get_users_by_participation_status(self, status: ParticipationStatus) -> List[User]:
-        """Получить пользователей по статусу участия"""
-        await self._ensure_initialized()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+def to_epoch(moment: datetime) -> int:
+    """Метка времени для базы: секунды эпохи (наивное время — локальное)"""
+    return int(moment.timestamp())
 
-        cursor.execute("""
-            SELECT * FROM users
-            WHERE is_active = 1 AND participation_status = ?
-        """, (status.value,))
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        users = []
-        for row in rows:
-            users.append(User(
-                user_id=row[0],
-                username=row[1],
-                first_name=row[2],
-                last_name=row[3],
-                bio=row[4],
-                interests=row[5],
-                participation_status=ParticipationStatus(row[6]),
-                is_active=bool(row[7]),
-                created_at=row[8]
-            ))
 
-        return users
+def from_epoch(value: Optional[int]) -> Optional[datetime]:
+    """Локальное время из метки в секундах эпохи"""
+    return datetime.fromtimestamp(value) if value is not None else None
 
-    async def create_match(self, user1_id: int, user2_id: int) -> bool:
-        """Создать пару пользователей"""
-        await self._ensure_initialized()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+def user_page_key(user: User) -> Tuple[int, int]:
+    """Ключ пользователя в постраничном просмотре: (created_at, user_id)"""
+    return to_epoch(user.created_at), user.user_id
 
-        cursor.execute("""
-            INSERT INTO matches (user1_id, user2_id)
-            VALUES (?, ?)
-        """, (user1_id, user2_id))
 
-        conn.commit()
-        result = cursor.rowcount > 0
-        conn.close()
-        return result
+def _row_to_user(row) -> User:
+    """Собрать пользователя из строки таблицы users"""
+    return User(
+        user_id=row[0],
+        username=row[1],
+        first_name=row[2],
+        last_name=row[3],
+        bio=row[4],
+        interests=row[5],
+        participation_status=ParticipationStatus(row[6]),
+        is_active=bool(row[7]),
+        created_at=from_epoch(row[8])
+    )
 
-    async def check_recent_match(self, user1_id: int, user2_id: int, days: int = 30) -> bool:
-        """Проверить, были ли пользователи в паре недавно"""
-        await self._ensure_initialized()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+class Database:
+    def __init__(self, db_path: str, pool_size: int = 4,
+                 user_cache_size: int = USER_CACHE_SIZE,
+                 user_cache_ttl: float = USER_CACHE_TTL,
+                 clock: Callable[[], datetime] = datetime.now):
+        self.db_path = db_path
+        # Источник текущего времени; симуляция подставляет виртуальные часы
+        self.clock = clock
+        # Количество соединений-читателей; писатель всегда один
+        self.pool_size = max(1, pool_size)
+        self._user_cache = LRUCache(user_cache_size, ttl=user_cache_ttl)
+        # Поколение записи пользователя: растет при каждом изменении анкеты
+        self._user_generations: Dict[int, int] = {}
+        self._initialized = False
+        self._init_lock: Optional[asyncio.Lock] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._readers: List[aiosqlite.Connection] = []
+        self._reader_pool: Optional[asyncio.Queue] = None
+
+    async def _connect(self) -> aiosqlite.Connection:
+        """Открыть долгоживущее соединение для пула"""
+        connection = aiosqlite.connect(self.db_path)
+        # Поток соединения не должен мешать завершению процесса
+        connection.daemon = True
+        await connection
+        # WAL позволяет читателям работать параллельно с писателем
+        await connection.execute("PRAGMA journal_mode=WAL")
+        await connection.execute("PRAGMA synchronous=NORMAL")
+        await connection.execute("PRAGMA busy_timeout=5000")
+        return connection
 
-        date_threshold = datetime.now() - timedelta(days=days)
+    async def init_db(self):
+        """Инициализация базы данных"""
+        if self._initialized:
+            return
 
-        cursor.execute("""
-            SELECT COUNT(*) FROM matches
-            WHERE ((user1_id = ? AND user2_id = ?) OR (user1_id = ? AND user2_id = ?))
-            AND created_at > ?
-        """, (user1_id, user2_id, user2_id, user1_id, date_threshold.isoformat()))
+        # Блокировки создаются уже внутри работающего event loop
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
 
-        count = cursor.fetchone()[0]
-        conn.close()
+        async with self._init_lock:
+            if self._initialized:
+                return
 
-        return count > 0
+            # Схема создается и обновляется версионированными миграциями;
+            # синхронный sqlite3 запускаем вне event loop
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, apply_migrations, self.db_path)
 
-    async def create_pending_match(self, user_id: int) -> bool:
-        """Создать запись ожидающего подтверждения участника"""
-        await self._ensure_initialized()
+            writer = await self._connect()
+            readers = [await self._connect() for _ in range(self.pool_size)]
+            reader_pool = asyncio.Queue()
+            for reader in readers:
+                reader_pool.put_nowait(reader)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+            self._writer = writer
+            self._write_lock = asyncio.Lock()
+            self._readers = readers
+            self._reader_pool = reader_pool
+            self._initialized = True
 
-        cursor.execute("""
-            INSERT OR REPLACE INTO pending_matches (user_id, confirmed)
-            VALUES (?, NULL)
-        """, (user_id,))
+    async def _ensure_initialized(self):
+        """Убедиться, что база данных инициализирована"""
+        if not self._initialized:
+            await self.init_db()
 
-        conn.commit()
-        result = cursor.rowcount > 0
-        conn.close()
-        return result
+    async def close(self):
+        """Закрыть все соединения пула"""
+        if not self._initialized:
+            return
 
-    async def get_pending_participants(self) -> List[User]:
-        """Получить список участников, ожидающих подтверждения"""
+        self._initialized = False
+        for reader in self._readers:
+            await reader.close()
+        await self._writer.close()
+
+        self._readers = []
+        self._reader_pool = None
+        self._writer = None
+
+    def _timestamp(self, delta: timedelta = timedelta()) -> int:
+        """Метка времени по часам базы со смещением delta"""
+        return to_epoch(self.clock() + delta)
+
+    def _window_start(self, days: int, since: Optional[datetime]) -> int:
+        """Начало окна: since или days дней назад по часам базы"""
+        if since is not None:
+            return to_epoch(since)
+        return self._timestamp(timedelta(days=-days))
+
+    async def set_trace_callback(self, handler):
+        """Передавать обработчику текст каждого SQL-запроса всех соединений пула"""
         await self._ensure_initialized()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT u.* FROM users u
-            JOIN pending_matches pm ON u.user_id = pm.user_id
-            WHERE pm.confirmed IS NULL
-        """)
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        users = []
-        for row in rows:
-            users.append(User(
-                user_id=row[0],
-                username=row[1],
-                first_name=row[2],
-                last_name=row[3],
-                bio=row[4],
-                interests=row[5],
-                participation_status=ParticipationStatus(row[6]),
-                is_active=bool(row[7]),
-                created_at=row[8]
-            ))
-
-        return users
+        for connection in [self._writer] + self._readers:
+            await connection.set_trace_callback(handler)
 
-    async def confirm_pending_participation(self, user_id: int) -> bool:
-        """Подтвердить участие пользователя"""
+    @asynccontextmanager
+    async def _read(self):
+        """Взять соединение-читатель из пула на время запроса"""
         await self._ensure_initialized()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            UPDATE pending_matches
-            SET confirmed = 1
-            WHERE user_id = ?
-        """, (user_id,))
+        connection = await self._reader_pool.get()
+        try:
+            yield connection
+        finally:
+            self._reader_pool.put_nowait(connection)
 
-        conn.commit()
-        result = cursor.rowcount > 0
-        conn.close()
-        return result
-
-    async def decline_pending_participation(self, user_id: int) -> bool:
-        """Отклонить участие пользователя"""
+    @asynccontextmanager
+    async def _write(self):
+        """Эксклюзивный доступ к писателю: одна транзакция на блок"""
         await self._ensure_initialized()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+            await self._writer.commit()
 
-        cursor.execute("""
-            UPDATE pending_matches
-            SET confirmed = 0
-            WHERE user_id = ?
-        """, (user_id,))
+    async def create_or_update_user(self, user: User) -> bool:
+        """Создать или обновить пользователя"""
+        async with self._write() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO users
+                (user_id, username, first_name, last_name, bio, interests,
+                 participation_status, is_active, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    username = excluded.username,
+                    first_name = excluded.first_name,
+                    last_name = excluded.last_name,
+                    bio = excluded.bio,
+                    interests = excluded.interests,
+                    participation_status = excluded.participation_status,
+                    is_active = excluded.is_active
+            """, (
+                user.user_id, user.username, user.first_name, user.last_name,
+                user.bio, user.interests, user.participation_status.value, user.is_active,
+                self._timestamp()
+            ))
+            updated = cursor.rowcount > 0
+            await self._update_user_tags(conn, user.user_id, user.interests)
 
-        conn.commit()
-        result = cursor.rowcount > 0
-        conn.close()
-        return result
+        self._invalidate_user(user.user_id)
+        return updated
 
-    async def get_confirmed_participants(self) -> List[User]:
-        """Получить список подтвердивших участие пользователей"""
-        await self._ensure_initialized()
+    def _invalidate_user(self, user_id: int):
+        """Сбросить анкету в кэше после изменения"""
+        self._user_generations[user_id] = self._user_generations.get(user_id, 0) + 1
+        self._user_cache.pop(user_id)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT u.* FROM users u
-            JOIN pending_matches pm ON u.user_id = pm.user_id
-            WHERE pm.confirmed = 1
-        """)
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        users = []
-        for row in rows:
-            users.append(User(
-                user_id=row[0],
-                username=row[1],
-                first_name=row[2],
-                last_name=row[3],
-                bio=row[4],
-                interests=row[5],
-                participation_status=ParticipationStatus(row[6]),
-                is_active=bool(row[7]),
-                created_at=row[8]
-            ))
+    async def get_user(self, user_id: int) -> Optional[User]:
+        """Получить пользователя по ID"""
+        async with self._read() as conn:
+            async with conn.execute(
+                "SELECT * FROM users WHERE user_id = ?", (user_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
 
-        return users
+        if row:
+            return _row_to_user(row)
+        return None
 
-    async def clear_pending_matches(self) -> bool:
-        """Очистить таблицу ожидающих подтверждения"""
-        await self._ensure_initialized()
+    async def get_cached_user(self, user_id: int) -> Optional[User]:
+        """Получить пользователя через кэш анкет.
+
+        Возвращается копия, поэтому ее можно менять перед
+        create_or_update_user, не портя кэш.
+        """
+        user = self._user_cache.get(user_id)
+        if user is None:
+            generation = self._user_generations.get(user_id, 0)
+            user = await self.get_user(user_id)
+            # Запись, изменившаяся во время чтения, в кэш не попадает:
+            # прочитанная строка могла устареть
+            if self._user_generations.get(user_id, 0) == generation:
+                self._user_cache.set(user_id, _NO_USER if user is None else user)
+        if user is None or user is _NO_USER:
+            return None
+        return dataclasses.replace(user)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    async def delete_user(self, user_id: int) -> bool:
+        """Удалить пользователя"""
+        async with self._write() as conn:
+            cursor = await conn.execute(
+                "DELETE FROM users WHERE user_id = ?", (user_id,)
+            )
+            deleted = cursor.rowcount > 0
+            await conn.execute("DELETE FROM user_tags WHERE user_id = ?", (user_id,))
+
+        self._invalidate_user(user_id)
+        return deleted
+
+    async def _update_user_tags(self, conn, user_id: int, interests: Optional[str]):
+        """Привести теги пользователя в индексе интересов к его анкете"""
+        tags = set(tokenize_interests(interests))
+        async with conn.execute("""
+            SELECT t.name FROM user_tags ut
+            JOIN interest_tags t ON t.id = ut.tag_id
+            WHERE ut.user_id = ?
+        """, (user_id,)) as cursor:
+            current = {row[0] for row in await cursor.fetchall()}
+
+        removed = list(current - tags)
+        added = list(tags - current)
+
+        if removed:
+            placeholders = ", ".join("?" for _ in removed)
+            await conn.execute(f"""
+                DELETE FROM user_tags
+                WHERE user_id = ? AND tag_id IN (
+                    SELECT id FROM interest_tags WHERE name IN ({placeholders})
+                )
+            """, (user_id, *removed))
+
+        if added:
+            await conn.executemany(
+                "INSERT OR IGNORE INTO interest_tags (name) VALUES (?)",
+                [(tag,) for tag in added]
+            )
+            placeholders = ", ".join("?" for _ in added)
+            await conn.execute(f"""
+                INSERT OR IGNORE INTO user_tags (tag_id, user_id)
+                SELECT id, ? FROM interest_tags WHERE name IN ({placeholders})
+            """, (user_id, *added))
+
+    async def rebuild_interest_index(self) -> int:
+        """Перестроить индекс интересов по всем анкетам, вернуть число связей"""
+        async with self._write() as conn:
+            await conn.execute("DELETE FROM user_tags")
+            await conn.execute("DELETE FROM interest_tags")
+
+            async with conn.execute(
+                "SELECT user_id, interests FROM users WHERE interests IS NOT NULL"
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+            tag_ids: Dict[str, int] = {}
+            links = []
+            for user_id, interests in rows:
+                for tag in tokenize_interests(interests):
+                    links.append((tag_ids.setdefault(tag, len(tag_ids) + 1), user_id))
+
+            await conn.executemany(
+                "INSERT INTO interest_tags (id, name) VALUES (?, ?)",
+                [(tag_id, tag) for tag, tag_id in tag_ids.items()]
+            )
+            await conn.executemany(
+                "INSERT INTO user_tags (tag_id, user_id) VALUES (?, ?)", links
+            )
 
-        cursor.execute("DELETE FROM pending_matches")
+        return len(links)
 
-        conn.commit()
-        result = cursor.rowcount >= 0
-        conn.close()
-        return result
+    async def get_tag_postings(self, user_ids: List[int]) -> Dict[int, List[int]]:
+        """Списки участников по тегам: только теги, общие хотя бы для двоих"""
+        postings: Dict[int, List[int]] = {}
+        user_ids = list(dict.fromkeys(user_ids))
 
-    # Админские методы
-    async def get_all_users(self, limit: int = None, offset: int = 0) -> List[User]:
-        """Получить всех пользователей (с пагинацией)"""
-        await self._ensure_initialized()
+        async with self._read() as conn:
+            for start in range(0, len(user_ids), USER_SELECT_CHUNK):
+                chunk = user_ids[start:start + USER_SELECT_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                async with conn.execute(
+                    f"SELECT tag_id, user_id FROM user_tags WHERE user_id IN ({placeholders})",
+                    chunk
+                ) as cursor:
+                    for tag_id, user_id in await cursor.fetchall():
+                        postings.setdefault(tag_id, []).append(user_id)
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        query = "SELECT * FROM users ORDER BY created_at DESC"
-        params = ()
-
-        if limit is not None:
-            query += " LIMIT ? OFFSET ?"
-            params = (limit, offset)
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        conn.close()
-
-        users = []
-        for row in rows:
-            users.append(User(
-                user_id=row[0],
-                username=row[1],
-                first_name=row[2],
-                last_name=row[3],
-                bio=row[4],
-                interests=row[5],
-                participation_status=ParticipationStatus(row[6]),
-                is_active=bool(row[7]),
-                created_at=row[8]
-            ))
+        return {
+            tag_id: members for tag_id, members in postings.items()
+            if len(members) > 1
+        }
 
-        return users
+    async def load_participants(self, session_id: Optional[int] = None,
+                                with_tags: bool = False,
+                                batch_size: int = PARTICIPANT_FETCH_SIZE) -> ParticipantArrays:
+        """Загрузить участников мэтчинга в компактные массивы.
+
+        С session_id — участники сессии (снимок "всегда" и подтвердившие),
+        кроме уже получивших встречу в этой сессии (повтор прерванной
+        фазы 2); без него — все "всегда" и подтвердившие в активных
+        сессиях. Строки читаются порциями по batch_size, анкеты не
+        загружаются.
+        """
+        if session_id is not None:
+            participants_sql = """
+                SELECT sp.user_id, u.participation_status
+                FROM session_participants sp
+                JOIN users u ON u.user_id = sp.user_id
+                WHERE sp.session_id = ? AND sp.confirmed = 1 AND u.is_active = 1
+                  AND sp.user_id NOT IN (
+                      SELECT mm.user_id FROM matches m
+                      JOIN match_members mm ON mm.match_id = m.id
+                      WHERE m.session_id = ?
+                  )
+            """
+            params = (session_id, session_id)
+        else:
+            participants_sql = f"""
+                SELECT user_id, participation_status FROM users
+                WHERE is_active = 1 AND participation_status = ?
+                UNION
+                SELECT u.user_id, u.participation_status
+                FROM session_participants sp
+                JOIN users u ON u.user_id = sp.user_id
+                WHERE sp.session_id IN ({_ACTIVE_SESSIONS_SQL})
+                  AND sp.source = 'ask' AND sp.confirmed = 1
+            """
+            params = (ParticipationStatus.ALWAYS.value,)
+
+        user_ids = array('q')
+        status_codes = array('b')
+        async with self._read() as conn:
+            async with conn.execute(
+                f"SELECT * FROM ({participants_sql}) ORDER BY 1", params
+            ) as cursor:
+                while rows := await cursor.fetchmany(batch_size):
+                    for user_id, status in rows:
+                        user_ids.append(user_id)
+                        status_codes.append(_STATUS_CODES[status])
+
+            if not with_tags:
+                return ParticipantArrays(user_ids, status_codes)
+
+            # Теги идут в том же порядке ID; у участника без тегов
+            # начало и конец его отрезка совпадают
+            tag_offsets = array('q', [0])
+            tag_ids = array('q')
+            index = 0
+            async with conn.execute(f"""
+                SELECT p.user_id, ut.tag_id
+                FROM ({participants_sql}) p
+                JOIN user_tags ut ON ut.user_id = p.user_id
+                ORDER BY p.user_id
+            """, params) as cursor:
+                while rows := await cursor.fetchmany(batch_size):
+                    for user_id, tag_id in rows:
+                        while user_ids[index] != user_id:
+                            tag_offsets.append(len(tag_ids))
+                            index += 1
+                        tag_ids.append(tag_id)
+
+        while len(tag_offsets) <= len(user_ids):
+            tag_offsets.append(len(tag_ids))
+        return ParticipantArrays(user_ids, status_codes, tag_offsets, tag_ids)
 
-    async def get_users_count(self) -> int:
-        """Получить общее количество пользователей"""
-        await self._ensure_initialized()
+    async def get_participants(self) -> List[User]:
+        """Получить всех активных участников"""
+        async with self._read() as conn:
+            async with conn.execute("""
+                SELECT * FROM users
+                WHERE is_active = 1 AND participation_status IN ('always', 'ask_each_time')
+            """) as cursor:
+                rows = await cursor.fetchall()
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        return [_row_to_user(row) for row in rows]
 
-        cursor.execute("SELECT COUNT(*) FROM users")
-        count = cursor.fetchone()[0]
-        conn.close()
+    # Новые методы для мэтчинга
+    async def get_users_by_participation_status(self, status: ParticipationStatus) -> List[User]:
+        """Получить пользователей по статусу участия"""
+        async with self._read() as conn:
+            async with conn.execute("""
+                SELECT * FROM users
+                WHERE is_active = 1 AND participation_status = ?
+            """, (status.value,)) as cursor:
+                rows = await cursor.fetchall()
 
-        return count
+        return [_row_to_user(row) for row in rows]
 
-    async def get_matching_statistics(self) -> dict:
-        """Получить статистику мэтчинга"""
-        await self._ensure_initialized()
+    async def create_match(self, user1_id: int, user2_id: int) -> bool:
+        """Создать пару пользователей"""
+        async with self._write() as conn:
+            match_ids = await self._insert_matches(conn, [(user1_id, user2_id)])
+            return len(match_ids) == 1
+
+    async def create_matches_bulk(self, groups: List[Tuple[int, ...]]) -> List[int]:
+        """Создать все встречи сессии (пары и тройки) одной транзакцией и вернуть их ID"""
+        if not groups:
+            return []
+
+        async with self._write() as conn:
+            return await self._insert_matches(conn, groups)
+
+    async def _insert_matches(self, conn, groups: List[Tuple[int, ...]],
+                              session_id: Optional[int] = None) -> List[int]:
+        """Вставить встречи многострочными INSERT; ID возвращаются в порядке groups.
+
+        В matches записываются первые два участника, полный состав
+        встречи — в match_members; pair_history обновляет триггер.
+        """
+        ids_by_pair = {}
+        created_at = self._timestamp()
+
+        for start in range(0, len(groups), MATCH_INSERT_CHUNK):
+            chunk = groups[start:start + MATCH_INSERT_CHUNK]
+            placeholders = ", ".join("(?, ?, ?, ?)" for _ in chunk)
+            params = [
+                value for group in chunk
+                for value in (*group[:2], created_at, session_id)
+            ]
+
+            async with conn.execute(f"""
+                INSERT INTO matches (user1_id, user2_id, created_at, session_id)
+                VALUES {placeholders}
+                RETURNING id, user1_id, user2_id
+            """, params) as cursor:
+                for match_id, user1_id, user2_id in await cursor.fetchall():
+                    ids_by_pair[(user1_id, user2_id)] = match_id
+
+        # Порядок строк RETURNING не гарантирован, поэтому сопоставляем по паре
+        match_ids = [ids_by_pair[tuple(group[:2])] for group in groups]
+
+        await conn.executemany("""
+            INSERT INTO match_members (match_id, user_id) VALUES (?, ?)
+        """, [
+            (match_id, user_id)
+            for match_id, group in zip(match_ids, groups)
+            for user_id in group
+        ])
+
+        return match_ids
+
+    async def commit_matching_round(self, groups: List[Tuple[int, ...]],
+                                    no_match_user_ids: List[int],
+                                    session_id: Optional[int] = None) -> List[int]:
+        """Атомарно сохранить итог мэтчинга вместе с outbox уведомлений.
+
+        В одной транзакции создаются встречи (пары и тройки), по строке
+        outbox на каждое уведомление и завершается сессия session_id (без
+        нее — все активные сессии, их участники уже распределены). Если
+        процесс упадет до коммита, не сохранится ничего и фазу 2 можно
+        повторить; после коммита уведомления дошлет OutboxDrainer.
+        """
+        match_ids, _ = await self.save_matching_batch(
+            groups, no_match_user_ids, session_id, complete=True
+        )
+        return match_ids
+
+    async def save_matching_batch(self, groups: List[Tuple[int, ...]],
+                                  no_match_user_ids: List[int] = (),
+                                  session_id: Optional[int] = None,
+                                  complete: bool = False) -> Tuple[List[int], List[dict]]:
+        """Сохранить порцию итога мэтчинга вместе с ее строками outbox.
+
+        Встречи помечаются сессией, поэтому после падения посреди фазы 2
+        load_participants не вернет уже распределенных участников. С
+        complete=True в той же транзакции завершается сессия. Возвращает
+        ID встреч в порядке groups и созданные строки outbox в формате
+        get_pending_outbox.
+        """
+        async with self._write() as conn:
+            match_ids = (
+                await self._insert_matches(conn, groups, session_id) if groups else []
+            )
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+            messages = []
+            for group, match_id in zip(groups, match_ids):
+                for user_id in group:
+                    partner_ids = [other for other in group if other != user_id]
+                    messages.append((user_id, 'match',
+                                     {'partner_ids': partner_ids, 'match_id': match_id}))
+            for user_id in no_match_user_ids:
+                messages.append((user_id, 'no_match', {}))
+
+            outbox_rows = await self._insert_outbox(conn, messages)
+
+            if complete:
+                condition, params = _session_filter("id", session_id)
+                await conn.execute(f"""
+                    UPDATE matching_sessions
+                    SET status = 'completed', completed_at = ?
+                    WHERE {condition}
+                """, (self._timestamp(),) + params)
+
+        return match_ids, outbox_rows
+
+    async def _insert_outbox(self, conn, messages: List[Tuple[int, str, dict]]) -> List[dict]:
+        """Вставить строки outbox многострочными INSERT, вернуть их по порядку id.
+
+        Получатель встречается в раунде один раз, поэтому ID строк
+        сопоставляются по chat_id, а payload не читается обратно.
+        """
+        ids_by_chat = {}
+        created_at = self._timestamp()
+
+        for start in range(0, len(messages), MATCH_INSERT_CHUNK):
+            chunk = messages[start:start + MATCH_INSERT_CHUNK]
+            placeholders = ", ".join("(?, ?, ?, ?)" for _ in chunk)
+            params = [
+                value for chat_id, kind, payload in chunk
+                for value in (chat_id, kind, json.dumps(payload), created_at)
+            ]
+
+            async with conn.execute(f"""
+                INSERT INTO notification_outbox (chat_id, kind, payload, created_at)
+                VALUES {placeholders}
+                RETURNING id, chat_id
+            """, params) as cursor:
+                ids_by_chat.update((chat_id, outbox_id)
+                                   for outbox_id, chat_id in await cursor.fetchall())
+
+        rows = [
+            {
+                'id': ids_by_chat[chat_id],
+                'chat_id': chat_id,
+                'kind': kind,
+                'payload': payload,
+                'attempts': 0
+            }
+            for chat_id, kind, payload in messages
+        ]
+        # Порядок строк RETURNING не гарантирован
+        rows.sort(key=lambda row: row['id'])
+        return rows
+
+    async def get_pending_outbox(self, limit: int = 100, after_id: int = 0) -> List[dict]:
+        """Получить неотправленные сообщения outbox по порядку"""
+        async with self._read() as conn:
+            async with conn.execute("""
+                SELECT id, chat_id, kind, payload, attempts
+                FROM notification_outbox
+                WHERE status = 'pending' AND id > ?
+                ORDER BY id
+                LIMIT ?
+            """, (after_id, limit)) as cursor:
+                rows = await cursor.fetchall()
+
+        return [
+            {
+                'id': row[0],
+                'chat_id': row[1],
+                'kind': row[2],
+                'payload': json.loads(row[3]),
+                'attempts': row[4]
+            }
+            for row in rows
+        ]
+
+    async def mark_outbox_sent(self, outbox_ids: List[int]) -> int:
+        """Отметить сообщения outbox доставленными"""
+        if not outbox_ids:
+            return 0
+
+        sent_at = self._timestamp()
+        async with self._write() as conn:
+            cursor = await conn.executemany("""
+                UPDATE notification_outbox
+                SET status = 'sent', sent_at = ?
+                WHERE id = ? AND status = 'pending'
+            """, [(sent_at, outbox_id) for outbox_id in outbox_ids])
+            return cursor.rowcount
+
+    async def mark_outbox_failed(self, outbox_ids: List[int], max_attempts: int = 3) -> int:
+        """Учесть неудачную попытку; после max_attempts сообщение не повторяется"""
+        if not outbox_ids:
+            return 0
+
+        async with self._write() as conn:
+            cursor = await conn.executemany("""
+                UPDATE notification_outbox
+                SET attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE status END
+                WHERE id = ? AND status = 'pending'
+            """, [(max_attempts, outbox_id) for outbox_id in outbox_ids])
+            return cursor.rowcount
+
+    async def mark_outbox_undeliverable(self, rows: List[Tuple[int, str]]) -> int:
+        """Сразу отказаться от сообщений, которые не доставить никогда.
+
+        rows — пары (ID строки outbox, причина); причина сохраняется в error.
+        """
+        if not rows:
+            return 0
+
+        async with self._write() as conn:
+            cursor = await conn.executemany("""
+                UPDATE notification_outbox
+                SET status = 'failed', error = ?
+                WHERE id = ? AND status = 'pending'
+            """, [(reason, outbox_id) for outbox_id, reason in rows])
+            return cursor.rowcount
+
+    async def get_users_by_ids(self, user_ids: List[int]) -> Dict[int, User]:
+        """Получить пользователей по списку ID"""
+        users: Dict[int, User] = {}
+        user_ids = list(dict.fromkeys(user_ids))
+
+        async with self._read() as conn:
+            for start in range(0, len(user_ids), USER_SELECT_CHUNK):
+                chunk = user_ids[start:start + USER_SELECT_CHUNK]
+                placeholders = ", ".join("?" for _ in chunk)
+                async with conn.execute(
+                    f"SELECT * FROM users WHERE user_id IN ({placeholders})", chunk
+                ) as cursor:
+                    for row in await cursor.fetchall():
+                        users[row[0]] = _row_to_user(row)
 
-        # Общее количество мэтчей
-        cursor.execute("SELECT COUNT(*) FROM matches")
-        total_matches = cursor.fetchone()[0]
+        return users
 
-        # Количество мэтчей за последние 30 дней
-        cursor.execute("""
-            SELECT COUNT(*) FROM matches
-            WHERE created_at >= datetime('now', '-30 days')
-        """)
-        recent_matches = cursor.fetchone()[0]
+    async def get_fsm_state(self, key: str) -> Optional[Tuple[Optional[str], dict, int]]:
+        """Получить состояние FSM, данные и время обновления по ключу"""
+        async with self._read() as conn:
+            async with conn.execute("""
+                SELECT state, data, updated_at FROM fsm_states WHERE key = ?
+            """, (key,)) as cursor:
+                row = await cursor.fetchone()
+
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2]
+
+    async def save_fsm_states(self, records: List[Tuple[str, Optional[str], dict, int]]) -> int:
+        """Сохранить пачку состояний FSM одной транзакцией.
+
+        Пустые записи (без состояния и данных) удаляются.
+        """
+        if not records:
+            return 0
+
+        upserts = []
+        deletes = []
+        for key, state, data, updated_at in records:
+            if state is None and not data:
+                deletes.append((key,))
+            else:
+                upserts.append((key, state, json.dumps(data), updated_at))
+
+        async with self._write() as conn:
+            if upserts:
+                await conn.executemany("""
+                    INSERT INTO fsm_states (key, state, data, updated_at)
+                    VALUES (?, ?, ?, ?)
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = excluded.state,
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                """, upserts)
+            if deletes:
+                await conn.executemany("DELETE FROM fsm_states WHERE key = ?", deletes)
+
+        return len(records)
+
+    async def purge_fsm_states(self, older_than: int) -> int:
+        """Удалить состояния FSM, не обновлявшиеся с момента older_than"""
+        async with self._write() as conn:
+            cursor = await conn.execute("""
+                DELETE FROM fsm_states WHERE updated_at < ?
+            """, (older_than,))
+            return cursor.rowcount
+
+    async def check_recent_match(self, user1_id: int, user2_id: int, days: int = 30,
+                                 since: Optional[datetime] = None) -> bool:
+        """Проверить, были ли пользователи в паре недавно (после since)"""
+        date_threshold = self._window_start(days, since)
+
+        async with self._read() as conn:
+            async with conn.execute("""
+                SELECT 1 FROM pair_history
+                WHERE user1_id = ? AND user2_id = ? AND last_met_at > ?
+            """, (min(user1_id, user2_id), max(user1_id, user2_id),
+                  date_threshold)) as cursor:
+                row = await cursor.fetchone()
+
+        return row is not None
+
+    async def get_recent_pairs(self, days: int = 30,
+                               since: Optional[datetime] = None) -> List[Tuple[int, int]]:
+        """Получить все пары участников встреч за последние days дней (после since).
+
+        Тройка дает три пары: каждый из ее участников встречался с двумя другими.
+        Каждая пара возвращается один раз как (меньший ID, больший ID).
+        """
+        date_threshold = self._window_start(days, since)
+
+        async with self._read() as conn:
+            async with conn.execute("""
+                SELECT user1_id, user2_id FROM pair_history
+                WHERE last_met_at > ?
+            """, (date_threshold,)) as cursor:
+                return await cursor.fetchall()
+
+    async def _current_session_id(self, conn) -> Optional[int]:
+        """ID последней активной сессии"""
+        async with conn.execute(f"""
+            {_ACTIVE_SESSIONS_SQL}
+            ORDER BY started_at DESC, id DESC
+            LIMIT 1
+        """) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def create_pending_match(self, user_id: int,
+                                   session_id: Optional[int] = None) -> bool:
+        """Создать запись ожидающего подтверждения участника.
+
+        Без session_id участник добавляется в текущую активную сессию;
+        если активной сессии нет, это ошибка вызывающего кода.
+        """
+        async with self._write() as conn:
+            if session_id is None:
+                session_id = await self._current_session_id(conn)
+            if session_id is None:
+                raise ValueError(
+                    f"Нет активной сессии мэтчинга для участника {user_id}"
+                )
+
+            cursor = await conn.execute("""
+                INSERT INTO session_participants
+                    (session_id, user_id, source, confirmed, invited_at)
+                VALUES (?, ?, 'ask', NULL, ?)
+                ON CONFLICT (session_id, user_id) DO UPDATE SET
+                    source = 'ask',
+                    confirmed = NULL,
+                    invited_at = excluded.invited_at,
+                    responded_at = NULL
+            """, (session_id, user_id, self._timestamp()))
+            return cursor.rowcount > 0
+
+    async def create_pending_matches(self, session_id: int,
+                                     status: ParticipationStatus = ParticipationStatus.ASK_EACH_TIME) -> int:
+        """Запросить подтверждение у всех активных пользователей со статусом status.
+
+        Записи создаются одним INSERT ... SELECT без загрузки анкет;
+        возвращается число созданных запросов.
+        """
+        async with self._write() as conn:
+            cursor = await conn.execute("""
+                INSERT INTO session_participants
+                    (session_id, user_id, source, confirmed, invited_at)
+                SELECT ?, user_id, 'ask', NULL, ?
+                FROM users
+                WHERE is_active = 1 AND participation_status = ?
+                ON CONFLICT (session_id, user_id) DO NOTHING
+            """, (session_id, self._timestamp(), status.value))
+            return cursor.rowcount
+
+    async def get_pending_participants(self, session_id: Optional[int] = None) -> List[User]:
+        """Получить список участников, ожидающих подтверждения"""
+        condition, params = _session_filter("sp.session_id", session_id)
+        async with self._read() as conn:
+            async with conn.execute(f"""
+                SELECT u.* FROM session_participants sp
+                JOIN users u ON u.user_id = sp.user_id
+                WHERE {condition} AND sp.confirmed IS NULL
+            """, params) as cursor:
+                rows = await cursor.fetchall()
+
+        return [_row_to_user(row) for row in rows]
+
+    async def _set_participation(self, user_id: int, confirmed: bool,
+                                 session_id: Optional[int]) -> bool:
+        condition, params = _session_filter("session_id", session_id)
+        async with self._write() as conn:
+            cursor = await conn.execute(f"""
+                UPDATE session_participants
+                SET confirmed = ?, responded_at = ?
+                WHERE user_id = ? AND source = 'ask' AND {condition}
+            """, (int(confirmed), self._timestamp(), user_id) + params)
+            return cursor.rowcount > 0
+
+    async def confirm_pending_participation(self, user_id: int,
+                                            session_id: Optional[int] = None) -> bool:
+        """Подтвердить участие пользователя"""
+        return await self._set_participation(user_id, True, session_id)
 
-        # Количество пользователей по статусам участия
-        cursor.execute("""
-            SELECT participation_status, COUNT(*) FROM users
-            WHERE is_active = 1
-            GROUP BY participation_status
-        """)
-        participation_stats = dict(cursor.fetchall())
+    async def decline_pending_participation(self, user_id: int,
+                                            session_id: Optional[int] = None) -> bool:
+        """Отклонить участие пользователя"""
+        return await self._set_participation(user_id, False, session_id)
+
+    async def record_participation_responses(self, responses: Dict[int, bool],
+                                             session_id: Optional[int] = None) -> int:
+        """Записать ответы многих участников одной транзакцией"""
+        if not responses:
+            return 0
+
+        condition, params = _session_filter("session_id", session_id)
+        responded_at = self._timestamp()
+        async with self._write() as conn:
+            cursor = await conn.executemany(f"""
+                UPDATE session_participants
+                SET confirmed = ?, responded_at = ?
+                WHERE user_id = ? AND source = 'ask' AND {condition}
+            """, [
+                (int(confirmed), responded_at, user_id) + params
+                for user_id, confirmed in responses.items()
+            ])
+            return cursor.rowcount
+
+    async def get_confirmed_participants(self, session_id: Optional[int] = None) -> List[User]:
+        """Получить список подтвердивших участие пользователей"""
+        condition, params = _session_filter("sp.session_id", session_id)
+        async with self._read() as conn:
+            async with conn.execute(f"""
+                SELECT u.* FROM session_participants sp
+                JOIN users u ON u.user_id = sp.user_id
+                WHERE {condition} AND sp.source = 'ask' AND sp.confirmed = 1
+            """, params) as cursor:
+                rows = await cursor.fetchall()
+
+        return [_row_to_user(row) for row in rows]
+
+    async def get_session_participants(self, session_id: int) -> List[User]:
+        """Все участники сессии: снимок "всегда" и подтвердившие"""
+        async with self._read() as conn:
+            async with conn.execute("""
+                SELECT u.* FROM session_participants sp
+                JOIN users u ON u.user_id = sp.user_id
+                WHERE sp.session_id = ? AND sp.confirmed = 1 AND u.is_active = 1
+            """, (session_id,)) as cursor:
+                rows = await cursor.fetchall()
+
+        return [_row_to_user(row) for row in rows]
+
+    async def clear_pending_matches(self, session_id: Optional[int] = None) -> bool:
+        """Очистить ожидающих подтверждения: завершить активные сессии (или session_id).
+
+        Раньше таблица pending_matches удалялась целиком; теперь участники
+        остаются в истории завершенной сессии, но ни ожидающими, ни
+        подтвердившими больше не считаются. Возвращает True, если была
+        завершена хотя бы одна сессия.
+        """
+        condition, params = _session_filter("id", session_id)
+        async with self._write() as conn:
+            cursor = await conn.execute(f"""
+                UPDATE matching_sessions
+                SET status = 'completed', completed_at = ?
+                WHERE {condition} AND status IN {ACTIVE_SESSION_STATUSES}
+            """, (self._timestamp(),) + params)
+            return cursor.rowcount > 0
 
-        # Количество активных пользователей
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = 1")
-        active_users = cursor.fetchone()[0]
+    # Админские методы
+    async def get_users_page(self, limit: int, after: Optional[Tuple[int, int]] = None,
+                             before: Optional[Tuple[int, int]] = None) -> List[User]:
+        """Получить страницу пользователей, новые сначала.
+
+        Страницы отсчитываются по ключу (created_at, user_id) крайнего
+        пользователя соседней страницы (user_page_key), поэтому любая
+        страница стоит столько же, сколько первая, а удаление опорного
+        пользователя не сбивает курсор.
+        """
+        if after is not None:
+            query = """
+                SELECT * FROM users
+                WHERE (created_at, user_id) < (?, ?)
+                ORDER BY created_at DESC, user_id DESC
+                LIMIT ?
+            """
+            params = tuple(after) + (limit,)
+        elif before is not None:
+            # Идем назад по возрастанию ключа и разворачиваем результат
+            query = """
+                SELECT * FROM users
+                WHERE (created_at, user_id) > (?, ?)
+                ORDER BY created_at ASC, user_id ASC
+                LIMIT ?
+            """
+            params = tuple(before) + (limit,)
+        else:
+            query = """
+                SELECT * FROM users
+                ORDER BY created_at DESC, user_id DESC
+                LIMIT ?
+            """
+            params = (limit,)
+
+        async with self._read() as conn:
+            async with conn.execute(query, params) as cursor:
+                rows = await cursor.fetchall()
+
+        users = [_row_to_user(row) for row in rows]
+        if before is not None and after is None:
+            users.reverse()
+        return users
 
-        # Количество пользователей, ожидающих подтверждения
-        cursor.execute("SELECT COUNT(*) FROM pending_matches WHERE confirmed IS NULL")
-        pending_users = cursor.fetchone()[0]
+    async def get_users_count(self) -> int:
+        """Получить общее количество пользователей (счетчик на триггерах)"""
+        async with self._read() as conn:
+            async with conn.execute(
+                "SELECT value FROM stats_counters WHERE name = 'total_users'"
+            ) as cursor:
+                row = await cursor.fetchone()
 
-        # Количество подтвердивших участие
-        cursor.execute("SELECT COUNT(*) FROM pending_matches WHERE confirmed = 1")
-        confirmed_users = cursor.fetchone()[0]
+        return row[0] if row else 0
 
-        conn.close()
+    async def get_matching_statistics(self) -> dict:
+        """Получить статистику мэтчинга.
+
+        Счетчики поддерживаются триггерами, поэтому это одно чтение
+        независимо от объема истории.
+        """
+        async with self._read() as conn:
+            async with conn.execute("""
+                SELECT name, value FROM stats_counters
+                UNION ALL
+                SELECT 'recent_matches', COALESCE(SUM(count), 0)
+                FROM match_counts_daily
+                WHERE day >= date(?, 'unixepoch')
+            """, (self._timestamp(timedelta(days=-30)),)) as cursor:
+                counters = dict(await cursor.fetchall())
+
+        participation_stats = {
+            name[len('status:'):]: value
+            for name, value in counters.items()
+            if name.startswith('status:') and value > 0
+        }
 
         return {
-            'total_matches': total_matches,
-            'recent_matches': recent_matches,
+            'total_matches': counters.get('total_matches', 0),
+            'recent_matches': counters.get('recent_matches', 0),
             'participation_stats': participation_stats,
-            'active_users': active_users,
-            'pending_users': pending_users,
-            'confirmed_users': confirmed_users
+            'active_users': counters.get('active_users', 0),
+            'pending_users': counters.get('pending:waiting', 0),
+            'confirmed_users': counters.get('pending:confirmed', 0)
         }
 
+    async def rebuild_statistics(self):
+        """Пересчитать счетчики статистики полным проходом по таблицам"""
+        async with self._write() as conn:
+            for statement in STATS_REBUILD_SQL:
+                await conn.execute(statement)
+
     # Методы для работы с обратной связью о встречах
     async def record_meeting_feedback(self, match_id: int, user_id: int, feedback: str) -> bool:
         """Записать обратную связь о встрече"""
-        await self._ensure_initialized()
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Проверяем, что пользователь участвует в этом матче
-        cursor.execute("""
-            SELECT id FROM matches
-            WHERE id = ? AND (user1_id = ? OR user2_id = ?)
-        """, (match_id, user_id, user_id))
-
-        match = cursor.fetchone()
-        if not match:
-            conn.close()
-            return False
-
-        # Записываем обратную связь
-        cursor.execute("""
-            UPDATE matches
-            SET meeting_feedback = ?
-            WHERE id = ?
-        """, (feedback, match_id))
-
-        conn.commit()
-        result = cursor.rowcount > 0
-        conn.close()
-        return result
-
-    async def get_user_recent_matches(self, user_id: int, days: int = 7) -> List[dict]:
+        async with self._write() as conn:
+            # Проверяем, что пользователь участвует в этом матче
+            async with conn.execute("""
+                SELECT 1 FROM match_members
+                WHERE match_id = ? AND user_id = ?
+            """, (match_id, user_id)) as cursor:
+                match = await cursor.fetchone()
+
+            if not match:
+                return False
+
+            # Записываем обратную связь
+            cursor = await conn.execute("""
+                UPDATE matches
+                SET meeting_feedback = ?
+                WHERE id = ?
+            """, (feedback, match_id))
+            return cursor.rowcount > 0
+
+    async def record_meetings_feedback(self, entries: List[Tuple[int, int, str]]) -> int:
+        """Записать обратную связь (match_id, user_id, feedback) одной транзакцией.
+
+        Как и в record_meeting_feedback, учитываются только ответы
+        участников встречи.
+        """
+        if not entries:
+            return 0
+
+        async with self._write() as conn:
+            cursor = await conn.executemany("""
+                UPDATE matches
+                SET meeting_feedback = ?
+                WHERE id = ? AND EXISTS (
+                    SELECT 1 FROM match_members
+                    WHERE match_id = matches.id AND user_id = ?
+                )
+            """, [(feedback, match_id, user_id) for match_id, user_id, feedback in entries])
+            return cursor.rowcount
+
+    async def get_user_recent_matches(self, user_id: int, days: int = 7,
+                                      since: Optional[datetime] = None) -> List[dict]:
         """Получить недавние матчи пользователя для отправки обратной связи"""
-        await self._ensure_initialized()
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        date_threshold = datetime.now() - timedelta(days=days)
-
-        cursor.execute("""
-            SELECT m.id, m.user1_id, m.user2_id, m.created_at, m.meeting_feedback,
-                   u1.first_name as user1_name, u1.last_name as user1_lastname,
-                   u2.first_name as user2_name, u2.last_name as user2_lastname
-            FROM matches m
-            JOIN users u1 ON m.user1_id = u1.user_id
-            JOIN users u2 ON m.user2_id = u2.user_id
-            WHERE (m.user1_id = ? OR m.user2_id = ?)
-            AND m.created_at >= ?
-            AND m.meeting_feedback IS NULL
-            ORDER BY m.created_at DESC
-        """, (user_id, user_id, date_threshold.isoformat()))
-
-        rows = cursor.fetchall()
-        conn.close()
-
-        matches = []
-        for row in rows:
-            partner_name = (
-                f"{row[5]} {row[6] or ''}".strip() if user_id == row[2]
-                else f"{row[7]} {row[8] or ''}".strip()
-            )
-            matches.append({
+        date_threshold = self._window_start(days, since)
+
+        async with self._read() as conn:
+            # Партнеры — все остальные участники встречи (в тройке их двое)
+            async with conn.execute("""
+                SELECT m.id, m.created_at, m.meeting_feedback,
+                       group_concat(TRIM(u.first_name || ' ' || COALESCE(u.last_name, '')), ', ')
+                FROM match_members me
+                JOIN matches m ON m.id = me.match_id
+                JOIN match_members other ON other.match_id = m.id AND other.user_id != me.user_id
+                JOIN users u ON u.user_id = other.user_id
+                WHERE me.user_id = ?
+                AND m.created_at >= ?
+                AND m.meeting_feedback IS NULL
+                GROUP BY m.id
+                ORDER BY m.created_at DESC
+            """, (user_id, date_threshold)) as cursor:
+                rows = await cursor.fetchall()
+
+        return [
+            {
                 'match_id': row[0],
-                'partner_name': partner_name,
-                'created_at': row[3],
-                'feedback': row[4]
-            })
-
-        return matches
+                'partner_name': row[3],
+                'created_at': from_epoch(row[1]),
+                'feedback': row[2]
+            }
+            for row in rows
+        ]
 
     # Методы для работы с сессиями матчинга
     async def create_matching_session(self, deadline_hours: int = 24) -> int:
-        """Создать новую сессию матчинга"""
-        await self._ensure_initialized()
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        deadline = datetime.now() + timedelta(hours=deadline_hours)
-
-        cursor.execute("""
-            INSERT INTO matching_sessions (deadline)
-            VALUES (?)
-        """, (deadline.isoformat(),))
-
+        """Создать новую сессию матчинга и снимок ее участников "всегда" на старте"""
+        async with self._write() as conn:
+            return await self._insert_session(conn, deadline_hours)
+
+    async def _insert_session(self, conn, deadline_hours: int) -> int:
+        started_at = self._timestamp()
+        cursor = await conn.execute("""
+            INSERT INTO matching_sessions (started_at, deadline)
+            VALUES (?, ?)
+        """, (started_at, self._timestamp(timedelta(hours=deadline_hours))))
         session_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+
+        # Участники "всегда" фиксируются на старте одним запросом,
+        # фаза 2 читает их вместе с подтвердившими из диапазона сессии
+        await conn.execute("""
+            INSERT INTO session_participants
+                (session_id, user_id, source, confirmed, invited_at)
+            SELECT ?, user_id, 'always', 1, ?
+            FROM users
+            WHERE is_active = 1 AND participation_status = ?
+        """, (session_id, started_at, ParticipationStatus.ALWAYS.value))
         return session_id
 
     async def get_current_matching_session(self) -> Optional[dict]:
         """Получить текущую активную сессию матчинга"""
-        await self._ensure_initialized()
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("""
-            SELECT id, status, started_at, deadline, completed_at, forced_completion
-            FROM matching_sessions
-            WHERE status IN ('collecting', 'pairing')
-            ORDER BY started_at DESC
-            LIMIT 1
-        """)
-
-        row = cursor.fetchone()
-        conn.close()
+        async with self._read() as conn:
+            async with conn.execute(f"""
+                SELECT id, status, started_at, deadline, completed_at, forced_completion
+                FROM matching_sessions
+                WHERE status IN {ACTIVE_SESSION_STATUSES}
+                ORDER BY started_at DESC, id DESC
+                LIMIT 1
+            """) as cursor:
+                row = await cursor.fetchone()
 
         if row:
             return {
                 'id': row[0],
                 'status': row[1],
-                'started_at': row[2],
-                'deadline': row[3],
-                'completed_at': row[4],
+                'started_at': from_epoch(row[2]),
+                'deadline': from_epoch(row[3]),
+                'completed_at': from_epoch(row[4]),
                 'forced_completion': bool(row[5])
             }
         return None
 
     async def update_matching_session_status(self, session_id: int, status: str, forced: bool = False) -> bool:
         """Обновить статус сессии матчинга"""
-        await self._ensure_initialized()
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        if status == 'completed':
-            cursor.execute("""
-                UPDATE matching_sessions
-                SET status = ?, completed_at = CURRENT_TIMESTAMP, forced_completion = ?
-                WHERE id = ?
-            """, (status, forced, session_id))
-        else:
-            cursor.execute("""
-                UPDATE matching_sessions
-                SET status = ?
-                WHERE id = ?
-            """, (status, session_id))
-
-        conn.commit()
-        result = cursor.rowcount > 0
-        conn.close()
-        return result
+        async with self._write() as conn:
+            if status == 'completed':
+                cursor = await conn.execute("""
+                    UPDATE matching_sessions
+                    SET status = ?, completed_at = ?, forced_completion = ?
+                    WHERE id = ?
+                """, (status, self._timestamp(), forced, session_id))
+            else:
+                cursor = await conn.execute("""
+                    UPDATE matching_sessions
+                    SET status = ?
+                    WHERE id = ?
+                """, (status, session_id))
+            return cursor.rowcount > 0
 
     async def force_complete_matching_session(self) -> bool:
         """Принудительно завершить текущую сессию матчинга"""
@@ -0,0 +1,163 @@
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Telegram позволяет боту около 30 сообщений в секунду суммарно
+# и примерно одно сообщение в секунду в один чат
+GLOBAL_RATE_LIMIT = 30.0
+PER_CHAT_INTERVAL = 1.0
+
+
+class TokenBucket:
+    """Ведро токенов: не больше rate операций в секунду, всплеск до capacity"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated_at: Optional[float] = None
+        self._paused_until = 0.0
+
+    def _refill(self, now: float):
+        if self._updated_at is not None:
+            elapsed = now - self._updated_at
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    async def acquire(self):
+        """Дождаться и забрать один токен"""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            if now < self._paused_until:
+                await asyncio.sleep(self._paused_until - now)
+                continue
+
+            self._refill(now)
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Приостановить выдачу токенов (например, после RetryAfter)"""
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+        self._tokens = 0
+
+
+class NotificationDispatcher:
+    """Параллельная рассылка сообщений с соблюдением лимитов Telegram.
+
+    Сообщения ставятся в очередь через enqueue, их отправляют
+    concurrency воркеров. Общий темп ограничен ведром токенов,
+    сообщения в один чат разнесены минимум на per_chat_interval секунд,
+    а TelegramRetryAfter приостанавливает всю рассылку на указанное время
+    и сообщение отправляется повторно.
+    """
+
+    def __init__(self, bot, concurrency: int = 16,
+                 rate: float = GLOBAL_RATE_LIMIT,
+                 per_chat_interval: float = PER_CHAT_INTERVAL,
+                 max_retries: int = 3):
+        self.bot = bot
+        self.concurrency = max(1, concurrency)
+        self.per_chat_interval = per_chat_interval
+        self.max_retries = max_retries
+        self.sent = 0
+        self.failed = 0
+        self._bucket = TokenBucket(rate)
+        self._chat_next_send: Dict[int, float] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers = []
+
+    def _ensure_started(self):
+        """Запустить воркеры при первой постановке в очередь"""
+        if self._workers:
+            return
+
+        self._queue = asyncio.Queue()
+        self._workers = [
+            asyncio.create_task(self._worker())
+            for _ in range(self.concurrency)
+        ]
+
+    def enqueue(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Поставить сообщение в очередь; future вернет True после доставки"""
+        self._ensure_started()
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((chat_id, text, kwargs, future))
+        return future
+
+    async def join(self):
+        """Дождаться отправки всех поставленных в очередь сообщений"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """Дослать очередь и остановить воркеры"""
+        if not self._workers:
+            return
+
+        await self.join()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+    async def _worker(self):
+        while True:
+            chat_id, text, kwargs, future = await self._queue.get()
+            try:
+                delivered = await self._deliver(chat_id, text, kwargs)
+                if delivered:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                if not future.done():
+                    future.set_result(delivered)
+            finally:
+                self._queue.task_done()
+
+    async def _wait_for_chat(self, chat_id: int):
+        """Выдержать интервал между сообщениями в один чат"""
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        send_at = max(now, self._chat_next_send.get(chat_id, now))
+        self._chat_next_send[chat_id] = send_at + self.per_chat_interval
+
+        # Не даем словарю расти бесконечно на больших рассылках
+        if len(self._chat_next_send) > 10000:
+            self._chat_next_send = {
+                key: value for key, value in self._chat_next_send.items()
+                if value > now
+            }
+
+        if send_at > now:
+            await asyncio.sleep(send_at - now)
+
+    async def _deliver(self, chat_id: int, text: str, kwargs: dict) -> bool:
+        for _ in range(self.max_retries + 1):
+            await self._wait_for_chat(chat_id)
+            await self._bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return True
+            except TelegramRetryAfter as e:
+                logger.warning(f"Превышен лимит Telegram, пауза {e.retry_after} с "
+                               f"(чат {chat_id})")
+                self._bucket.pause(e.retry_after)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сообщения пользователю {chat_id}: {e}")
+                return False
+
+        logger.error(f"Сообщение пользователю {chat_id} не отправлено: "
+                     f"исчерпаны повторы после RetryAfter")
+        return False
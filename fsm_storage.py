@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from typing import Any, Callable, Dict, NamedTuple, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from cache import LRUCache
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Незавершенная анкета хранится неделю, потом считается брошенной
+STATE_TTL = 7 * 24 * 3600
+
+
+class _Record(NamedTuple):
+    state: Optional[str]
+    data: Dict[str, Any]
+    updated_at: int
+
+
+_EMPTY = _Record(None, {}, 0)
+
+
+class SQLiteStorage(BaseStorage):
+    """Хранилище состояний FSM aiogram в таблице fsm_states.
+
+    Чтения обслуживаются из LRU-кэша ограниченного размера, записи сразу
+    попадают в кэш и копятся в буфере, который сбрасывается в базу одной
+    транзакцией раз в flush_interval секунд или при накоплении
+    flush_batch изменений. Состояния, не обновлявшиеся дольше state_ttl,
+    считаются устаревшими и периодически удаляются из базы.
+    """
+
+    def __init__(self, database: Database, cache_size: int = 10000,
+                 state_ttl: int = STATE_TTL, flush_interval: float = 1.0,
+                 flush_batch: int = 500, purge_interval: float = 3600.0,
+                 clock: Callable[[], float] = time.time):
+        self.db = database
+        self.state_ttl = state_ttl
+        self.flush_interval = flush_interval
+        self.flush_batch = max(1, flush_batch)
+        self.purge_interval = purge_interval
+        self._clock = clock
+        self._cache = LRUCache(cache_size)
+        # Изменения, еще не записанные в базу, и записываемые прямо сейчас
+        self._dirty: Dict[str, _Record] = {}
+        self._flushing: Dict[str, _Record] = {}
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(key: StorageKey) -> str:
+        """Строковый ключ строки fsm_states"""
+        return (f"{key.bot_id}:{key.chat_id}:{key.user_id}:"
+                f"{key.thread_id or ''}:{key.destiny}")
+
+    def _is_stale(self, record: _Record) -> bool:
+        return self._clock() - record.updated_at > self.state_ttl
+
+    async def _load(self, key: str) -> _Record:
+        """Текущая запись: из буфера, кэша или базы"""
+        record = self._dirty.get(key) or self._flushing.get(key) or self._cache.get(key)
+        if record is None:
+            row = await self.db.get_fsm_state(key)
+            record = _EMPTY if row is None else _Record(*row)
+            self._cache.set(key, record)
+
+        if record is not _EMPTY and self._is_stale(record):
+            return _EMPTY
+        return record
+
+    async def _store(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        record = _Record(state, data, int(self._clock()))
+        self._cache.set(key, record)
+        self._dirty[key] = record
+
+        if len(self._dirty) >= self.flush_batch:
+            await self.flush()
+        else:
+            self._ensure_started()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        if isinstance(state, State):
+            state = state.state
+        record = await self._load(self._key(key))
+        await self._store(self._key(key), state, record.data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(self._key(key))).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._load(self._key(key))
+        await self._store(self._key(key), record.state, dict(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._load(self._key(key))).data)
+
+    async def flush(self) -> int:
+        """Записать накопленные изменения в базу, вернуть их количество"""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            self._flushing, self._dirty = self._dirty, {}
+            try:
+                await self.db.save_fsm_states([
+                    (key, record.state, record.data, record.updated_at)
+                    for key, record in self._flushing.items()
+                ])
+            except Exception:
+                # Вернем изменения в буфер, не затирая более свежие
+                for key, record in self._flushing.items():
+                    self._dirty.setdefault(key, record)
+                raise
+            finally:
+                flushed = len(self._flushing)
+                self._flushing = {}
+
+            return flushed
+
+    async def purge(self) -> int:
+        """Удалить из базы устаревшие состояния"""
+        return await self.db.purge_fsm_states(int(self._clock()) - self.state_ttl)
+
+    def _ensure_started(self):
+        """Запустить фоновый сброс при первой записи"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if self._clock() - last_purge >= self.purge_interval:
+                    purged = await self.purge()
+                    if purged:
+                        logger.info(f"Удалено устаревших состояний FSM: {purged}")
+                    last_purge = self._clock()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении состояний FSM: {e}")
+
+    async def close(self) -> None:
+        """Остановить фоновый сброс и записать оставшиеся изменения"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -12,7 +12,7 @@ from keyboards import (
     get_force_complete_confirmation
 )
 from models import ParticipationStatus
-from database import Database
+from database import Database, user_page_key
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -65,29 +65,50 @@ async def admin_users_callback(callback: CallbackQuery, db: Database):
     await _show_users_page(callback, db, page=0)
 
 
-@router.callback_query(F.data.startswith("users_page_"))
+@router.callback_query(F.data.startswith("users_next_") | F.data.startswith("users_prev_"))
 async def users_page_callback(callback: CallbackQuery, db: Database):
     """Обработчик пагинации списка пользователей"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
 
-    page = int(callback.data.split("_")[-1])
-    await _show_users_page(callback, db, page)
+    # users_next_<страница>_<created_at>_<ID> последнего на странице
+    # или users_prev_<страница>_<created_at>_<ID> первого
+    _, direction, page, created_at, user_id = callback.data.split("_")
+    key = (int(created_at), int(user_id))
+    if direction == "next":
+        await _show_users_page(callback, db, int(page), after=key)
+    else:
+        await _show_users_page(callback, db, int(page), before=key)
+
+
+@router.callback_query(F.data.startswith("users_page_"))
+async def legacy_users_page_callback(callback: CallbackQuery, db: Database):
+    """Кнопки users_page_<страница> из сообщений до перехода на курсоры"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+
+    # По номеру страницы курсор не восстановить — показываем первую
+    await _show_users_page(callback, db, page=0,
+                           notice="Список устарел, показана первая страница")
 
 
-async def _show_users_page(callback: CallbackQuery, db, page: int = 0):
+async def _show_users_page(callback: CallbackQuery, db, page: int = 0,
+                           after: tuple = None, before: tuple = None,
+                           notice: str = None):
     """Показать страницу со списком пользователей"""
     page_size = 10
-    offset = page * page_size
 
     try:
-        users = await db.get_all_users(limit=page_size, offset=offset)
+        users = await db.get_users_page(page_size, after=after, before=before)
         total_users = await db.get_users_count()
 
-        if not users and page > 0:
-            # Если страница пустая, переходим на первую страницу
-            await _show_users_page(callback, db, page=0)
+        # Дальше никого не осталось или назад дошли до начала списка —
+        # показываем первую страницу
+        reached_start = before is not None and len(users) < page_size
+        if page > 0 and (not users or reached_start):
+            await _show_users_page(callback, db, page=0, notice=notice)
             return
 
         text = f"👥 <b>Список пользователей</b> (всего: {total_users})\n\n"
@@ -95,7 +116,7 @@ async def _show_users_page(callback: CallbackQuery, db, page: int = 0):
         if not users:
             text += "📭 Пользователей пока нет"
         else:
-            for i, user in enumerate(users, start=offset + 1):
+            for i, user in enumerate(users, start=1):
                 status_emoji = {
                     ParticipationStatus.ALWAYS: "✅",
                     ParticipationStatus.ASK_EACH_TIME: "❓",
@@ -113,7 +134,8 @@ async def _show_users_page(callback: CallbackQuery, db, page: int = 0):
                 active_text = "✅" if user.is_active else "❌"
 
                 created_date = (
-                    user.created_at[:10] if user.created_at else 'неизвестно'
+                    user.created_at.strftime('%Y-%m-%d') if user.created_at
+                    else 'неизвестно'
                 )
 
                 text += (
@@ -126,7 +148,11 @@ async def _show_users_page(callback: CallbackQuery, db, page: int = 0):
 
         await callback.message.edit_text(
             text,
-            reply_markup=get_users_list_keyboard(total_users, page, page_size),
+            reply_markup=get_users_list_keyboard(
+                total_users, page, page_size,
+                first_key=user_page_key(users[0]) if users else None,
+                last_key=user_page_key(users[-1]) if users else None
+            ),
             parse_mode="HTML"
         )
 
@@ -137,7 +163,7 @@ async def _show_users_page(callback: CallbackQuery, db, page: int = 0):
             reply_markup=get_back_to_admin()
         )
 
-    await callback.answer()
+    await callback.answer(notice)
 
 
 @router.callback_query(F.data == "admin_stats")
@@ -266,7 +292,7 @@ async def admin_force_complete_callback(callback: CallbackQuery, db: Database):
         await callback.message.edit_text(
             f"⚠️ Принудительное завершение матчинга\n\n"
             f"Текущий статус: Сбор участников\n"
-            f"Дедлайн: {session['deadline'][:16]}\n\n"
+            f"Дедлайн: {session['deadline']:%Y-%m-%d %H:%M}\n\n"
             f"Вы уверены, что хотите завершить матчинг принудительно? "
             f"Это создаст пары из уже подтвердивших участие пользователей.",
             reply_markup=get_force_complete_confirmation()
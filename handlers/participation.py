@@ -1,16 +1,16 @@
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import CallbackQuery
 
 from database import Database
-from models import ParticipationStatus
+from models import ParticipationStatus, User
 from keyboards import get_participation_menu, get_main_menu
 
 router = Router()
 
 @router.callback_query(F.data == "participation_menu")
-async def participation_menu(callback: CallbackQuery, db: Database):
-    user = await db.get_user(callback.from_user.id)
-
+async def participation_menu(callback: CallbackQuery, user: Optional[User]):
     if not user:
         await callback.answer("❌ Сначала создайте анкету", show_alert=True)
         return
@@ -29,9 +29,8 @@ async def participation_menu(callback: CallbackQuery, db: Database):
     )
 
 @router.callback_query(F.data.startswith("participation_"))
-async def change_participation(callback: CallbackQuery, db: Database):
-    user = await db.get_user(callback.from_user.id)
-
+async def change_participation(callback: CallbackQuery, db: Database,
+                               user: Optional[User]):
     if not user:
         await callback.answer("❌ Сначала создайте анкету", show_alert=True)
         return
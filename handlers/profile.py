@@ -1,3 +1,5 @@
+from typing import Optional
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
@@ -35,9 +37,7 @@ async def profile_menu(callback: CallbackQuery):
 
 
 @router.callback_query(F.data == "view_profile")
-async def view_profile(callback: CallbackQuery, db: Database):
-    user = await db.get_user(callback.from_user.id)
-
+async def view_profile(callback: CallbackQuery, user: Optional[User]):
     if not user:
         await callback.answer("❌ У вас нет анкеты", show_alert=True)
         return
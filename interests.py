@@ -0,0 +1,158 @@
+"""
+Векторное сходство анкет по интересам.
+
+Интересы и "о себе" разбиваются на токены, из них строится разреженная
+матрица TF-IDF с нормированными строками, а косинусная близость
+считается пакетным умножением матриц только для top-k соседей каждого
+участника. Нужны numpy и scipy (requirements-weighted.txt); без них
+модуль импортируется, но build_term_matrix и top_k_neighbours недоступны.
+"""
+
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # pragma: no cover - зависит от окружения
+    np = None
+    sparse = None
+
+HAS_NUMPY = np is not None
+
+# Грубый стемминг: "программирование" и "программист" дают один токен
+STEM_LENGTH = 6
+MIN_TOKEN_LENGTH = 2
+# Интересы говорят о человеке больше, чем свободный текст "о себе"
+INTERESTS_WEIGHT = 2
+BIO_WEIGHT = 1
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+_STOP_WORDS = frozenset({
+    "и", "в", "во", "на", "с", "со", "по", "за", "из", "от", "до", "для",
+    "не", "но", "а", "или", "как", "что", "это", "мне", "меня", "люблю",
+    "очень", "все", "всё", "так", "же", "бы", "то",
+    "the", "and", "of", "in", "on", "for", "to", "with", "my", "love",
+})
+
+
+def require_numpy():
+    """Проверить, что установлены numpy и scipy"""
+    if not HAS_NUMPY:
+        raise ImportError(
+            "Для взвешенного мэтчинга по интересам (MATCHING_STRATEGY=weighted) "
+            "нужны numpy и scipy: pip install -r requirements-weighted.txt"
+        )
+
+
+def tokenize_interests(text: Optional[str]) -> List[str]:
+    """Разбить текст на нормализованные токены (без повторов, по порядку)"""
+    if not text:
+        return []
+
+    tokens = []
+    for word in _TOKEN_RE.findall(text.lower()):
+        if len(word) < MIN_TOKEN_LENGTH or word.isdigit() or word in _STOP_WORDS:
+            continue
+        tokens.append(word[:STEM_LENGTH])
+    return list(dict.fromkeys(tokens))
+
+
+def profile_terms(interests: Optional[str], bio: Optional[str]) -> Counter:
+    """Веса токенов анкеты: интересы весомее, чем текст о себе"""
+    terms = Counter()
+    for token in tokenize_interests(interests):
+        terms[token] += INTERESTS_WEIGHT
+    for token in tokenize_interests(bio):
+        terms[token] += BIO_WEIGHT
+    return terms
+
+
+def build_term_matrix(documents: Sequence[Counter]):
+    """Разреженная матрица TF-IDF (документы x токены) с L2-нормой строк"""
+    require_numpy()
+
+    vocabulary: Dict[str, int] = {}
+    indptr = [0]
+    indices: List[int] = []
+    data: List[float] = []
+    for terms in documents:
+        for token, weight in terms.items():
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+            data.append(weight)
+        indptr.append(len(indices))
+
+    matrix = sparse.csr_matrix(
+        (np.asarray(data, dtype=np.float32), np.asarray(indices, dtype=np.int32),
+         np.asarray(indptr, dtype=np.int64)),
+        shape=(len(documents), len(vocabulary))
+    )
+
+    # Редкие общие интересы значат больше популярных
+    document_frequency = np.bincount(matrix.indices, minlength=len(vocabulary))
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+    matrix = matrix.multiply(idf.astype(np.float32)).tocsr()
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.diags(1 / norms.astype(np.float32)) @ matrix
+
+
+def top_k_neighbours(matrix, k: int = 10, window: Optional[int] = None,
+                     seed: Optional[int] = None) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """Top-k самых похожих по косинусу соседей каждой строки.
+
+    Кандидаты берутся из списков участников каждого токена: список
+    случайно перемешивается, и каждый участник становится кандидатом
+    для window следующих за ним. Для редких токенов это все пары,
+    для популярных — линейная по размеру списка выборка, поэтому
+    кандидатов O(nnz · window), а не O(n²). Затем сходство кандидатов
+    считается точно, и у каждой строки остаются k лучших. Возвращает
+    массивы (строка, столбец, вес) неупорядоченных пар без повторов.
+    """
+    require_numpy()
+
+    n = matrix.shape[0]
+    window = window or k
+    rng = np.random.default_rng(seed)
+
+    # Элементы матрицы, сгруппированные по токену в случайном порядке
+    entries = matrix.tocoo()
+    order = np.argsort(entries.col + rng.random(entries.nnz))
+    terms = entries.col[order]
+    users = entries.row[order].astype(np.int64)
+
+    lows, highs = [], []
+    for shift in range(1, window + 1):
+        same_term = terms[:-shift] == terms[shift:]
+        first = users[:-shift][same_term]
+        second = users[shift:][same_term]
+        lows.append(np.minimum(first, second))
+        highs.append(np.maximum(first, second))
+
+    low = np.concatenate(lows) if lows else np.empty(0, dtype=np.int64)
+    high = np.concatenate(highs) if highs else np.empty(0, dtype=np.int64)
+    _, unique = np.unique(low * n + high, return_index=True)
+    low, high = low[unique], high[unique]
+
+    # Точное косинусное сходство кандидатов (строки уже нормированы)
+    weights = np.asarray(matrix[low].multiply(matrix[high]).sum(axis=1)).ravel()
+
+    # Оставляем k лучших соседей каждой строки: сортируем ребра обоих
+    # направлений по строке и убыванию веса (вес в [0, 1] не выводит
+    # ключ за пределы строки) и берем первые k
+    row = np.concatenate([low, high])
+    col = np.concatenate([high, low])
+    data = np.concatenate([weights, weights])
+    order = np.argsort(row - 0.5 * np.clip(data, 0, 1))
+    row, col, data = row[order], col[order], data[order]
+    rank = np.arange(len(row)) - np.searchsorted(row, row)
+    keep = rank < k
+    row, col, data = row[keep], col[keep], data[keep]
+
+    # Пара может попасть в top-k обоих участников — оставляем одну
+    low = np.minimum(row, col)
+    high = np.maximum(row, col)
+    _, unique = np.unique(low * n + high, return_index=True)
+    return low[unique], high[unique], data[unique].astype(np.float32)
@@ -1,3 +1,5 @@
+from typing import Optional, Tuple
+
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
@@ -127,9 +129,16 @@ def get_admin_menu() -> InlineKeyboardMarkup:
 
 
 def get_users_list_keyboard(
-    users_count: int, page: int = 0, page_size: int = 10
+    users_count: int, page: int = 0, page_size: int = 10,
+    first_key: Optional[Tuple[int, int]] = None,
+    last_key: Optional[Tuple[int, int]] = None
 ) -> InlineKeyboardMarkup:
-    """Клавиатура для списка пользователей с пагинацией"""
+    """Клавиатура для списка пользователей с пагинацией.
+
+    В callback_data кнопок навигации передается номер страницы и ключ
+    (created_at, user_id) крайнего пользователя текущей страницы —
+    курсор для следующего запроса.
+    """
     builder = InlineKeyboardBuilder()
 
     # Кнопки навигации по страницам
@@ -137,10 +146,10 @@ def get_users_list_keyboard(
 
     if total_pages > 1:
         nav_buttons = []
-        if page > 0:
+        if page > 0 and first_key is not None:
             nav_buttons.append(InlineKeyboardButton(
                 text="⬅️ Назад",
-                callback_data=f"users_page_{page-1}"
+                callback_data=f"users_prev_{page-1}_{first_key[0]}_{first_key[1]}"
             ))
 
         nav_buttons.append(InlineKeyboardButton(
@@ -148,10 +157,10 @@ def get_users_list_keyboard(
             callback_data="current_page"
         ))
 
-        if page < total_pages - 1:
+        if page < total_pages - 1 and last_key is not None:
             nav_buttons.append(InlineKeyboardButton(
                 text="Вперед ➡️",
-                callback_data=f"users_page_{page+1}"
+                callback_data=f"users_next_{page+1}_{last_key[0]}_{last_key[1]}"
             ))
 
         if nav_buttons:
@@ -222,30 +231,24 @@ def get_meeting_feedback_keyboard(match_id: int) -> InlineKeyboardMarkup:
     return builder.as_markup()
 
 
-def get_match_with_feedback_keyboard(
-    partner_name: str, match_id: int
-) -> InlineKeyboardMarkup:
-    """Клавиатура с анкетой партнера и кнопкой обратной связи"""
-    builder = InlineKeyboardBuilder()
-    builder.row(
-        InlineKeyboardButton(
+def get_match_with_feedback_keyboard(match_id: int) -> InlineKeyboardMarkup:
+    """Клавиатура обратной связи к сообщению о встрече"""
+    # Строится на каждую встречу рассылки, поэтому без
+    # InlineKeyboardBuilder: он глубоко копирует кнопки при сборке
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(
             text="✅ Мы встретились",
             callback_data=f"feedback_met_{match_id}"
-        )
-    )
-    builder.row(
-        InlineKeyboardButton(
+        )],
+        [InlineKeyboardButton(
             text="❌ Встреча не состоялась",
             callback_data=f"feedback_not_met_{match_id}"
-        )
-    )
-    builder.row(
-        InlineKeyboardButton(
+        )],
+        [InlineKeyboardButton(
             text="📅 Напомнить позже",
             callback_data=f"feedback_later_{match_id}"
-        )
-    )
-    return builder.as_markup()
+        )],
+    ])
 
 
 def get_force_complete_confirmation() -> InlineKeyboardMarkup:
@@ -1,132 +1,792 @@
 import random
 import logging
-from typing import List, Tuple, Set
+import time
+from collections import deque
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Set
 
-from models import User, ParticipationStatus
-from database import Database
+from models import User
+from database import Database, ParticipantArrays
 
 logger = logging.getLogger(__name__)
 
+# Период блокировки повторных пар по умолчанию (в днях)
+RECENT_MATCH_DAYS = 30
+
+_PAIR_KEY_MASK = (1 << 64) - 1
+
 
 class MatchingResult:
-    """Результат матчинга"""
-    def __init__(self):
-        self.matches: List[Tuple[User, User]] = []
-        self.unmatched_users: List[User] = []
-        self.users_with_recent_matches: List[User] = []
+    """Результат матчинга в ID пользователей.
+
+    Анкеты участников (profiles) есть, только если мэтчинг запускался
+    по списку User; тогда matches, triads, unmatched_users и
+    users_with_recent_matches отдают те же группы анкетами. Без анкет
+    эти свойства бросают ValueError — нужны pairs, triples и списки ID.
+    """
+    def __init__(self, profiles: Optional[Dict[int, User]] = None):
+        self.pairs: List[Tuple[int, int]] = []
+        # ID записей в таблице matches, в том же порядке, что и pairs
+        self.match_ids: List[int] = []
+        self.unmatched_ids: List[int] = []
+        self.conflicted_ids: List[int] = []
+        # Группы из трех человек и их ID в таблице matches
+        self.triples: List[Tuple[int, int, int]] = []
+        self.triad_ids: List[int] = []
+        self.profiles: Dict[int, User] = profiles or {}
+
+    def _users(self, user_ids: Iterable[int]) -> tuple:
+        try:
+            return tuple(self.profiles[user_id] for user_id in user_ids)
+        except KeyError as error:
+            raise ValueError(
+                f"Нет анкеты участника {error.args[0]}: результат собран по ID, "
+                f"используйте pairs, triples, unmatched_ids и conflicted_ids"
+            ) from None
+
+    @property
+    def matches(self) -> List[Tuple[User, User]]:
+        return [self._users(pair) for pair in self.pairs]
+
+    @property
+    def triads(self) -> List[Tuple[User, User, User]]:
+        return [self._users(triple) for triple in self.triples]
+
+    @property
+    def unmatched_users(self) -> List[User]:
+        return list(self._users(self.unmatched_ids))
+
+    @property
+    def users_with_recent_matches(self) -> List[User]:
+        return list(self._users(self.conflicted_ids))
+
+
+class RecentPairIndex:
+    """Индекс недавних пар: ключ — неупорядоченная пара пользователей"""
+
+    def __init__(self, pairs: Iterable[Tuple[int, int]] = ()):
+        # Пара (a, b) упаковывается в одно целое число: так меньше памяти,
+        # чем на кортежи, и проверка остается O(1)
+        self._keys: Set[int] = set()
+        for user1_id, user2_id in pairs:
+            self.add(user1_id, user2_id)
+
+    @staticmethod
+    def _key(user1_id: int, user2_id: int) -> int:
+        if user1_id > user2_id:
+            user1_id, user2_id = user2_id, user1_id
+        return (user1_id << 64) | user2_id
+
+    def add(self, user1_id: int, user2_id: int):
+        """Добавить пару в индекс"""
+        self._keys.add(self._key(user1_id, user2_id))
+
+    def contains(self, user1_id: int, user2_id: int) -> bool:
+        """Проверить, встречалась ли пара недавно"""
+        return self._key(user1_id, user2_id) in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def pairs(self) -> Iterable[Tuple[int, int]]:
+        """Перебрать пары индекса в виде (меньший ID, больший ID)"""
+        for key in self._keys:
+            yield key >> 64, key & _PAIR_KEY_MASK
+
+    def neighbours(self, user_ids: Iterable[int]) -> Dict[int, Set[int]]:
+        """Недавние партнеры каждого из user_ids внутри этого же множества"""
+        members = set(user_ids)
+        result: Dict[int, Set[int]] = {}
+        for user1_id, user2_id in self.pairs():
+            if user1_id in members and user2_id in members:
+                result.setdefault(user1_id, set()).add(user2_id)
+                result.setdefault(user2_id, set()).add(user1_id)
+        return result
+
+
+class PairingOutcome(NamedTuple):
+    """Результат работы стратегии: пары и оставшиеся без пары ID"""
+    pairs: List[Tuple[int, int]]
+    # Пары не нашлось просто потому, что участников не хватило
+    unmatched: List[int]
+    # Пары не нашлось из-за недавних встреч с доступными участниками
+    conflicted: List[int]
+
+
+class RandomPairingStrategy:
+    """Исходный алгоритм: соседи в перемешанном списке образуют пару.
+
+    Пары, оказавшиеся недавними, затем чинит локальный поиск: обмен
+    партнерами с другой парой (2-swap), циклический обмен между тремя
+    парами (3-swap) и передача партнера участнику, оставшемуся без
+    пары. Поиск ограничен max_swaps попытками и repair_time_budget
+    секундами; счетчики попыток и удачных обменов — в stats.
+    """
+
+    name = "random"
+
+    def __init__(self, rng=None, repair: bool = True, max_swaps: int = 20000,
+                 repair_time_budget: float = 0.5, tries_per_pair: int = 16):
+        self.rng = rng or random
+        self.repair = repair
+        self.max_swaps = max_swaps
+        self.repair_time_budget = repair_time_budget
+        self.tries_per_pair = tries_per_pair
+        self.stats: Dict[str, int] = {}
+
+    def pair(self, user_ids: List[int], recent: RecentPairIndex,
+             profiles: Optional[Dict[int, User]] = None) -> PairingOutcome:
+        shuffled = list(user_ids)
+        self.rng.shuffle(shuffled)
+
+        pairs = []
+        broken = []
+        for i in range(0, len(shuffled) - 1, 2):
+            user1_id, user2_id = shuffled[i], shuffled[i + 1]
+            if recent.contains(user1_id, user2_id):
+                broken.append((user1_id, user2_id))
+            else:
+                pairs.append((user1_id, user2_id))
+
+        leftover = shuffled[-1] if len(shuffled) % 2 == 1 else None
+
+        self.stats = {'conflicts': len(broken), 'attempted': 0, 'succeeded': 0}
+        if self.repair and broken:
+            broken, leftover = self._repair(pairs, broken, leftover, recent)
+
+        # Пользователи недавно были в паре — оба остаются без пары
+        conflicted = [user_id for pair in broken for user_id in pair]
+        unmatched = [leftover] if leftover is not None else []
+        return PairingOutcome(pairs, unmatched, conflicted)
+
+    def _repair(self, pairs: List[Tuple[int, int]], broken: List[Tuple[int, int]],
+                leftover: Optional[int], recent: RecentPairIndex):
+        """Локальный поиск: разбить недавние пары обменами с другими парами"""
+        deadline = time.perf_counter() + self.repair_time_budget
+        stats = self.stats
+        unresolved = []
+
+        def allowed(user1_id: int, user2_id: int) -> bool:
+            return not recent.contains(user1_id, user2_id)
+
+        while broken:
+            if stats['attempted'] >= self.max_swaps or time.perf_counter() > deadline:
+                unresolved.extend(broken)
+                break
+
+            a, b = broken.pop()
+            fixed = False
+
+            # Участник без пары забирает одного из конфликтующих
+            if leftover is not None:
+                stats['attempted'] += 1
+                if allowed(leftover, a):
+                    pairs.append((leftover, a))
+                    leftover, fixed = b, True
+                elif allowed(leftover, b):
+                    pairs.append((leftover, b))
+                    leftover, fixed = a, True
+
+            # 2-swap с другой конфликтующей парой: чинит сразу обе
+            for index in range(len(broken)):
+                if fixed:
+                    break
+                c, d = broken[index]
+                stats['attempted'] += 1
+                for first, second in (((a, c), (b, d)), ((a, d), (b, c))):
+                    if allowed(*first) and allowed(*second):
+                        broken.pop(index)
+                        pairs.extend([first, second])
+                        fixed = True
+                        break
+
+            for _ in range(self.tries_per_pair):
+                if fixed or not pairs:
+                    break
+                stats['attempted'] += 1
+
+                # 2-swap со случайной здоровой парой
+                index = self.rng.randrange(len(pairs))
+                c, d = pairs[index]
+                for first, second in (((a, c), (b, d)), ((a, d), (b, c))):
+                    if allowed(*first) and allowed(*second):
+                        pairs[index] = first
+                        pairs.append(second)
+                        fixed = True
+                        break
+                if fixed or len(pairs) < 2:
+                    continue
+
+                # 3-swap: a, b и две здоровые пары образуют три новые
+                other = self.rng.randrange(len(pairs))
+                if other == index:
+                    continue
+                e, f = pairs[other]
+                stats['attempted'] += 1
+                for new_pairs in (((a, c), (b, e), (d, f)),
+                                  ((a, e), (b, c), (d, f)),
+                                  ((a, d), (b, f), (c, e))):
+                    if all(allowed(*new_pair) for new_pair in new_pairs):
+                        pairs[index], pairs[other] = new_pairs[0], new_pairs[1]
+                        pairs.append(new_pairs[2])
+                        fixed = True
+                        break
+
+            if fixed:
+                stats['succeeded'] += 1
+            else:
+                unresolved.append((a, b))
+
+        return unresolved, leftover
+
+
+class MaximumMatchingStrategy:
+    """Максимальное паросочетание в графе совместимости участников.
+
+    Ребро есть между любыми двумя участниками, кроме недавних пар.
+    Сначала строится случайное жадное паросочетание, затем из каждого
+    оставшегося без пары ищется увеличивающий путь (алгоритм Эдмондса
+    со сжатием цветков) при любом числе участников. Без пары остается
+    только тот, кого нельзя добавить, не оставив без пары другого.
+    """
+
+    name = "maximum"
+
+    def __init__(self, rng=None):
+        self.rng = rng or random
+
+    def pair(self, user_ids: List[int], recent: RecentPairIndex,
+             profiles: Optional[Dict[int, User]] = None) -> PairingOutcome:
+        ids = list(dict.fromkeys(user_ids))
+        self.rng.shuffle(ids)
+        excluded = recent.neighbours(ids)
+
+        mate = greedy_matching(ids, excluded)
+        free = [user_id for user_id in ids if user_id not in mate]
+        if len(free) > 1:
+            free = _augment(len(ids), free, mate, excluded)
+
+        pairs = []
+        for user_id in ids:
+            partner_id = mate.get(user_id)
+            if partner_id is not None and user_id < partner_id:
+                pairs.append((user_id, partner_id))
+        self.rng.shuffle(pairs)
+
+        unmatched = [user_id for user_id in free if not excluded.get(user_id)]
+        conflicted = [user_id for user_id in free if excluded.get(user_id)]
+        return PairingOutcome(pairs, unmatched, conflicted)
+
+def greedy_matching(ids: List[int], excluded: Dict[int, Set[int]]) -> Dict[int, int]:
+    """Жадное паросочетание в порядке ids за O(n · число недавних партнеров).
+
+    Возвращает партнера каждого сматченного участника; порядок ids
+    задает вызывающий (перемешивание делает результат случайным).
+    """
+    mate: Dict[int, int] = {}
+    waiting: List[int] = []
+    empty: Set[int] = set()
+
+    for user_id in ids:
+        blocked = excluded.get(user_id, empty)
+        # Среди ожидающих не больше len(blocked) несовместимых,
+        # поэтому просмотр с конца короткий
+        for index in range(len(waiting) - 1, -1, -1):
+            if waiting[index] not in blocked:
+                partner_id = waiting.pop(index)
+                mate[user_id] = partner_id
+                mate[partner_id] = user_id
+                break
+        else:
+            waiting.append(user_id)
+
+    return mate
+
+
+def _augment(n: int, free: List[int], mate: Dict[int, int],
+             excluded: Dict[int, Set[int]]) -> List[int]:
+    """Пройти увеличивающие пути из свободных вершин, вернуть оставшихся свободными.
+
+    Вершина, из которой пути нет, не получит его и после других
+    увеличений, поэтому каждая свободная вершина проверяется один раз.
+    """
+    empty: Set[int] = set()
+    free_set = set(free)
+
+    for root in free:
+        # Несовместимому со всеми искать нечего
+        if root not in free_set or len(excluded.get(root, empty)) >= n - 1:
+            continue
+        end, parent = _find_augmenting_path(root, mate, free_set, excluded)
+        if end is None:
+            continue
+
+        # Разворачиваем найденный путь
+        free_set.discard(root)
+        free_set.discard(end)
+        vertex = end
+        while vertex is not None:
+            previous = parent[vertex]
+            next_vertex = mate.get(previous)
+            mate[vertex] = previous
+            mate[previous] = vertex
+            vertex = next_vertex
+
+    return [user_id for user_id in free if user_id in free_set]
+
+
+def _find_augmenting_path(root: int, mate: Dict[int, int], free_set: Set[int],
+                          excluded: Dict[int, Set[int]]):
+    """Поиск увеличивающего пути из свободной вершины root со сжатием цветков.
+
+    Граф — дополнение к разреженному графу недавних пар, поэтому ребра
+    не перебираются: вершина сравнивается только с теми, кто еще вне
+    дерева, и с основаниями других цветков, а несовместимых у каждой
+    единицы. Новая внешняя вершина сразу проверяется на соседство со
+    свободными, так что короткий путь находится без обхода всего графа.
+    Возвращает конец пути (или None) и ссылки parent для его разворота.
+    """
+    empty: Set[int] = set()
+    parent: Dict[int, int] = {}
+    base: Dict[int, int] = {}
+    # Вершины цветка по его основанию; вершина вне цветков — сама себе основание
+    members: Dict[int, List[int]] = {}
+    outer = {root}
+    outer_bases = {root}
+    unlabelled = set(mate)
+    queue = deque()
+
+    def free_neighbour(vertex: int) -> Optional[int]:
+        blocked = excluded.get(vertex, empty)
+        for other in free_set:
+            if other != root and other not in blocked:
+                parent[other] = vertex
+                return other
+        return None
+
+    def add_outer(vertex: int) -> Optional[int]:
+        outer.add(vertex)
+        queue.append(vertex)
+        return free_neighbour(vertex)
+
+    def lowest_common_ancestor(a: int, b: int) -> int:
+        seen = set()
+        while True:
+            a = base.get(a, a)
+            seen.add(a)
+            if a not in mate:
+                break
+            a = parent[mate[a]]
+        while True:
+            b = base.get(b, b)
+            if b in seen:
+                return b
+            b = parent[mate[b]]
+
+    def mark_path(vertex: int, blossom_base: int, child: int, blossom: Set[int]):
+        while base.get(vertex, vertex) != blossom_base:
+            blossom.add(base.get(vertex, vertex))
+            blossom.add(base.get(mate[vertex], mate[vertex]))
+            parent[vertex] = child
+            child = mate[vertex]
+            vertex = parent[mate[vertex]]
+
+    def contract(vertex: int, other: int) -> Optional[int]:
+        # Нечетный цикл — сжимаем цветок в его основание
+        blossom_base = lowest_common_ancestor(vertex, other)
+        blossom: Set[int] = set()
+        mark_path(vertex, blossom_base, other, blossom)
+        mark_path(other, blossom_base, vertex, blossom)
+        blossom.discard(blossom_base)
+
+        merged = members.setdefault(blossom_base, [blossom_base])
+        for old_base in blossom:
+            outer_bases.discard(old_base)
+            for member in members.pop(old_base, (old_base,)):
+                base[member] = blossom_base
+                merged.append(member)
+                if member not in outer:
+                    end = add_outer(member)
+                    if end is not None:
+                        return end
+        return None
+
+    end = add_outer(root)
+    while end is None and queue:
+        vertex = queue.popleft()
+        blocked = excluded.get(vertex, empty)
+
+        # Пара вне дерева: ее участник становится внутренней вершиной,
+        # партнер — внешней
+        for other in tuple(unlabelled):
+            if other in blocked or other not in unlabelled:
+                continue
+            partner = mate[other]
+            parent[other] = vertex
+            unlabelled.discard(other)
+            unlabelled.discard(partner)
+            outer_bases.add(partner)
+            end = add_outer(partner)
+            if end is not None:
+                return end, parent
+
+        # Ребро между внешними вершинами разных цветков
+        for other_base in tuple(outer_bases):
+            if other_base not in outer_bases or other_base == base.get(vertex, vertex):
+                continue
+            for other in members.get(other_base, (other_base,)):
+                if other not in blocked:
+                    end = contract(vertex, other)
+                    break
+            if end is not None:
+                break
+
+    return end, parent
+
+
+class WeightedMatchingStrategy:
+    """Пары по сходству интересов (требует numpy и scipy).
+
+    Для каждого участника ищутся top_k самых похожих по TF-IDF анкетам
+    кандидатов, затем жадно берутся ребра по убыванию веса — это
+    половинное приближение паросочетания максимального веса. Участники
+    без подходящих кандидатов (пустые анкеты, только недавние партнеры)
+    добираются стратегией fallback. Время этапов последнего запуска
+    сохраняется в timings.
+    """
+
+    name = "weighted"
+    # Сходство считается по текстам анкет
+    needs_profiles = True
+
+    def __init__(self, rng=None, top_k: int = 10, fallback=None):
+        from interests import require_numpy
+        require_numpy()
+
+        self.rng = rng or random
+        self.top_k = top_k
+        self.fallback = fallback or MaximumMatchingStrategy(self.rng)
+        self.timings: Dict[str, float] = {}
+
+    def pair(self, user_ids: List[int], recent: RecentPairIndex,
+             profiles: Optional[Dict[int, User]] = None) -> PairingOutcome:
+        if not profiles:
+            return self.fallback.pair(user_ids, recent)
+
+        import numpy as np
+        from interests import build_term_matrix, profile_terms, top_k_neighbours
+
+        self.timings = {}
+        stage_started = time.perf_counter()
+
+        def stage(name: str):
+            nonlocal stage_started
+            now = time.perf_counter()
+            self.timings[name] = now - stage_started
+            stage_started = now
+
+        ids = list(dict.fromkeys(user_ids))
+        self.rng.shuffle(ids)
+        documents = [
+            profile_terms(profiles[user_id].interests, profiles[user_id].bio)
+            for user_id in ids
+        ]
+        stage('tokenize')
+
+        matrix = build_term_matrix(documents)
+        stage('term_matrix')
+
+        rows, cols, weights = top_k_neighbours(
+            matrix, self.top_k, seed=self.rng.getrandbits(32)
+        )
+        stage('top_k')
+
+        order = np.argsort(-weights, kind='stable')
+        matched = [False] * len(ids)
+        pairs = []
+        for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+            if matched[row] or matched[col]:
+                continue
+            user1_id, user2_id = ids[row], ids[col]
+            if recent.contains(user1_id, user2_id):
+                continue
+            matched[row] = matched[col] = True
+            pairs.append((user1_id, user2_id))
+        stage('greedy')
+
+        rest = [user_id for index, user_id in enumerate(ids) if not matched[index]]
+        outcome = self.fallback.pair(rest, recent)
+        stage('fallback')
+
+        return PairingOutcome(pairs + outcome.pairs, outcome.unmatched,
+                              outcome.conflicted)
+
+
+class SharedInterestStrategy:
+    """Пары из участников с общими интересами по индексу тегов.
+
+    Теги перебираются от самых редких к популярным: внутри списка
+    участников тега свободные случайно разбиваются на пары (кроме
+    недавних). Кому не нашлось пары с общими интересами, тех добирает
+    стратегия fallback. Списки берутся из таблицы user_tags в prepare,
+    а без нее строятся по анкетам. Число пар каждого вида за последний
+    запуск сохраняется в stats.
+    """
+
+    name = "interests"
+    # Теги участников загружаются вместе с их ID
+    needs_tags = True
+
+    def __init__(self, rng=None, fallback=None):
+        self.rng = rng or random
+        self.fallback = fallback or MaximumMatchingStrategy(self.rng)
+        self.stats: Dict[str, int] = {}
+        self._postings: Optional[Dict[int, List[int]]] = None
+
+    async def prepare(self, database: Database, user_ids: List[int],
+                      participants: Optional[ParticipantArrays] = None):
+        """Списки участников по тегам: из загруженных массивов или из индекса"""
+        if participants is not None and participants.tag_ids is not None:
+            self._postings = participants.postings()
+        else:
+            self._postings = await database.get_tag_postings(user_ids)
+
+    @staticmethod
+    def _postings_from_profiles(user_ids: List[int],
+                                profiles: Dict[int, User]) -> Dict[str, List[int]]:
+        from interests import tokenize_interests
+
+        postings: Dict[str, List[int]] = {}
+        for user_id in user_ids:
+            for tag in tokenize_interests(profiles[user_id].interests):
+                postings.setdefault(tag, []).append(user_id)
+        return postings
+
+    def pair(self, user_ids: List[int], recent: RecentPairIndex,
+             profiles: Optional[Dict[int, User]] = None) -> PairingOutcome:
+        ids = list(dict.fromkeys(user_ids))
+        postings, self._postings = self._postings, None
+        if postings is None:
+            postings = self._postings_from_profiles(ids, profiles) if profiles else {}
+
+        excluded = recent.neighbours(ids)
+        members = set(ids)
+        free = set(ids)
+        pairs = []
+
+        for tag_members in sorted(postings.values(), key=len):
+            candidates = [user_id for user_id in tag_members
+                          if user_id in free and user_id in members]
+            if len(candidates) < 2:
+                continue
+            self.rng.shuffle(candidates)
+            mate = greedy_matching(candidates, excluded)
+            for user_id, partner_id in mate.items():
+                if user_id < partner_id:
+                    pairs.append((user_id, partner_id))
+                    free.discard(user_id)
+                    free.discard(partner_id)
+
+        rest = [user_id for user_id in ids if user_id in free]
+        outcome = self.fallback.pair(rest, recent)
+        self.stats = {
+            'interest_pairs': len(pairs),
+            'fallback_pairs': len(outcome.pairs),
+        }
+
+        all_pairs = pairs + outcome.pairs
+        self.rng.shuffle(all_pairs)
+        return PairingOutcome(all_pairs, outcome.unmatched, outcome.conflicted)
+
+
+def form_triads(pairs: List[Tuple[int, int]], leftovers: List[int],
+                recent: RecentPairIndex, rng=None):
+    """Присоединить оставшихся без пары к парам, образуя тройки.
+
+    Участник присоединяется к паре, если не встречался недавно ни с
+    одним из ее участников; каждая пара принимает не больше одного.
+    Возвращает (пары, тройки, оставшиеся без группы).
+    """
+    rng = rng or random
+    pairs = list(pairs)
+    triads = []
+    remaining = []
+
+    for user_id in leftovers:
+        order = list(range(len(pairs)))
+        rng.shuffle(order)
+        for index in order:
+            user1_id, user2_id = pairs[index]
+            if not recent.contains(user_id, user1_id) and not recent.contains(user_id, user2_id):
+                triads.append((user1_id, user2_id, user_id))
+                # Убираем пару за O(1): на ее место ставим последнюю
+                pairs[index] = pairs[-1]
+                pairs.pop()
+                break
+        else:
+            remaining.append(user_id)
+
+    return pairs, triads, remaining
+
+
+MATCHING_STRATEGIES = {
+    RandomPairingStrategy.name: RandomPairingStrategy,
+    MaximumMatchingStrategy.name: MaximumMatchingStrategy,
+    WeightedMatchingStrategy.name: WeightedMatchingStrategy,
+    SharedInterestStrategy.name: SharedInterestStrategy,
+}
+
+
+def get_matching_strategy(name: str):
+    """Создать стратегию мэтчинга по имени"""
+    try:
+        return MATCHING_STRATEGIES[name]()
+    except KeyError:
+        raise ValueError(f"Неизвестная стратегия мэтчинга: {name}")
 
 
 class MatchingService:
-    def __init__(self, database: Database):
+    def __init__(self, database: Database, recent_days: int = RECENT_MATCH_DAYS,
+                 strategy=None, triads: bool = True):
         self.db = database
+        # Период (в днях), в течение которого пары не повторяются
+        self.recent_days = recent_days
+        self.strategy = strategy or MaximumMatchingStrategy()
+        # Оставшиеся без пары присоединяются к парам, образуя тройки
+        self.triads = triads
 
     async def start_weekly_matching_session(self, deadline_hours: int = 24) -> int:
         """Начать новую сессию матчинга с дедлайном для сбора участников"""
-        # Создаем новую сессию матчинга
+        # Создаем новую сессию матчинга; участники "всегда" попадают
+        # в нее снимком
         session_id = await self.db.create_matching_session(deadline_hours)
 
-        # Получаем участников со статусом "спрашивать каждый раз"
-        ask_participants = await self.db.get_users_by_participation_status(
-            ParticipationStatus.ASK_EACH_TIME
-        )
-
-        # Для участников "спрашивать каждый раз" создаем записи
-        # в таблице pending_matches
-        await self._create_pending_matches(ask_participants)
+        # Для участников "спрашивать каждый раз" создаем запросы
+        # подтверждения одним запросом на стороне базы
+        requested = await self.db.create_pending_matches(session_id)
 
         logger.info(f"Начата сессия матчинга #{session_id}")
-        logger.info(f"Создано {len(ask_participants)} запросов на "
-                    f"подтверждение участия")
+        logger.info(f"Создано {requested} запросов на подтверждение участия")
         logger.info(f"Дедлайн для подтверждения: {deadline_hours} часов")
 
         return session_id
 
-    async def create_weekly_matches(self) -> MatchingResult:
-        """Создать пары для еженедельного мэтчинга из всех участников"""
-        # Получаем всех участников со статусом "всегда участвовать"
-        always_participants = await self.db.get_users_by_participation_status(
-            ParticipationStatus.ALWAYS
+    async def create_weekly_matches(self, session_id: Optional[int] = None) -> MatchingResult:
+        """Создать пары для еженедельного мэтчинга из всех участников.
+
+        Участники сессии — снимок "всегда" и подтвердившие — читаются
+        одним запросом. Без session_id участвуют все "всегда" и
+        подтвердившие в активных сессиях. Пары, уведомления для outbox
+        и завершение сессии сохраняются одной транзакцией.
+        """
+        result = await self.pair_session(session_id)
+
+        # Сохраняем пары и уведомления, завершаем сессию
+        match_ids = await self.db.commit_matching_round(
+            self.group_ids(result),
+            result.unmatched_ids + result.conflicted_ids,
+            session_id
         )
+        self.assign_match_ids(result, match_ids)
 
-        # Получаем участников, подтвердивших участие
-        confirmed_participants = await self.db.get_confirmed_participants()
+        return result
 
-        # Объединяем всех участников
-        all_participants = always_participants + confirmed_participants
+    async def pair_session(self, session_id: Optional[int] = None) -> MatchingResult:
+        """Разбить участников сессии на пары без записи в базу.
 
-        # Создаем пары из всех участников
-        result = await self._create_matches_from_users(all_participants)
+        Участники, чьи встречи в этой сессии уже сохранены (повтор
+        прерванной фазы 2), не загружаются.
+        """
+        # Участники читаются потоком в массивы ID, анкеты не нужны:
+        # уведомления собирает outbox только для получателей
+        participants = await self.db.load_participants(
+            session_id, with_tags=getattr(self.strategy, 'needs_tags', False)
+        )
 
-        # Очищаем таблицу pending_matches после создания пар
-        await self.db.clear_pending_matches()
+        # Создаем пары из всех участников
+        result = await self._pair_ids(list(participants.user_ids), participants)
 
-        logger.info(f"Создано {len(result.matches)} пар для матчинга")
-        logger.info(f"Участников 'всегда': {len(always_participants)}")
-        logger.info(f"Подтвердивших участие: {len(confirmed_participants)}")
-        logger.info(f"Не нашлось пары для {len(result.unmatched_users)} "
+        logger.info(f"Создано {len(result.pairs)} пар для матчинга")
+        if result.triples:
+            logger.info(f"Создано {len(result.triples)} групп из трех человек")
+        logger.info(f"Участников мэтчинга: {len(participants.user_ids)}")
+        logger.info(f"Не нашлось пары для {len(result.unmatched_ids)} "
                     f"пользователей")
         logger.info(f"Пропущено из-за недавних матчей: "
-                    f"{len(result.users_with_recent_matches)} пользователей")
+                    f"{len(result.conflicted_ids)} пользователей")
 
         return result
 
-    async def _create_pending_matches(self, users: List[User]):
-        """Создать записи ожидающих подтверждения участников"""
-        for user in users:
-            await self.db.create_pending_match(user.user_id)
-
     async def _create_matches_from_users(self, users: List[User]) -> MatchingResult:
         """Создать пары из списка пользователей"""
-        result = MatchingResult()
+        result = await self._pair_users(users)
 
-        if len(users) < 2:
-            # Если пользователей меньше 2, никого нельзя сматчить
-            result.unmatched_users = users
-            return result
+        # Сохраняем все пары и тройки одной транзакцией
+        match_ids = await self.db.create_matches_bulk(self.group_ids(result))
+        self.assign_match_ids(result, match_ids)
 
-        # Перемешиваем пользователей для случайности
-        shuffled_users = users.copy()
-        random.shuffle(shuffled_users)
-
-        matched_user_ids: Set[int] = set()
-
-        # Создаем пары
-        for i in range(0, len(shuffled_users) - 1, 2):
-            user1 = shuffled_users[i]
-            user2 = shuffled_users[i + 1]
+        return result
 
-            # Проверяем, не были ли эти пользователи в паре недавно
-            if not await self._were_matched_recently(user1.user_id, user2.user_id):
-                # Сохраняем пару в базу данных
-                await self.db.create_match(user1.user_id, user2.user_id)
-                result.matches.append((user1, user2))
-                matched_user_ids.add(user1.user_id)
-                matched_user_ids.add(user2.user_id)
-            else:
-                # Пользователи недавно были в паре, добавляем их в список с недавними матчами
-                result.users_with_recent_matches.extend([user1, user2])
-
-        # Обрабатываем пользователей, которые не были сматчены
-        for user in shuffled_users:
-            if user.user_id not in matched_user_ids:
-                # Если остался один пользователь и есть существующие пары,
-                # можно добавить его к случайной паре (группа из 3 человек)
-                if (len(shuffled_users) % 2 == 1 and result.matches and
-                    user == shuffled_users[-1]):
-                    # Это случай с нечетным количеством - добавляем в группу из 3 человек
-                    random_match_index = random.randint(0, len(result.matches) - 1)
-                    logger.info(f"Пользователь {user.first_name} добавлен к "
-                               f"существующей паре (группа из 3 человек)")
-                    # Можно расширить логику для групп из 3 человек в будущем
-                    result.unmatched_users.append(user)
-                else:
-                    result.unmatched_users.append(user)
+    @staticmethod
+    def group_ids(result: MatchingResult) -> List[Tuple[int, ...]]:
+        """ID участников всех встреч: сначала пары, затем тройки"""
+        return result.pairs + result.triples
+
+    @staticmethod
+    def assign_match_ids(result: MatchingResult, match_ids: List[int]):
+        """Разложить ID встреч в порядке group_ids по парам и тройкам"""
+        result.match_ids = match_ids[:len(result.pairs)]
+        result.triad_ids = match_ids[len(result.pairs):]
+
+    async def _pair_users(self, users: List[User]) -> MatchingResult:
+        """Разбить пользователей на пары без записи в базу"""
+        users_by_id = {user.user_id: user for user in users}
+        return await self._pair_ids(list(users_by_id), profiles=users_by_id)
+
+    async def _pair_ids(self, user_ids: List[int],
+                        participants: Optional[ParticipantArrays] = None,
+                        profiles: Optional[Dict[int, User]] = None) -> MatchingResult:
+        """Разбить участников на пары по ID без записи в базу.
+
+        Анкеты загружаются, только если они нужны стратегии
+        (needs_profiles) и не переданы в profiles.
+        """
+        result = MatchingResult(profiles)
+
+        if len(user_ids) < 2:
+            # Если пользователей меньше 2, никого нельзя сматчить
+            result.unmatched_ids = list(user_ids)
+            return result
 
+        # Загружаем недавние пары одним запросом на весь запуск
+        recent_pairs = await self.load_recent_pairs()
+
+        # Стратегии, которым нужны данные из базы, загружают их заранее
+        prepare = getattr(self.strategy, 'prepare', None)
+        if prepare is not None:
+            await prepare(self.db, user_ids, participants)
+        if profiles is None and getattr(self.strategy, 'needs_profiles', False):
+            profiles = await self.db.get_users_by_ids(user_ids)
+
+        outcome = self.strategy.pair(user_ids, recent_pairs, profiles)
+        pairs, unmatched, conflicted = outcome.pairs, outcome.unmatched, outcome.conflicted
+
+        if self.triads and (unmatched or conflicted):
+            pairs, result.triples, remaining = form_triads(
+                pairs, unmatched + conflicted, recent_pairs
+            )
+            remaining = set(remaining)
+            unmatched = [user_id for user_id in unmatched if user_id in remaining]
+            conflicted = [user_id for user_id in conflicted if user_id in remaining]
+
+        result.pairs = pairs
+        result.unmatched_ids = unmatched
+        result.conflicted_ids = conflicted
         return result
 
-    async def _were_matched_recently(self, user1_id: int, user2_id: int, days: int = 30) -> bool:
-        """Проверить, были ли пользователи в паре недавно"""
-        return await self.db.check_recent_match(user1_id, user2_id, days)
+    async def load_recent_pairs(self) -> RecentPairIndex:
+        """Загрузить все пары за период блокировки повторов"""
+        pairs = await self.db.get_recent_pairs(self.recent_days)
+        return RecentPairIndex(pairs)
 
     async def process_pending_confirmations(self) -> List[User]:
         """Получить список пользователей, которым нужно отправить запрос на участие"""
@@ -144,18 +804,16 @@ class MatchingService:
         confirmed_users = await self.db.get_confirmed_participants()
         result = await self._create_matches_from_users(confirmed_users)
 
-        # Очищаем таблицу pending_matches после создания пар
+        # Завершаем сбор участников после создания пар
         await self.db.clear_pending_matches()
 
         return result
 
 
-def format_user_profile(user: User, match_id: int = None) -> str:
-    """Форматировать анкету пользователя для отправки"""
+def format_partner(user: User) -> str:
+    """Блок анкеты одного партнера"""
     from html import escape
 
-    profile_text = f"👤 Ваша пара на эту неделю:\n\n"
-
     # Экранируем HTML символы для безопасности
     first_name = escape(user.first_name or "")
     last_name = escape(user.last_name or "")
@@ -163,7 +821,7 @@ def format_user_profile(user: User, match_id: int = None) -> str:
     bio = escape(user.bio or "")
     interests = escape(user.interests or "")
 
-    profile_text += f"<b>{first_name}"
+    profile_text = f"<b>{first_name}"
 
     if last_name:
         profile_text += f" {last_name}"
@@ -181,21 +839,62 @@ def format_user_profile(user: User, match_id: int = None) -> str:
     if interests:
         profile_text += f"🎯 Интересы: {interests}\n\n"
 
-    profile_text += f"💬 Напишите друг другу и договоритесь о встрече!\n"
-    profile_text += f"☕ Удачного знакомства!\n\n"
+    return profile_text
+
+
+def _format_match_footer(match_id: int = None, group: bool = False) -> str:
+    """Призыв договориться о встрече и просьба об обратной связи"""
+    if group:
+        footer = f"💬 Напишите друг другу и договоритесь о встрече втроем!\n"
+    else:
+        footer = f"💬 Напишите друг другу и договоритесь о встрече!\n"
+    footer += f"☕ Удачного знакомства!\n\n"
 
     if match_id:
-        profile_text += (
+        footer += (
             f"📋 После встречи, пожалуйста, отметьте состоялась ли она, "
             f"это поможет улучшить алгоритм подбора пар."
         )
 
+    return footer
+
+
+def format_match_message(partner_blocks: List[str], match_id: int = None,
+                         group: Optional[bool] = None) -> str:
+    """Сообщение о встрече из готовых блоков анкет (format_partner).
+
+    По умолчанию встреча считается групповой, если партнеров больше одного.
+    """
+    if group is None:
+        group = len(partner_blocks) > 1
+    if group:
+        profile_text = f"👥 На этой неделе вы встречаетесь втроем!\n\n"
+    else:
+        profile_text = f"👤 Ваша пара на эту неделю:\n\n"
+    profile_text += "".join(partner_blocks)
+    profile_text += _format_match_footer(match_id, group=group)
     return profile_text
 
 
+def format_user_profile(user: User, match_id: int = None) -> str:
+    """Форматировать анкету пользователя для отправки"""
+    return format_match_message([format_partner(user)], match_id)
+
+
+def format_group_profiles(users: List[User], match_id: int = None) -> str:
+    """Форматировать анкеты всех партнеров по группе из трех человек"""
+    return format_match_message([format_partner(user) for user in users], match_id,
+                                group=True)
+
+
 def format_no_match_message(user: User) -> str:
     """Форматировать сообщение для пользователя без пары"""
-    message_text = f"☕ Привет, {user.first_name}!\n\n"
+    return format_no_match_text(user.first_name)
+
+
+def format_no_match_text(first_name: str) -> str:
+    """Сообщение без пары по имени получателя"""
+    message_text = f"☕ Привет, {first_name}!\n\n"
     message_text += f"К сожалению, на этой неделе мы не смогли подобрать вам "
     message_text += f"пару для Random Coffee.\n\n"
     message_text += f"Это могло произойти по одной из причин:\n"
@@ -1,66 +1,900 @@
 #!/usr/bin/env python3
 """
-Скрипт миграции базы данных для добавления новых функций:
-1. Поле meeting_feedback в таблице matches
-2. Таблица matching_sessions для отслеживания сессий матчинга
+Версионированные миграции базы данных.
+
+Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция
+применяется ровно один раз в собственной транзакции, поэтому скрипт
+можно безопасно запускать повторно. Database.init_db вызывает
+apply_migrations автоматически при старте бота.
+
+Запуск вручную:
+    python migrate_db.py  # применить недостающие миграции
+
+Планы горячих запросов проверяет python -m benchmarks.query_plans.
 """
 
+import re
 import sqlite3
 import sys
+from typing import Callable, Iterable, List, NamedTuple, Tuple
+
 from config import load_config
+from interests import tokenize_interests
 
 
-def migrate_database():
-    """Выполнить миграцию базы данных"""
-    config = load_config()
-    conn = sqlite3.connect(config.database_path)
-    cursor = conn.cursor()
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[sqlite3.Cursor], None]
 
-    try:
-        print("Начинаем миграцию базы данных...")
 
-        # Проверяем, есть ли поле meeting_feedback в таблице matches
-        cursor.execute("PRAGMA table_info(matches)")
-        columns = [column[1] for column in cursor.fetchall()]
+def _column_names(cursor: sqlite3.Cursor, table: str) -> List[str]:
+    """Получить список колонок таблицы"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [column[1] for column in cursor.fetchall()]
 
-        if 'meeting_feedback' not in columns:
-            print("Добавляем поле meeting_feedback в таблицу matches...")
-            cursor.execute("""
-                ALTER TABLE matches
-                ADD COLUMN meeting_feedback TEXT DEFAULT NULL
-            """)
-            print("✅ Поле meeting_feedback добавлено")
-        else:
-            print("ℹ️ Поле meeting_feedback уже существует")
 
-        # Проверяем, существует ли таблица matching_sessions
+def _create_base_schema(cursor: sqlite3.Cursor):
+    """Базовая схема: users, matches, pending_matches, matching_sessions"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT NOT NULL,
+            last_name TEXT,
+            bio TEXT,
+            interests TEXT,
+            participation_status TEXT DEFAULT 'ask_each_time',
+            is_active BOOLEAN DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user1_id INTEGER,
+            user2_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_completed BOOLEAN DEFAULT 0,
+            meeting_feedback TEXT DEFAULT NULL,
+            FOREIGN KEY (user1_id) REFERENCES users (user_id),
+            FOREIGN KEY (user2_id) REFERENCES users (user_id)
+        )
+    """)
+
+    # Старые базы создавались без поля meeting_feedback
+    if 'meeting_feedback' not in _column_names(cursor, 'matches'):
         cursor.execute("""
-            SELECT name FROM sqlite_master
-            WHERE type='table' AND name='matching_sessions'
+            ALTER TABLE matches
+            ADD COLUMN meeting_feedback TEXT DEFAULT NULL
         """)
 
-        if not cursor.fetchone():
-            print("Создаем таблицу matching_sessions...")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pending_matches (
+            user_id INTEGER PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            confirmed BOOLEAN DEFAULT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS matching_sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT DEFAULT 'collecting',
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            deadline TIMESTAMP,
+            completed_at TIMESTAMP DEFAULT NULL,
+            forced_completion BOOLEAN DEFAULT 0
+        )
+    """)
+
+
+def _create_hot_path_indexes(cursor: sqlite3.Cursor):
+    """Индексы для горячих запросов Database"""
+    # check_recent_match, get_user_recent_matches, record_meeting_feedback
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_matches_user1_created
+        ON matches (user1_id, created_at)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_matches_user2_created
+        ON matches (user2_id, created_at)
+    """)
+    # get_recent_pairs и статистика за период: покрывающий индекс по времени
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_matches_created_pair
+        ON matches (created_at, user1_id, user2_id)
+    """)
+    # get_current_matching_session и поиск активных сессий
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_status_started
+        ON matching_sessions (status, started_at)
+    """)
+    # get_users_by_participation_status, get_participants, статистика
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_active_status
+        ON users (is_active, participation_status)
+    """)
+    # get_pending_participants, get_confirmed_participants
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pending_confirmed
+        ON pending_matches (confirmed)
+    """)
+
+
+def _create_notification_outbox(cursor: sqlite3.Cursor):
+    """Outbox уведомлений: пишется в одной транзакции с парами"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{}',
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP DEFAULT NULL
+        )
+    """)
+    # get_pending_outbox: очередь неотправленных сообщений по порядку
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_outbox_status_id
+        ON notification_outbox (status, id)
+    """)
+
+
+def _create_fsm_states(cursor: sqlite3.Cursor):
+    """Состояния FSM aiogram, переживающие перезапуск бота"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER NOT NULL
+        )
+    """)
+    # purge_fsm_states: удаление устаревших состояний
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_fsm_states_updated
+        ON fsm_states (updated_at)
+    """)
+
+
+# Сессии, в которые еще собираются участники или создаются пары
+ACTIVE_SESSION_STATUSES = "('collecting', 'pairing')"
+
+# Ответы на запрос участия в активных сессиях
+_PENDING_STATS_SQL = f"""
+    INSERT INTO stats_counters (name, value)
+    SELECT 'pending:' || CASE sp.confirmed WHEN 1 THEN 'confirmed'
+                                          WHEN 0 THEN 'declined'
+                                          ELSE 'waiting' END, COUNT(*)
+    FROM session_participants sp
+    JOIN matching_sessions s ON s.id = sp.session_id
+    WHERE sp.source = 'ask' AND s.status IN {ACTIVE_SESSION_STATUSES}
+    GROUP BY 1
+"""
+
+
+def _base_stats_sql(day_sql: str) -> List[str]:
+    """Пересчет счетчиков пользователей и встреч; day_sql — день встречи"""
+    return [
+        "DELETE FROM stats_counters",
+        "DELETE FROM match_counts_daily",
+        """
+        INSERT INTO stats_counters (name, value)
+        SELECT 'total_matches', COUNT(*) FROM matches
+        UNION ALL
+        SELECT 'total_users', COUNT(*) FROM users
+        UNION ALL
+        SELECT 'active_users', COUNT(*) FROM users WHERE is_active = 1
+        UNION ALL
+        SELECT 'status:' || participation_status, COUNT(*) FROM users
+        WHERE is_active = 1
+        GROUP BY participation_status
+        """,
+        f"""
+        INSERT INTO match_counts_daily (day, count)
+        SELECT {day_sql}, COUNT(*) FROM matches
+        GROUP BY 1
+        """,
+    ]
+
+
+def _match_day(column: str) -> str:
+    """День встречи (UTC) по метке времени в секундах эпохи"""
+    return f"date({column}, 'unixepoch')"
+
+
+# Пересчет счетчиков статистики с нуля для починки счетчиков
+# (Database.rebuild_statistics) на текущей схеме
+STATS_REBUILD_SQL = _base_stats_sql(_match_day("created_at")) + [_PENDING_STATS_SQL]
+
+
+def _counter_delta(name_sql: str, delta: int) -> str:
+    """Тело триггера: прибавить delta к счетчику с именем name_sql"""
+    return f"""
+        INSERT INTO stats_counters (name, value) VALUES ({name_sql}, {delta})
+        ON CONFLICT (name) DO UPDATE SET value = value + {delta};
+    """
+
+
+def _pending_counter(row: str) -> str:
+    return (f"'pending:' || CASE {row}.confirmed WHEN 1 THEN 'confirmed' "
+            f"WHEN 0 THEN 'declined' ELSE 'waiting' END")
+
+
+def _create_stats_counters(cursor: sqlite3.Cursor):
+    """Счетчики статистики, которые поддерживаются триггерами"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    # Мэтчи по дням: окно "за последние N дней" — сумма не более N строк
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS match_counts_daily (
+            day TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+
+    triggers = {
+        'trg_users_stats_insert': ("AFTER INSERT ON users WHEN NEW.is_active = 1",
+            _counter_delta("'active_users'", 1)
+            + _counter_delta("'status:' || NEW.participation_status", 1)),
+        'trg_users_stats_delete': ("AFTER DELETE ON users WHEN OLD.is_active = 1",
+            _counter_delta("'active_users'", -1)
+            + _counter_delta("'status:' || OLD.participation_status", -1)),
+        'trg_users_stats_update_old': (
+            "AFTER UPDATE OF is_active, participation_status ON users "
+            "WHEN OLD.is_active = 1",
+            _counter_delta("'active_users'", -1)
+            + _counter_delta("'status:' || OLD.participation_status", -1)),
+        'trg_users_stats_update_new': (
+            "AFTER UPDATE OF is_active, participation_status ON users "
+            "WHEN NEW.is_active = 1",
+            _counter_delta("'active_users'", 1)
+            + _counter_delta("'status:' || NEW.participation_status", 1)),
+        'trg_matches_stats_insert': ("AFTER INSERT ON matches",
+            _counter_delta("'total_matches'", 1) + """
+            INSERT INTO match_counts_daily (day, count)
+            VALUES (date(NEW.created_at), 1)
+            ON CONFLICT (day) DO UPDATE SET count = count + 1;
+            """),
+        'trg_matches_stats_delete': ("AFTER DELETE ON matches",
+            _counter_delta("'total_matches'", -1) + """
+            UPDATE match_counts_daily SET count = count - 1
+            WHERE day = date(OLD.created_at);
+            """),
+        'trg_pending_stats_insert': ("AFTER INSERT ON pending_matches",
+            _counter_delta(_pending_counter("NEW"), 1)),
+        'trg_pending_stats_delete': ("AFTER DELETE ON pending_matches",
+            _counter_delta(_pending_counter("OLD"), -1)),
+        'trg_pending_stats_update': ("AFTER UPDATE OF confirmed ON pending_matches",
+            _counter_delta(_pending_counter("OLD"), -1)
+            + _counter_delta(_pending_counter("NEW"), 1)),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+    # До сессионных участников ответы хранились в pending_matches,
+    # а метки времени — строками
+    for statement in _base_stats_sql("date(created_at)"):
+        cursor.execute(statement)
+    cursor.execute("""
+        INSERT INTO stats_counters (name, value)
+        SELECT 'pending:' || CASE confirmed WHEN 1 THEN 'confirmed'
+                                           WHEN 0 THEN 'declined'
+                                           ELSE 'waiting' END, COUNT(*)
+        FROM pending_matches
+        GROUP BY 1
+    """)
+
+
+def _create_users_keyset_index(cursor: sqlite3.Cursor):
+    """Индекс и счетчик для постраничного просмотра пользователей"""
+    # get_users_page: страницы по ключу (created_at, user_id)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_created_id
+        ON users (created_at, user_id)
+    """)
+
+    triggers = {
+        'trg_users_total_insert': ("AFTER INSERT ON users",
+                                   _counter_delta("'total_users'", 1)),
+        'trg_users_total_delete': ("AFTER DELETE ON users",
+                                   _counter_delta("'total_users'", -1)),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+    cursor.execute("""
+        INSERT OR REPLACE INTO stats_counters (name, value)
+        SELECT 'total_users', COUNT(*) FROM users
+    """)
+
+
+def _create_interest_index(cursor: sqlite3.Cursor):
+    """Инвертированный индекс интересов: тег -> список пользователей"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS interest_tags (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_tags (
+            tag_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (tag_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    # Замена тегов пользователя при редактировании анкеты
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_user_tags_user
+        ON user_tags (user_id, tag_id)
+    """)
+
+    # Заполняем индекс по уже существующим анкетам
+    cursor.execute("SELECT user_id, interests FROM users WHERE interests IS NOT NULL")
+    for user_id, interests in cursor.fetchall():
+        for tag in tokenize_interests(interests):
+            cursor.execute(
+                "INSERT OR IGNORE INTO interest_tags (name) VALUES (?)", (tag,)
+            )
             cursor.execute("""
-                CREATE TABLE matching_sessions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    status TEXT DEFAULT 'collecting',
-                    started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    deadline TIMESTAMP,
-                    completed_at TIMESTAMP DEFAULT NULL,
-                    forced_completion BOOLEAN DEFAULT 0
-                )
-            """)
-            print("✅ Таблица matching_sessions создана")
-        else:
-            print("ℹ️ Таблица matching_sessions уже существует")
+                INSERT OR IGNORE INTO user_tags (tag_id, user_id)
+                SELECT id, ? FROM interest_tags WHERE name = ?
+            """, (user_id, tag))
+
+
+def _create_match_members(cursor: sqlite3.Cursor):
+    """Участники встреч: у пары два участника, у тройки — три"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS match_members (
+            match_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (match_id, user_id),
+            FOREIGN KEY (match_id) REFERENCES matches (id)
+        ) WITHOUT ROWID
+    """)
+    # Встречи пользователя: проверки повторов, обратная связь
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_match_members_user
+        ON match_members (user_id, match_id)
+    """)
+    cursor.execute("""
+        INSERT OR IGNORE INTO match_members (match_id, user_id)
+        SELECT id, user1_id FROM matches
+        UNION ALL
+        SELECT id, user2_id FROM matches
+    """)
+
+
+def _session_counters(sign: str) -> str:
+    """Тело триггера: учесть ответы всей сессии при ее закрытии или открытии"""
+    return f"""
+        UPDATE stats_counters SET value = value {sign} (
+            SELECT COUNT(*) FROM session_participants sp
+            WHERE sp.session_id = NEW.id AND sp.source = 'ask'
+              AND {_pending_counter("sp")} = stats_counters.name
+        )
+        WHERE name LIKE 'pending:%';
+    """
+
+
+def _create_session_participants(cursor: sqlite3.Cursor):
+    """Участники сессий вместо общей таблицы pending_matches"""
+    # source: 'always' — снимок участников "всегда" на старте сессии,
+    # 'ask' — запрос участия; confirmed: NULL — ждем ответа, 1 — да, 0 — нет
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS session_participants (
+            session_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            source TEXT NOT NULL DEFAULT 'ask',
+            confirmed BOOLEAN DEFAULT NULL,
+            invited_at TIMESTAMP NOT NULL,
+            responded_at TIMESTAMP DEFAULT NULL,
+            PRIMARY KEY (session_id, user_id),
+            FOREIGN KEY (session_id) REFERENCES matching_sessions (id)
+        ) WITHOUT ROWID
+    """)
+    # Ответ пользователя без номера сессии: его строки в активных сессиях
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_session_participants_user
+        ON session_participants (user_id, session_id)
+    """)
+
+    # Ожидающие ответа переходят в текущую сессию, без сессии они
+    # все равно были бы удалены в фазе 2
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO session_participants
+            (session_id, user_id, source, confirmed, invited_at)
+        SELECT s.id, pm.user_id, 'ask', pm.confirmed, pm.created_at
+        FROM pending_matches pm
+        JOIN (
+            SELECT id FROM matching_sessions
+            WHERE status IN {ACTIVE_SESSION_STATUSES}
+            ORDER BY started_at DESC, id DESC
+            LIMIT 1
+        ) s
+    """)
+    # Активные сессии получают снимок участников "всегда", как новые
+    # сессии в Database._insert_session, иначе фаза 2 их не увидит
+    cursor.execute(f"""
+        INSERT OR IGNORE INTO session_participants
+            (session_id, user_id, source, confirmed, invited_at)
+        SELECT s.id, u.user_id, 'always', 1, s.started_at
+        FROM matching_sessions s
+        JOIN users u ON u.is_active = 1 AND u.participation_status = 'always'
+        WHERE s.status IN {ACTIVE_SESSION_STATUSES}
+    """)
+    for name in ('trg_pending_stats_insert', 'trg_pending_stats_delete',
+                 'trg_pending_stats_update'):
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+    cursor.execute("DROP TABLE IF EXISTS pending_matches")
+
+    # Счетчики pending:* отражают только активные сессии
+    session_active = (f"EXISTS (SELECT 1 FROM matching_sessions "
+                      f"WHERE id = {{row}}.session_id "
+                      f"AND status IN {ACTIVE_SESSION_STATUSES})")
+    triggers = {
+        'trg_participants_stats_insert': (
+            "AFTER INSERT ON session_participants WHEN NEW.source = 'ask' AND "
+            + session_active.format(row="NEW"),
+            _counter_delta(_pending_counter("NEW"), 1)),
+        'trg_participants_stats_delete': (
+            "AFTER DELETE ON session_participants WHEN OLD.source = 'ask' AND "
+            + session_active.format(row="OLD"),
+            _counter_delta(_pending_counter("OLD"), -1)),
+        'trg_participants_stats_update_old': (
+            "AFTER UPDATE OF confirmed, source ON session_participants "
+            "WHEN OLD.source = 'ask' AND " + session_active.format(row="OLD"),
+            _counter_delta(_pending_counter("OLD"), -1)),
+        'trg_participants_stats_update_new': (
+            "AFTER UPDATE OF confirmed, source ON session_participants "
+            "WHEN NEW.source = 'ask' AND " + session_active.format(row="NEW"),
+            _counter_delta(_pending_counter("NEW"), 1)),
+        'trg_sessions_stats_close': (
+            f"AFTER UPDATE OF status ON matching_sessions "
+            f"WHEN OLD.status IN {ACTIVE_SESSION_STATUSES} "
+            f"AND NEW.status NOT IN {ACTIVE_SESSION_STATUSES}",
+            _session_counters("-")),
+        'trg_sessions_stats_reopen': (
+            f"AFTER UPDATE OF status ON matching_sessions "
+            f"WHEN OLD.status NOT IN {ACTIVE_SESSION_STATUSES} "
+            f"AND NEW.status IN {ACTIVE_SESSION_STATUSES}",
+            _session_counters("+")),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+    cursor.execute("DELETE FROM stats_counters WHERE name LIKE 'pending:%'")
+    cursor.execute(_PENDING_STATS_SQL)
+
+
+# Текущее время в секундах эпохи для DEFAULT (unixepoch() есть только с SQLite 3.38)
+_NOW_EPOCH_SQL = "(CAST(strftime('%s', 'now') AS INTEGER))"
+
+# Таблицы с метками времени: новое определение и колонки с временем
+_EPOCH_TABLES = {
+    'users': (f"""
+        CREATE TABLE {{name}} (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT NOT NULL,
+            last_name TEXT,
+            bio TEXT,
+            interests TEXT,
+            participation_status TEXT DEFAULT 'ask_each_time',
+            is_active BOOLEAN DEFAULT 1,
+            created_at INTEGER DEFAULT {_NOW_EPOCH_SQL}
+        )
+    """, ('created_at',)),
+    'matches': (f"""
+        CREATE TABLE {{name}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user1_id INTEGER,
+            user2_id INTEGER,
+            created_at INTEGER DEFAULT {_NOW_EPOCH_SQL},
+            is_completed BOOLEAN DEFAULT 0,
+            meeting_feedback TEXT DEFAULT NULL,
+            FOREIGN KEY (user1_id) REFERENCES users (user_id),
+            FOREIGN KEY (user2_id) REFERENCES users (user_id)
+        )
+    """, ('created_at',)),
+    'matching_sessions': (f"""
+        CREATE TABLE {{name}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT DEFAULT 'collecting',
+            started_at INTEGER DEFAULT {_NOW_EPOCH_SQL},
+            deadline INTEGER,
+            completed_at INTEGER DEFAULT NULL,
+            forced_completion BOOLEAN DEFAULT 0
+        )
+    """, ('started_at', 'deadline', 'completed_at')),
+    'session_participants': ("""
+        CREATE TABLE {name} (
+            session_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            source TEXT NOT NULL DEFAULT 'ask',
+            confirmed BOOLEAN DEFAULT NULL,
+            invited_at INTEGER NOT NULL,
+            responded_at INTEGER DEFAULT NULL,
+            PRIMARY KEY (session_id, user_id),
+            FOREIGN KEY (session_id) REFERENCES matching_sessions (id)
+        ) WITHOUT ROWID
+    """, ('invited_at', 'responded_at')),
+    'notification_outbox': (f"""
+        CREATE TABLE {{name}} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL DEFAULT '{{{{}}}}',
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at INTEGER DEFAULT {_NOW_EPOCH_SQL},
+            sent_at INTEGER DEFAULT NULL
+        )
+    """, ('created_at', 'sent_at')),
+}
+
+# Колонки, которые старый код писал из Python через datetime.now(),
+# то есть в локальном времени сервера, а не через CURRENT_TIMESTAMP
+_LOCAL_TIME_COLUMNS = {
+    'matching_sessions': ('deadline',),
+}
+
+
+def _epoch_sql(column: str, local: bool = False) -> str:
+    """Перевести метку времени column в секунды эпохи.
+
+    Строки 'YYYY-MM-DD HH:MM:SS' (и ISO-формат с 'T') считаются
+    временем UTC, как у CURRENT_TIMESTAMP. Для local=True строка —
+    локальное время сервера и переводится в UTC модификатором 'utc'.
+    """
+    modifier = ", 'utc'" if local else ""
+    return (f"CASE WHEN typeof({column}) IN ('integer', 'real') "
+            f"THEN CAST({column} AS INTEGER) "
+            f"ELSE CAST(strftime('%s', {column}{modifier}) AS INTEGER) END")
+
+
+def _convert_timestamps_to_epoch(cursor: sqlite3.Cursor):
+    """Метки времени в секундах эпохи вместо строк.
 
-        conn.commit()
-        print("✅ Миграция завершена успешно!")
+    Строки сравнивались текстом, и форматы 'YYYY-MM-DD HH:MM:SS'
+    и isoformat() с 'T' упорядочивались неверно. Значения CURRENT_TIMESTAMP
+    записаны в UTC, а записанные из Python — в локальном времени
+    (_LOCAL_TIME_COLUMNS). SQLite не меняет тип
+    колонки, поэтому таблицы пересоздаются: индексы и триггеры
+    сохраняются из sqlite_master и создаются заново, счетчики по дням
+    пересчитываются по новым меткам.
+    """
+    tables = list(_EPOCH_TABLES)
+    placeholders = ", ".join("?" for _ in tables)
+    cursor.execute(f"""
+        SELECT type, name, sql FROM sqlite_master
+        WHERE type IN ('index', 'trigger') AND sql IS NOT NULL
+          AND tbl_name IN ({placeholders})
+    """, tables)
+    schema = cursor.fetchall()
+    cursor.execute(f"SELECT name, seq FROM sqlite_sequence WHERE name IN ({placeholders})",
+                   tables)
+    sequences = cursor.fetchall()
+
+    # Триггеры ссылаются на соседние таблицы и мешают переименованию
+    for kind, name, _ in schema:
+        if kind == 'trigger':
+            cursor.execute(f"DROP TRIGGER {name}")
+
+    for table, (create_sql, timestamp_columns) in _EPOCH_TABLES.items():
+        columns = _column_names(cursor, table)
+        local_columns = _LOCAL_TIME_COLUMNS.get(table, ())
+        values = [_epoch_sql(column, column in local_columns)
+                  if column in timestamp_columns else column
+                  for column in columns]
+        cursor.execute(create_sql.format(name=f"{table}_new"))
+        cursor.execute(f"""
+            INSERT INTO {table}_new ({", ".join(columns)})
+            SELECT {", ".join(values)} FROM {table}
+        """)
+        cursor.execute(f"DROP TABLE {table}")
+        cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+    # Счетчик AUTOINCREMENT не должен откатиться к максимальному ID
+    for name, seq in sequences:
+        cursor.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?",
+                       (seq, name))
+        if cursor.rowcount == 0:
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                           (name, seq))
+
+    day_triggers = {
+        'trg_matches_stats_insert': ("AFTER INSERT ON matches",
+            _counter_delta("'total_matches'", 1) + f"""
+            INSERT INTO match_counts_daily (day, count)
+            VALUES ({_match_day("NEW.created_at")}, 1)
+            ON CONFLICT (day) DO UPDATE SET count = count + 1;
+            """),
+        'trg_matches_stats_delete': ("AFTER DELETE ON matches",
+            _counter_delta("'total_matches'", -1) + f"""
+            UPDATE match_counts_daily SET count = count - 1
+            WHERE day = {_match_day("OLD.created_at")};
+            """),
+    }
+    for kind, name, sql in schema:
+        if name not in day_triggers:
+            cursor.execute(sql)
+    for name, (event, body) in day_triggers.items():
+        cursor.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+    for statement in STATS_REBUILD_SQL:
+        cursor.execute(statement)
+
+
+def _create_pair_history(cursor: sqlite3.Cursor):
+    """История пар: одна строка на пару, встречавшуюся хотя бы раз"""
+    # Пара хранится как (меньший ID, больший ID); для тройки — три пары
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS pair_history (
+            user1_id INTEGER NOT NULL,
+            user2_id INTEGER NOT NULL,
+            last_met_at INTEGER NOT NULL,
+            meet_count INTEGER NOT NULL DEFAULT 1,
+            last_feedback TEXT DEFAULT NULL,
+            PRIMARY KEY (user1_id, user2_id),
+            CHECK (user1_id < user2_id)
+        ) WITHOUT ROWID
+    """)
+    # get_recent_pairs: пары за период блокировки повторов
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_pair_history_met
+        ON pair_history (last_met_at)
+    """)
+
+    triggers = {
+        # Новый участник встречи образует пару с каждым уже добавленным
+        'trg_pair_history_insert': ("AFTER INSERT ON match_members", """
+            INSERT INTO pair_history
+                (user1_id, user2_id, last_met_at, meet_count, last_feedback)
+            SELECT min(NEW.user_id, other.user_id), max(NEW.user_id, other.user_id),
+                   m.created_at, 1, m.meeting_feedback
+            FROM match_members other
+            JOIN matches m ON m.id = other.match_id
+            WHERE other.match_id = NEW.match_id AND other.user_id != NEW.user_id
+            ON CONFLICT (user1_id, user2_id) DO UPDATE SET
+                meet_count = meet_count + 1,
+                last_feedback = CASE WHEN excluded.last_met_at >= last_met_at
+                                     THEN excluded.last_feedback
+                                     ELSE last_feedback END,
+                last_met_at = max(last_met_at, excluded.last_met_at);
+        """),
+        # Отзыв учитывается, только если это последняя встреча пары
+        'trg_pair_history_feedback': ("AFTER UPDATE OF meeting_feedback ON matches", """
+            UPDATE pair_history SET last_feedback = NEW.meeting_feedback
+            WHERE last_met_at = NEW.created_at AND (user1_id, user2_id) IN (
+                SELECT a.user_id, b.user_id
+                FROM match_members a
+                JOIN match_members b ON b.match_id = a.match_id AND b.user_id > a.user_id
+                WHERE a.match_id = NEW.id
+            );
+        """),
+    }
+    for name, (event, body) in triggers.items():
+        cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cursor.execute(f"CREATE TRIGGER {name} {event} BEGIN {body} END")
+
+    # Заполняем по истории встреч; m.meeting_feedback берется
+    # из строки с MAX(created_at)
+    cursor.execute("""
+        INSERT OR REPLACE INTO pair_history
+            (user1_id, user2_id, last_met_at, meet_count, last_feedback)
+        SELECT a.user_id, b.user_id, MAX(m.created_at), COUNT(*), m.meeting_feedback
+        FROM match_members a
+        JOIN match_members b ON b.match_id = a.match_id AND b.user_id > a.user_id
+        JOIN matches m ON m.id = a.match_id
+        GROUP BY a.user_id, b.user_id
+    """)
+
+
+def _add_match_session(cursor: sqlite3.Cursor):
+    """Сессия, в которой создана встреча: фаза 2 сохраняется порциями"""
+    if 'session_id' not in _column_names(cursor, 'matches'):
+        cursor.execute("""
+            ALTER TABLE matches
+            ADD COLUMN session_id INTEGER DEFAULT NULL
+            REFERENCES matching_sessions (id)
+        """)
+    # load_participants: при повторе фазы 2 пропускаются участники,
+    # чьи встречи уже сохранены
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_matches_session
+        ON matches (session_id)
+    """)
+
+
+def _drop_unused_match_indexes(cursor: sqlite3.Cursor):
+    """Индексы matches, которые после pair_history не читает ни один запрос"""
+    # Повторы и окна по времени читаются из pair_history, встречи
+    # пользователя — через match_members; индексы только замедляли
+    # вставку встреч в фазе 2
+    for name in ('idx_matches_user1_created', 'idx_matches_user2_created',
+                 'idx_matches_created_pair'):
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+def _add_outbox_error(cursor: sqlite3.Cursor):
+    """Причина, по которой сообщение outbox не будет доставлено"""
+    if 'error' not in _column_names(cursor, 'notification_outbox'):
+        cursor.execute("""
+            ALTER TABLE notification_outbox
+            ADD COLUMN error TEXT DEFAULT NULL
+        """)
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Базовая схема", _create_base_schema),
+    Migration(2, "Индексы для горячих запросов", _create_hot_path_indexes),
+    Migration(3, "Outbox уведомлений", _create_notification_outbox),
+    Migration(4, "Хранилище состояний FSM", _create_fsm_states),
+    Migration(5, "Счетчики статистики на триггерах", _create_stats_counters),
+    Migration(6, "Постраничный просмотр пользователей", _create_users_keyset_index),
+    Migration(7, "Индекс интересов", _create_interest_index),
+    Migration(8, "Участники встреч для групп из трех человек", _create_match_members),
+    Migration(9, "Участники сессий мэтчинга", _create_session_participants),
+    Migration(10, "Метки времени в секундах эпохи", _convert_timestamps_to_epoch),
+    Migration(11, "История пар", _create_pair_history),
+    Migration(12, "Сессия встречи", _add_match_session),
+    Migration(13, "Удаление неиспользуемых индексов matches", _drop_unused_match_indexes),
+    Migration(14, "Причина недоставки outbox", _add_outbox_error),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    """Получить текущую версию схемы из PRAGMA user_version"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations(conn: sqlite3.Connection, verbose: bool = False) -> int:
+    """Применить недостающие миграции, вернуть их количество"""
+    current_version = get_schema_version(conn)
+    applied = 0
+
+    # Управляем транзакциями сами: DDL и user_version меняются атомарно
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        for migration in MIGRATIONS:
+            if migration.version <= current_version:
+                continue
+
+            if verbose:
+                print(f"Применяем миграцию {migration.version}: "
+                      f"{migration.description}...")
+
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                migration.apply(cursor)
+                cursor.execute(f"PRAGMA user_version = {migration.version}")
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+            applied += 1
+    finally:
+        conn.isolation_level = isolation_level
+
+    return applied
+
+
+def apply_migrations(db_path: str) -> int:
+    """Открыть базу по пути и применить недостающие миграции"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return run_migrations(conn)
+    finally:
+        conn.close()
+
+
+# Таблицы, которые читаются целиком намеренно: несколько десятков счетчиков
+FULL_SCAN_TABLES = {'stats_counters'}
+# Операторы, у которых есть план выполнения
+_PLANNED_STATEMENTS = {'SELECT', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'WITH'}
+
+
+def _trigger_statements(conn: sqlite3.Connection) -> List[Tuple[str, str, tuple]]:
+    """Операторы тел триггеров схемы: NEW.x и OLD.x заменены параметрами"""
+    statements = []
+    for name, sql in conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' ORDER BY name"
+    ):
+        body = sql[re.search(r"\bBEGIN\b", sql, re.I).end():sql.upper().rindex("END")]
+        for statement in body.split(";"):
+            statement, params = re.subn(r"\b(?:NEW|OLD)\.\w+", "?", statement, flags=re.I)
+            if statement.strip():
+                statements.append((name, statement, (None,) * params))
+    return statements
+
+
+def _full_scans(conn: sqlite3.Connection, statement: str, params: tuple = ()) -> List[str]:
+    """Полные сканирования таблиц в плане запроса.
+
+    Чтение по индексу с LIMIT (первая страница списка) останавливается
+    после limit строк и полным сканированием не считается.
+    """
+    scans = []
+    limited = re.search(r"\bLIMIT\b", statement, re.I) is not None
+    for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}", params):
+        detail = row[-1]
+        if not detail.startswith("SCAN ") or detail.endswith(("CONSTANT ROW", "CONSTANT ROWS")):
+            continue
+        if detail.split()[1] in FULL_SCAN_TABLES or (limited and " USING " in detail):
+            continue
+        scans.append(detail)
+    return scans
+
+
+def check_query_plans(conn: sqlite3.Connection, statements: Iterable[str]) -> List[str]:
+    """Проверить, что запросы и триггеры не делают полных сканирований таблиц.
+
+    statements — текст запросов с подставленными параметрами, как его
+    передает трассировка SQLite (Database.set_trace_callback); BEGIN,
+    COMMIT и прочие операторы без плана пропускаются.
+    """
+    problems = []
+
+    checked = set()
+    for statement in statements:
+        words = statement.split()
+        if not words or words[0].upper() not in _PLANNED_STATEMENTS:
+            continue
+        text = " ".join(words)
+        if text in checked:
+            continue
+        checked.add(text)
+        for detail in _full_scans(conn, statement):
+            problems.append(f"{text[:100]}: {detail}")
+
+    for name, statement, params in _trigger_statements(conn):
+        for detail in _full_scans(conn, statement, params):
+            problems.append(f"{name}: {detail}")
+
+    return problems
+
+
+def migrate_database(db_path: str = None) -> bool:
+    """Выполнить миграцию базы данных"""
+    if db_path is None:
+        db_path = load_config().database_path
+
+    conn = sqlite3.connect(db_path)
+
+    try:
+        print("Начинаем миграцию базы данных...")
+        print(f"Текущая версия схемы: {get_schema_version(conn)}")
+
+        applied = run_migrations(conn, verbose=True)
+
+        if applied:
+            print(f"✅ Применено миграций: {applied}")
+        else:
+            print("ℹ️ База данных уже в актуальном состоянии")
+        print(f"✅ Миграция завершена успешно! Версия схемы: "
+              f"{get_schema_version(conn)}")
 
     except Exception as e:
         print(f"❌ Ошибка при миграции: {e}")
-        conn.rollback()
         return False
     finally:
         conn.close()
@@ -69,5 +903,4 @@ def migrate_database():
 
 
 if __name__ == "__main__":
-    success = migrate_database()
-    sys.exit(0 if success else 1)
\ No newline at end of file
+    sys.exit(0 if migrate_database() else 1)
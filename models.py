@@ -1,4 +1,5 @@
 from dataclasses import dataclass
+from datetime import datetime
 from typing import Optional
 from enum import Enum
 
@@ -19,4 +20,4 @@ class User:
     interests: Optional[str]
     participation_status: ParticipationStatus
     is_active: bool = True
-    created_at: Optional[str] = None
+    created_at: Optional[datetime] = None
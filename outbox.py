@@ -0,0 +1,261 @@
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from cache import LRUCache
+from database import Database
+from dispatcher import NotificationDispatcher
+from keyboards import get_match_with_feedback_keyboard
+from matching import format_match_message, format_no_match_text, format_partner
+
+logger = logging.getLogger(__name__)
+
+# Сколько строк outbox гидратируется одним запросом анкет
+HYDRATE_CHUNK = 100
+# Отрисованные анкеты: участник тройки или повторной отправки
+# попадает в несколько сообщений
+PROFILE_CACHE_SIZE = 10000
+PROFILE_CACHE_TTL = 300.0
+# Сколько отрисованных порций ждут отправки
+SEND_QUEUE_SIZE = 2
+
+
+async def run_stages(*stages):
+    """Запустить стадии конвейера вместе; ошибка одной отменяет остальные"""
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+class UndeliverableMessage(Exception):
+    """Строку outbox нельзя доставить ни с какой попытки; текст — причина"""
+
+
+class RenderedProfile(NamedTuple):
+    """Анкета, готовая к вставке в сообщение"""
+    first_name: str
+    # Блок анкеты партнера (format_partner)
+    text: str
+
+
+class OutboxDrainer:
+    """Доставка сообщений из notification_outbox через диспетчер.
+
+    Строки outbox создаются в одной транзакции с парами, поэтому после
+    падения процесса достаточно снова запустить drain: он продолжит
+    с первой неотправленной строки. Доставка at-least-once — строка
+    помечается отправленной после успешного send_message. Неудачная
+    отправка повторяется до max_attempts раз, а строка, которую нельзя
+    отрисовать (анкета удалена), сразу помечается failed с причиной.
+
+    Строки хранят только ID: анкеты загружаются порциями по
+    hydrate_size строк непосредственно перед постановкой в очередь
+    диспетчера, пока он отправляет предыдущие порции. Отрисованные
+    анкеты живут в ограниченном LRU-кэше.
+    """
+
+    def __init__(self, database: Database, dispatcher: NotificationDispatcher,
+                 batch_size: int = 500, poll_interval: float = 60.0,
+                 max_attempts: int = 3, hydrate_size: int = HYDRATE_CHUNK,
+                 profile_cache_size: int = PROFILE_CACHE_SIZE,
+                 profile_cache_ttl: float = PROFILE_CACHE_TTL):
+        self.db = database
+        self.dispatcher = dispatcher
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.hydrate_size = max(1, hydrate_size)
+        self.profiles = LRUCache(profile_cache_size, ttl=profile_cache_ttl)
+        self._lock: Optional[asyncio.Lock] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """Блокировка доставки: два прохода отправили бы одни строки дважды"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def drain(self) -> int:
+        """Доставить все неотправленные сообщения, вернуть число доставленных"""
+        async with self.lock:
+            batches = asyncio.Queue(maxsize=1)
+            _, delivered = await run_stages(
+                self._read_pending(batches), self.deliver(batches)
+            )
+            return delivered
+
+    async def _read_pending(self, batches: asyncio.Queue):
+        last_id = 0
+        while rows := await self.db.get_pending_outbox(self.batch_size, last_id):
+            last_id = rows[-1]['id']
+            await batches.put(rows)
+        await batches.put(None)
+
+    async def deliver(self, batches: asyncio.Queue) -> int:
+        """Доставить строки outbox, поступающие порциями из очереди.
+
+        None в очереди завершает поток. Отрисовка (гидратация анкет и
+        постановка в очередь диспетчера) и ожидание отправки идут
+        отдельными стадиями: отрисовка опережает отправку не больше чем
+        на SEND_QUEUE_SIZE порций. Вызывающий держит lock, иначе
+        фоновый drain может взять те же строки.
+        """
+        rendered = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+        _, delivered = await run_stages(
+            self._render_stage(batches, rendered), self._send_stage(rendered)
+        )
+        return delivered
+
+    async def _render_stage(self, batches: asyncio.Queue, rendered: asyncio.Queue):
+        while (rows := await batches.get()) is not None:
+            for start in range(0, len(rows), self.hydrate_size):
+                chunk = rows[start:start + self.hydrate_size]
+                profiles = await self._hydrate(chunk)
+
+                enqueued = []
+                dropped = []
+                # Участники встречи идут подряд и получают одну клавиатуру
+                keyboards = {}
+                for row in chunk:
+                    try:
+                        text, kwargs = self._render(row, profiles, keyboards)
+                    except UndeliverableMessage as e:
+                        # Анкета не вернется — повторные попытки бесполезны
+                        dropped.append((row['id'], str(e)))
+                        continue
+                    enqueued.append(
+                        (row['id'], self.dispatcher.enqueue(row['chat_id'], text, **kwargs))
+                    )
+                await rendered.put((enqueued, dropped))
+        await rendered.put(None)
+
+    async def _send_stage(self, rendered: asyncio.Queue) -> int:
+        delivered = 0
+        sent_ids = []
+        failed_ids = []
+        dropped = []
+
+        while (item := await rendered.get()) is not None:
+            enqueued, undeliverable = item
+            dropped.extend(undeliverable)
+            for outbox_id, future in enqueued:
+                if await future:
+                    sent_ids.append(outbox_id)
+                else:
+                    failed_ids.append(outbox_id)
+
+            # Статусы пишутся порциями, а не на каждое сообщение
+            if len(sent_ids) + len(failed_ids) + len(dropped) >= self.batch_size:
+                delivered += await self._mark(sent_ids, failed_ids, dropped)
+                sent_ids, failed_ids, dropped = [], [], []
+
+        return delivered + await self._mark(sent_ids, failed_ids, dropped)
+
+    async def _mark(self, sent_ids: List[int], failed_ids: List[int],
+                    dropped: List[Tuple[int, str]]) -> int:
+        await self.db.mark_outbox_sent(sent_ids)
+        await self.db.mark_outbox_failed(failed_ids, self.max_attempts)
+        await self.db.mark_outbox_undeliverable(dropped)
+        return len(sent_ids)
+
+    async def _hydrate(self, rows) -> Dict[int, RenderedProfile]:
+        """Анкеты получателей и партнеров порции: из кэша или одним запросом"""
+        profiles: Dict[int, RenderedProfile] = {}
+        missing = []
+        for row in rows:
+            for user_id in [row['chat_id'], *self._partner_ids(row)]:
+                if user_id in profiles:
+                    continue
+                profile = self.profiles.get(user_id)
+                if profile is None:
+                    missing.append(user_id)
+                else:
+                    profiles[user_id] = profile
+
+        if missing:
+            users = await self.db.get_users_by_ids(missing)
+            for user_id, user in users.items():
+                profile = RenderedProfile(user.first_name, format_partner(user))
+                self.profiles.set(user_id, profile)
+                profiles[user_id] = profile
+        return profiles
+
+    @staticmethod
+    def _partner_ids(row: dict) -> List[int]:
+        """Партнеры из payload; строки до появления троек хранят partner_id"""
+        payload = row['payload']
+        if 'partner_ids' in payload:
+            return payload['partner_ids']
+        if 'partner_id' in payload:
+            return [payload['partner_id']]
+        return []
+
+    @classmethod
+    def _render(cls, row: dict, profiles: Dict[int, RenderedProfile],
+                keyboards: Optional[dict] = None) -> Tuple[str, dict]:
+        """Собрать текст и параметры сообщения по строке outbox.
+
+        Клавиатура зависит только от встречи, поэтому в keyboards она
+        запоминается по match_id для остальных участников. Если анкета
+        получателя или партнера удалена, поднимает UndeliverableMessage.
+        """
+        user = profiles.get(row['chat_id'])
+        if user is None:
+            raise UndeliverableMessage("recipient_deleted")
+
+        if row['kind'] == 'match':
+            partners = [profiles.get(partner_id) for partner_id in cls._partner_ids(row)]
+            if not partners or None in partners:
+                raise UndeliverableMessage("partner_deleted")
+            match_id = row['payload']['match_id']
+            text = format_match_message([partner.text for partner in partners], match_id)
+            keyboard = keyboards.get(match_id) if keyboards is not None else None
+            if keyboard is None:
+                keyboard = get_match_with_feedback_keyboard(match_id)
+                if keyboards is not None:
+                    keyboards[match_id] = keyboard
+            return text, {'reply_markup': keyboard, 'parse_mode': "HTML"}
+
+        if row['kind'] == 'no_match':
+            return format_no_match_text(user.first_name), {}
+
+        logger.error(f"Неизвестный тип сообщения outbox: {row['kind']}")
+        raise UndeliverableMessage(f"unknown_kind:{row['kind']}")
+
+    def wake(self):
+        """Разбудить фоновую доставку"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        """Запустить фоновую доставку; первый проход дошлет хвост после рестарта"""
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновую доставку"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                delivered = await self.drain()
+                if delivered:
+                    logger.info(f"Доставлено сообщений из outbox: {delivered}")
+            except Exception as e:
+                logger.error(f"Ошибка при доставке outbox: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
@@ -0,0 +1,80 @@
+import asyncio
+import logging
+from typing import List, Optional
+
+from matching import MatchingResult, MatchingService
+from outbox import OutboxDrainer, run_stages
+
+logger = logging.getLogger(__name__)
+
+# Сколько встреч сохраняется одной транзакцией
+PIPELINE_BATCH = 500
+# Сколько порций ждут в очереди между стадиями
+PIPELINE_DEPTH = 2
+
+
+class MatchingPipeline:
+    """Фаза 2 конвейером: мэтчинг → сохранение → отрисовка → отправка.
+
+    Стадии связаны ограниченными очередями и работают одновременно:
+    первая порция встреч уходит пользователям, пока сохраняются
+    следующие, и общее время определяется самой медленной стадией.
+    Каждая порция сохраняется вместе со своими строками outbox и
+    помечается сессией, поэтому после падения повтор фазы 2 распределит
+    только оставшихся участников, а неотправленное дошлет drain.
+    Сообщения без пары и завершение сессии идут последней порцией.
+
+    Сам мэтчинг не потоковый: стратегиям нужен весь граф участников
+    (максимальное паросочетание, тройки из оставшихся), поэтому пары
+    считаются одним шагом, и конвейер начинается с нарезки готового
+    результата на порции.
+    """
+
+    def __init__(self, service: MatchingService, drainer: OutboxDrainer,
+                 batch_size: int = PIPELINE_BATCH, depth: int = PIPELINE_DEPTH):
+        self.service = service
+        self.drainer = drainer
+        self.batch_size = max(1, batch_size)
+        self.depth = depth
+
+    async def run(self, session_id: Optional[int] = None) -> MatchingResult:
+        """Создать пары сессии и разослать уведомления по мере сохранения"""
+        groups = asyncio.Queue(maxsize=self.depth)
+        rows = asyncio.Queue(maxsize=self.depth)
+
+        # Пока конвейер пишет строки outbox, фоновый drain их не берет
+        async with self.drainer.lock:
+            result, match_ids, delivered = await run_stages(
+                self._match(session_id, groups),
+                self._persist(session_id, groups, rows),
+                self.drainer.deliver(rows),
+            )
+
+        self.service.assign_match_ids(result, match_ids)
+        logger.info(f"Отправлено уведомлений о мэтчинге: {delivered}")
+        return result
+
+    async def _match(self, session_id: Optional[int],
+                     groups: asyncio.Queue) -> MatchingResult:
+        result = await self.service.pair_session(session_id)
+
+        # Сначала пары и тройки, затем оставшиеся без пары
+        all_groups = self.service.group_ids(result)
+        for start in range(0, len(all_groups), self.batch_size):
+            await groups.put((all_groups[start:start + self.batch_size], [], False))
+        await groups.put(([], result.unmatched_ids + result.conflicted_ids, True))
+        return result
+
+    async def _persist(self, session_id: Optional[int], groups: asyncio.Queue,
+                       rows: asyncio.Queue) -> List[int]:
+        match_ids = []
+        complete = False
+        while not complete:
+            batch, no_match_user_ids, complete = await groups.get()
+            batch_ids, outbox_rows = await self.service.db.save_matching_batch(
+                batch, no_match_user_ids, session_id, complete
+            )
+            match_ids.extend(batch_ids)
+            await rows.put(outbox_rows)
+        await rows.put(None)
+        return match_ids
@@ -5,18 +5,29 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
 
 from database import Database
-from matching import MatchingService, format_user_profile, format_no_match_message
+from dispatcher import NotificationDispatcher
+from matching import MatchingService, get_matching_strategy
+from outbox import OutboxDrainer
+from pipeline import MatchingPipeline
 from handlers.matching import get_participation_keyboard
-from keyboards import get_match_with_feedback_keyboard
 
 logger = logging.getLogger(__name__)
 
 class MatchingScheduler:
-    def __init__(self, bot, database: Database):
+    def __init__(self, bot, database: Database, matching_strategy: str = "maximum",
+                 triads: bool = True, dispatcher: NotificationDispatcher = None):
         self.bot = bot
         self.db = database
-        self.matching_service = MatchingService(database)
+        self.matching_service = MatchingService(
+            database, strategy=get_matching_strategy(matching_strategy), triads=triads
+        )
         self.scheduler = AsyncIOScheduler()
+        # Рассылка уведомлений с соблюдением лимитов Telegram
+        self.dispatcher = dispatcher or NotificationDispatcher(bot)
+        # Надежная доставка уведомлений фазы 2 через outbox
+        self.outbox = OutboxDrainer(database, self.dispatcher)
+        # Фаза 2: пары рассылаются по мере сохранения порций
+        self.pipeline = MatchingPipeline(self.matching_service, self.outbox)
 
     def start(self):
         """Запустить планировщик"""
@@ -43,6 +54,8 @@ class MatchingScheduler:
         # )
 
         self.scheduler.start()
+        # Фоновая доставка outbox; первый проход дошлет хвост после рестарта
+        self.outbox.start()
         logger.info("Планировщик мэтчинга запущен")
 
     def stop(self):
@@ -60,8 +73,11 @@ class MatchingScheduler:
 
             # Отправляем запросы на подтверждение участия
             pending_users = await self.matching_service.process_pending_confirmations()
+            # Клавиатура одинакова для всех, собираем ее один раз
+            keyboard = get_participation_keyboard()
             for user in pending_users:
-                await self._send_participation_request(user)
+                self._send_participation_request(user, keyboard)
+            await self.dispatcher.join()
 
             logger.info(f"Сессия матчинга #{session_id} начата. "
                        f"Запросов на подтверждение: {len(pending_users)}")
@@ -76,95 +92,52 @@ class MatchingScheduler:
 
             # Проверяем, есть ли активная сессия матчинга
             session = await self.db.get_current_matching_session()
-            if not session or session['status'] != 'collecting':
+            # Сессия в статусе 'pairing' — фаза 2 прервалась; сохраненные
+            # порции помечены сессией, повтор распределит остальных
+            if not session or session['status'] not in ('collecting', 'pairing'):
                 logger.warning("Нет активной сессии сбора участников")
                 return
 
             # Переводим сессию в статус создания пар
             await self.db.update_matching_session_status(session['id'], 'pairing')
 
-            # Создаем пары из всех участников
-            matching_result = await self.matching_service.create_weekly_matches()
-
-            # Отправляем уведомления о парах с кнопками обратной связи
-            for user1, user2 in matching_result.matches:
-                # Получаем ID матча для обратной связи
-                recent_matches = await self.db.get_user_recent_matches(user1.user_id, 1)
-                match_id = recent_matches[0]['match_id'] if recent_matches else None
-
-                await self._send_match_notification_with_feedback(user1, user2, match_id)
-                await self._send_match_notification_with_feedback(user2, user1, match_id)
-
-            # Отправляем уведомления пользователям без пары
-            for user in matching_result.unmatched_users:
-                await self._send_no_match_notification(user)
+            # Пары сохраняются порциями вместе с уведомлениями и сразу
+            # рассылаются; последняя порция завершает сессию
+            matching_result = await self.pipeline.run(session['id'])
 
-            # Отправляем уведомления пользователям с недавними матчами
-            for user in matching_result.users_with_recent_matches:
-                await self._send_no_match_notification(user)
+            logger.info(f"Создано {len(matching_result.pairs)} пар и "
+                       f"{len(matching_result.triples)} троек из всех участников, "
+                       f"пользователей без пары: {len(matching_result.unmatched_ids)}")
 
-            # Завершаем сессию матчинга
-            await self.db.update_matching_session_status(session['id'], 'completed')
-
-            logger.info(f"Создано {len(matching_result.matches)} пар из всех участников, "
-                       f"пользователей без пары: {len(matching_result.unmatched_users)}")
+            # Досылаем хвост прерванного запуска и повторные попытки
+            delivered = await self.outbox.drain()
+            if delivered:
+                logger.info(f"Дослано уведомлений из outbox: {delivered}")
 
         except Exception as e:
             logger.error(f"Ошибка при создании пар: {e}")
 
-    async def _send_match_notification(self, user: object, partner: object):
-        """Отправить уведомление о паре"""
-        try:
-            profile_text = format_user_profile(partner)
-            await self.bot.send_message(
-                chat_id=user.user_id,
-                text=profile_text,
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления пользователю {user.user_id}: {e}")
-
-    async def _send_match_notification_with_feedback(self, user: object, partner: object, match_id: int):
-        """Отправить уведомление о паре с кнопками обратной связи"""
-        try:
-            profile_text = format_user_profile(partner, match_id)
-            await self.bot.send_message(
-                chat_id=user.user_id,
-                text=profile_text,
-                reply_markup=get_match_with_feedback_keyboard(partner.first_name, match_id),
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления пользователю {user.user_id}: {e}")
+    def _send_participation_request(self, user: object, keyboard=None):
+        """Поставить в очередь запрос на участие в мэтчинге"""
+        message_text = (
+            f"☕ Привет, {user.first_name}!\n\n"
+            f"Наступило время еженедельного Random Coffee!\n"
+            f"Хотите участвовать в мэтчинге на этой неделе?\n\n"
+            f"Если да, завтра мы подберем вам интересного собеседника для встречи за кофе."
+        )
 
-    async def _send_no_match_notification(self, user: object):
-        """Отправить уведомление о том, что пара не найдена"""
-        try:
-            no_match_text = format_no_match_message(user)
-            await self.bot.send_message(
-                chat_id=user.user_id,
-                text=no_match_text
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке уведомления об отсутствии пары пользователю {user.user_id}: {e}")
+        return self.dispatcher.enqueue(
+            user.user_id,
+            message_text,
+            reply_markup=keyboard or get_participation_keyboard()
+        )
 
-    async def _send_participation_request(self, user: object):
-        """Отправить запрос на участие в мэтчинге"""
-        try:
-            message_text = (
-                f"☕ Привет, {user.first_name}!\n\n"
-                f"Наступило время еженедельного Random Coffee!\n"
-                f"Хотите участвовать в мэтчинге на этой неделе?\n\n"
-                f"Если да, завтра мы подберем вам интересного собеседника для встречи за кофе."
-            )
-
-            await self.bot.send_message(
-                chat_id=user.user_id,
-                text=message_text,
-                reply_markup=get_participation_keyboard()
-            )
-        except Exception as e:
-            logger.error(f"Ошибка при отправке запроса участия пользователю {user.user_id}: {e}")
+    async def resume_interrupted_matching(self):
+        """Повторить фазу 2, если процесс упал во время создания пар"""
+        session = await self.db.get_current_matching_session()
+        if session and session['status'] == 'pairing':
+            logger.info(f"Возобновляем создание пар для сессии #{session['id']}")
+            await self.create_confirmed_matches()
 
     # Методы для ручного запуска (для админов)
     async def manual_start_matching(self):
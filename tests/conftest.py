@@ -2,10 +2,13 @@ import pytest
 import pytest_asyncio
 import tempfile
 import os
+from unittest.mock import AsyncMock
 
 from database import Database
+from dispatcher import NotificationDispatcher
 from models import User, ParticipationStatus
 from matching import MatchingService
+from outbox import OutboxDrainer
 
 
 @pytest_asyncio.fixture(scope="function")
@@ -20,6 +23,8 @@ async def temp_db():
 
     yield db
 
+    await db.close()
+
     # Удаляем временный файл после теста
     try:
         os.unlink(temp_file.name)
@@ -91,3 +96,23 @@ async def populated_db(temp_db, sample_users):
     for user in sample_users:
         await temp_db.create_or_update_user(user)
     yield temp_db
+
+
+@pytest.fixture(scope="function")
+def mock_bot():
+    """Мок бота: отправленные сообщения видны в send_message"""
+    return AsyncMock()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def dispatcher(mock_bot):
+    """Диспетчер рассылки поверх мока бота"""
+    dispatcher = NotificationDispatcher(mock_bot)
+    yield dispatcher
+    await dispatcher.close()
+
+
+@pytest_asyncio.fixture(scope="function")
+async def drainer(populated_db, dispatcher):
+    """Доставка outbox базы с тестовыми пользователями"""
+    return OutboxDrainer(populated_db, dispatcher)
@@ -1,6 +1,17 @@
+import asyncio
+import sqlite3
+import time
 import pytest
 from datetime import datetime, timedelta
+from unittest.mock import patch
 
+from aiogram.fsm.storage.base import StorageKey
+
+from benchmarks.query_plans import record_hot_queries
+from database import Database, PARTICIPATION_STATUSES, user_page_key
+from fsm_storage import SQLiteStorage
+from handlers.profile import ProfileStates
+from migrate_db import LATEST_VERSION, MIGRATIONS, check_query_plans, run_migrations
 from models import User, ParticipationStatus
 
 class TestDatabase:
@@ -128,6 +139,11 @@ class TestDatabase:
     @pytest.mark.asyncio
     async def test_pending_matches_workflow(self, populated_db):
         """Тест работы с ожидающими подтверждения участниками"""
+        # Без активной сессии участника некуда добавить
+        with pytest.raises(ValueError):
+            await populated_db.create_pending_match(1)
+        await populated_db.create_matching_session()
+
         # Создаем записи для ожидающих
         await populated_db.create_pending_match(1)
         await populated_db.create_pending_match(2)
@@ -151,3 +167,413 @@ class TestDatabase:
         await populated_db.clear_pending_matches()
         pending_after_clear = await populated_db.get_pending_participants()
         assert len(pending_after_clear) == 0
+
+    @pytest.mark.asyncio
+    async def test_concurrent_pool_access(self, temp_db):
+        """Тест параллельных чтений и записей через пул соединений"""
+        users = [
+            User(i, f"user{i}", f"User{i}", None, None, None,
+                 ParticipationStatus.ALWAYS)
+            for i in range(1, 21)
+        ]
+
+        await asyncio.gather(*(temp_db.create_or_update_user(u) for u in users))
+        retrieved = await asyncio.gather(*(temp_db.get_user(u.user_id) for u in users))
+
+        assert all(user is not None for user in retrieved)
+        assert await temp_db.get_users_count() == 20
+
+    @pytest.mark.asyncio
+    async def test_create_matches_bulk(self, temp_db):
+        """Тест пакетного создания пар с возвратом ID"""
+        pairs = [(1, 2), (3, 4), (5, 6)]
+
+        match_ids = await temp_db.create_matches_bulk(pairs)
+
+        assert len(match_ids) == 3
+        assert len(set(match_ids)) == 3
+        assert await temp_db.check_recent_match(4, 3, days=1) is True
+        assert await temp_db.create_matches_bulk([]) == []
+
+    @pytest.mark.asyncio
+    async def test_migrations_and_query_plans(self, temp_db):
+        """Тест версии схемы и использования индексов горячими запросами"""
+        # Планы строятся по SQL, который действительно выполнили методы
+        statements = await record_hot_queries(temp_db)
+        assert any("ORDER BY started_at DESC, id DESC" in sql for sql in statements)
+
+        conn = sqlite3.connect(temp_db.db_path)
+        try:
+            assert conn.execute("PRAGMA user_version").fetchone()[0] == LATEST_VERSION
+            # Повторный запуск ничего не применяет
+            assert run_migrations(conn) == 0
+            assert check_query_plans(conn, statements) == []
+
+            # Без индекса сессий проверка находит полные сканирования
+            conn.execute("DROP INDEX idx_sessions_status_started")
+        finally:
+            conn.close()
+
+        # Новое соединение: закэшированный EXPLAIN показал бы старый план
+        conn = sqlite3.connect(temp_db.db_path)
+        try:
+            problems = check_query_plans(conn, statements)
+            assert problems and all(p.endswith("SCAN matching_sessions") for p in problems)
+        finally:
+            conn.close()
+
+    def test_timestamps_migrate_to_epoch(self, tmp_path):
+        """Тест: строковые метки обоих форматов переводятся в секунды эпохи"""
+        conn = sqlite3.connect(str(tmp_path / "old.db"))
+        try:
+            for migration in MIGRATIONS[:9]:
+                migration.apply(conn.cursor())
+            conn.execute("PRAGMA user_version = 9")
+            conn.executemany("""
+                INSERT INTO matches (user1_id, user2_id, created_at) VALUES (?, ?, ?)
+            """, [(1, 2, '2024-01-02 10:00:00'), (3, 4, '2024-01-02T09:00:00')])
+            conn.commit()
+
+            assert run_migrations(conn) == len(MIGRATIONS) - 9
+            rows = conn.execute(
+                "SELECT created_at FROM matches ORDER BY created_at"
+            ).fetchall()
+            assert rows == [(1704186000,), (1704189600,)]
+            assert conn.execute(
+                "SELECT day, count FROM match_counts_daily"
+            ).fetchall() == [('2024-01-02', 2)]
+        finally:
+            conn.close()
+
+    def test_local_deadline_migrates_to_utc(self, tmp_path, monkeypatch):
+        """Тест: дедлайн из datetime.now() переводится из локального времени в UTC"""
+        # Сервер в UTC+5 без перехода на летнее время
+        monkeypatch.setenv('TZ', 'UTC-5')
+        time.tzset()
+        conn = sqlite3.connect(str(tmp_path / "old.db"))
+        try:
+            for migration in MIGRATIONS[:9]:
+                migration.apply(conn.cursor())
+            conn.execute("PRAGMA user_version = 9")
+            conn.execute("""
+                INSERT INTO matching_sessions (started_at, deadline)
+                VALUES ('2024-01-02 10:00:00', '2024-01-02T15:00:00.123456')
+            """)
+            conn.commit()
+
+            run_migrations(conn)
+            row = conn.execute(
+                "SELECT started_at, deadline FROM matching_sessions"
+            ).fetchone()
+            # CURRENT_TIMESTAMP уже в UTC, локальные 15:00 — это 10:00 UTC
+            assert row == (1704189600, 1704189600)
+        finally:
+            conn.close()
+            monkeypatch.undo()
+            time.tzset()
+
+    @pytest.mark.asyncio
+    async def test_active_session_keeps_always_participants(self, tmp_path):
+        """Тест: активная при обновлении сессия получает участников "всегда" снимком"""
+        path = str(tmp_path / "old.db")
+        conn = sqlite3.connect(path)
+        try:
+            for migration in MIGRATIONS[:8]:
+                migration.apply(conn.cursor())
+            conn.execute("PRAGMA user_version = 8")
+            conn.executemany("""
+                INSERT INTO users (user_id, first_name, participation_status, is_active)
+                VALUES (?, ?, ?, ?)
+            """, [(1, 'Alice', 'always', 1), (2, 'Bob', 'ask_each_time', 1),
+                  (3, 'Charlie', 'always', 0)])
+            conn.execute("INSERT INTO matching_sessions (deadline) VALUES ('2024-01-02T10:00:00')")
+            conn.execute("INSERT INTO pending_matches (user_id, confirmed) VALUES (2, 1)")
+            conn.commit()
+        finally:
+            conn.close()
+
+        db = Database(path)
+        try:
+            participants = await db.load_participants(1)
+            assert list(participants.user_ids) == [1, 2]
+        finally:
+            await db.close()
+
+    @pytest.mark.asyncio
+    async def test_time_windows_use_datetimes(self, temp_db):
+        """Тест: окна по времени принимают и возвращают datetime"""
+        now = datetime(2024, 3, 1, 12, 0)
+        temp_db.clock = lambda: now
+        await temp_db.create_or_update_user(
+            User(1, "user1", "User1", None, None, None, ParticipationStatus.ALWAYS)
+        )
+        await temp_db.create_or_update_user(
+            User(2, "user2", "User2", None, None, None, ParticipationStatus.ALWAYS)
+        )
+        await temp_db.create_match(1, 2)
+
+        assert (await temp_db.get_user(1)).created_at == now
+        assert await temp_db.check_recent_match(1, 2, since=now - timedelta(seconds=1))
+        assert not await temp_db.check_recent_match(1, 2, since=now)
+        assert await temp_db.get_recent_pairs(since=now + timedelta(days=1)) == []
+
+        recent = await temp_db.get_user_recent_matches(1)
+        assert recent[0]['created_at'] == now
+
+        # Через неделю встреча выходит из окна обратной связи
+        now += timedelta(days=8)
+        assert await temp_db.get_user_recent_matches(1) == []
+
+    @pytest.mark.asyncio
+    async def test_pair_history_follows_matches(self, temp_db):
+        """Тест: история пар обновляется при создании встреч и отзывах"""
+        now = datetime(2024, 3, 1, 12, 0)
+        temp_db.clock = lambda: now
+        [first] = await temp_db.create_matches_bulk([(2, 1)])
+        now += timedelta(days=7)
+        [triad] = await temp_db.create_matches_bulk([(1, 2, 3)])
+        await temp_db.record_meeting_feedback(first, 1, "met")
+        await temp_db.record_meeting_feedback(triad, 3, "not_met")
+
+        conn = sqlite3.connect(temp_db.db_path)
+        try:
+            rows = conn.execute("""
+                SELECT user1_id, user2_id, meet_count, last_feedback
+                FROM pair_history ORDER BY 1, 2
+            """).fetchall()
+        finally:
+            conn.close()
+
+        # Отзыв о старой встрече не перекрывает последнюю
+        assert rows == [(1, 2, 2, "not_met"), (1, 3, 1, "not_met"), (2, 3, 1, "not_met")]
+        assert sorted(await temp_db.get_recent_pairs(days=1)) == [(1, 2), (1, 3), (2, 3)]
+        assert await temp_db.check_recent_match(3, 2, days=1)
+        assert not await temp_db.check_recent_match(2, 3, since=now)
+
+    @pytest.mark.asyncio
+    async def test_fsm_storage_survives_restart(self, temp_db):
+        """Тест: состояние FSM переживает перезапуск и устаревает по TTL"""
+        now = [1_000_000.0]
+        key = StorageKey(bot_id=42, chat_id=1, user_id=1)
+
+        storage = SQLiteStorage(temp_db, cache_size=2, state_ttl=3600,
+                                clock=lambda: now[0])
+        await storage.set_state(key, ProfileStates.waiting_for_bio)
+        await storage.update_data(key, {"bio": "Люблю кофе"})
+        await storage.close()
+
+        restarted = SQLiteStorage(temp_db, state_ttl=3600, clock=lambda: now[0])
+        assert await restarted.get_state(key) == ProfileStates.waiting_for_bio.state
+        assert await restarted.get_data(key) == {"bio": "Люблю кофе"}
+
+        # Брошенная анкета устаревает и удаляется из базы
+        now[0] += 7200
+        assert await restarted.get_state(key) is None
+        assert await restarted.purge() == 1
+        await restarted.close()
+
+    @pytest.mark.asyncio
+    async def test_cached_user_invalidation(self, temp_db):
+        """Тест кэша анкет: повторное чтение без запроса, сброс при записи"""
+        assert await temp_db.get_cached_user(1) is None
+
+        user = User(1, "user1", "User1", None, None, None, ParticipationStatus.ALWAYS)
+        await temp_db.create_or_update_user(user)
+
+        cached = await temp_db.get_cached_user(1)
+        assert cached.participation_status == ParticipationStatus.ALWAYS
+
+        # Изменение копии не портит кэш, а повторное чтение не ходит в базу
+        cached.participation_status = ParticipationStatus.NEVER
+        with patch.object(temp_db, 'get_user', side_effect=AssertionError):
+            again = await temp_db.get_cached_user(1)
+        assert again.participation_status == ParticipationStatus.ALWAYS
+
+        await temp_db.create_or_update_user(cached)
+        assert (await temp_db.get_cached_user(1)).participation_status == ParticipationStatus.NEVER
+
+        await temp_db.delete_user(1)
+        assert await temp_db.get_cached_user(1) is None
+
+    @pytest.mark.asyncio
+    async def test_cached_user_read_racing_write(self, temp_db):
+        """Тест: чтение, начатое до записи, не кладет в кэш устаревшую анкету"""
+        user = User(1, "user1", "User1", None, None, None, ParticipationStatus.ALWAYS)
+        await temp_db.create_or_update_user(user)
+
+        read_done = asyncio.Event()
+        release = asyncio.Event()
+        get_user = temp_db.get_user
+
+        async def slow_get_user(user_id):
+            row = await get_user(user_id)
+            read_done.set()
+            await release.wait()
+            return row
+
+        # Чтение получает старую строку и ждет, пока запись сбросит кэш
+        with patch.object(temp_db, 'get_user', side_effect=slow_get_user):
+            reader = asyncio.create_task(temp_db.get_cached_user(1))
+            await read_done.wait()
+            user.participation_status = ParticipationStatus.NEVER
+            await temp_db.create_or_update_user(user)
+            release.set()
+            stale = await reader
+
+        assert stale.participation_status == ParticipationStatus.ALWAYS
+        assert (await temp_db.get_cached_user(1)).participation_status == ParticipationStatus.NEVER
+
+    @pytest.mark.asyncio
+    async def test_statistics_counters_follow_changes(self, populated_db, sample_users):
+        """Тест: счетчики статистики совпадают с полным пересчетом"""
+        await populated_db.create_matches_bulk([(1, 2), (3, 4)])
+        await populated_db.create_matching_session()
+        await populated_db.create_pending_match(1)
+        await populated_db.create_pending_match(2)
+        await populated_db.confirm_pending_participation(1)
+
+        user = sample_users[0]
+        user.participation_status = ParticipationStatus.NEVER
+        await populated_db.create_or_update_user(user)
+        await populated_db.delete_user(sample_users[1].user_id)
+
+        stats = await populated_db.get_matching_statistics()
+        await populated_db.rebuild_statistics()
+        assert await populated_db.get_matching_statistics() == stats
+
+        assert stats['total_matches'] == 2
+        assert stats['recent_matches'] == 2
+        assert stats['active_users'] == len(sample_users) - 1
+        assert stats['pending_users'] == 1
+        assert stats['confirmed_users'] == 1
+        assert stats['participation_stats'][ParticipationStatus.NEVER.value] >= 1
+
+    @pytest.mark.asyncio
+    async def test_session_participants_snapshot(self, populated_db, sample_users):
+        """Тест: участники сессии фиксируются снимком и остаются в истории"""
+        first = await populated_db.create_matching_session()
+        await populated_db.create_pending_match(3, first)
+        # Пересекающаяся сессия для другой когорты
+        second = await populated_db.create_matching_session()
+        await populated_db.confirm_pending_participation(3, first)
+
+        # Смена статуса после старта не меняет снимок
+        user = sample_users[0]
+        user.participation_status = ParticipationStatus.NEVER
+        await populated_db.create_or_update_user(user)
+
+        first_ids = [u.user_id for u in await populated_db.get_session_participants(first)]
+        second_ids = [u.user_id for u in await populated_db.get_session_participants(second)]
+        assert sorted(first_ids) == [1, 2, 3, 4]
+        assert sorted(second_ids) == [1, 2, 4]
+        assert (await populated_db.get_matching_statistics())['confirmed_users'] == 1
+
+        await populated_db.commit_matching_round([(1, 2), (3, 4)], [], first)
+
+        # Сессия завершена, но ее участники сохранились
+        assert len(await populated_db.get_session_participants(first)) == 4
+        assert (await populated_db.get_current_matching_session())['id'] == second
+        stats = await populated_db.get_matching_statistics()
+        assert stats['confirmed_users'] == 0
+        await populated_db.rebuild_statistics()
+        assert await populated_db.get_matching_statistics() == stats
+
+    @pytest.mark.asyncio
+    async def test_bulk_pending_matches(self, populated_db):
+        """Тест: запросы подтверждения создаются одним запросом для всех ask_each_time"""
+        session_id = await populated_db.create_matching_session()
+
+        assert await populated_db.create_pending_matches(session_id) == 1
+        pending = await populated_db.get_pending_participants(session_id)
+        assert [user.user_id for user in pending] == [3]
+
+        # Повторный вызов не дублирует запросы
+        assert await populated_db.create_pending_matches(session_id) == 0
+        assert (await populated_db.get_matching_statistics())['pending_users'] == 1
+
+    @pytest.mark.asyncio
+    async def test_load_participants_arrays(self, populated_db):
+        """Тест: участники сессии читаются порциями в массивы ID и тегов"""
+        session_id = await populated_db.create_matching_session()
+        await populated_db.create_pending_matches(session_id)
+        await populated_db.confirm_pending_participation(3, session_id)
+
+        participants = await populated_db.load_participants(
+            session_id, with_tags=True, batch_size=2
+        )
+
+        assert participants.user_ids.typecode == 'q'
+        assert list(participants.user_ids) == [1, 2, 3, 4]
+        assert participants.status(2) == ParticipationStatus.ASK_EACH_TIME
+        assert [PARTICIPATION_STATUSES[code] for code in participants.status_codes].count(
+            ParticipationStatus.ALWAYS
+        ) == 3
+        # У каждого из четверых по два тега из анкеты
+        assert len(participants.tag_offsets) == 5
+        assert [participants.tag_offsets[i + 1] - participants.tag_offsets[i]
+                for i in range(4)] == [2, 2, 2, 2]
+
+        # Без сессии: "всегда" и подтвердившие в активных сессиях
+        active = await populated_db.load_participants()
+        assert list(active.user_ids) == [1, 2, 3, 4] and active.tag_ids is None
+
+    @pytest.mark.asyncio
+    async def test_users_keyset_pagination(self, temp_db):
+        """Тест постраничного просмотра пользователей по курсору"""
+        for i in range(1, 26):
+            await temp_db.create_or_update_user(
+                User(i, f"user{i}", f"User{i}", None, None, None,
+                     ParticipationStatus.ALWAYS)
+            )
+
+        assert await temp_db.get_users_count() == 25
+
+        pages = []
+        keys = []
+        cursor = None
+        while True:
+            page = await temp_db.get_users_page(10, after=cursor)
+            if not page:
+                break
+            pages.append([user.user_id for user in page])
+            keys.append((user_page_key(page[0]), user_page_key(page[-1])))
+            cursor = keys[-1][1]
+
+        # Все пользователи ровно по одному разу, новые сначала
+        assert [len(page) for page in pages] == [10, 10, 5]
+        assert sorted(sum(pages, [])) == list(range(1, 26))
+        assert pages[0] == [user.user_id for user in await temp_db.get_users_page(10)]
+
+        # Шаг назад со второй страницы возвращает первую
+        back = await temp_db.get_users_page(10, before=keys[1][0])
+        assert [user.user_id for user in back] == pages[0]
+
+        # Удаление опорного пользователя не сбивает курсор
+        await temp_db.delete_user(pages[0][-1])
+        assert await temp_db.get_users_count() == 24
+        after_deleted = await temp_db.get_users_page(10, after=keys[0][1])
+        assert [user.user_id for user in after_deleted] == pages[1]
+
+    @pytest.mark.asyncio
+    async def test_interest_index_updates_incrementally(self, temp_db):
+        """Тест: индекс интересов следует за правками анкеты и перестраивается"""
+        alice = User(1, "alice", "Alice", None, None, "Шахматы, кофе",
+                     ParticipationStatus.ALWAYS)
+        bob = User(2, "bob", "Bob", None, None, "кофе, бег",
+                   ParticipationStatus.ALWAYS)
+        await temp_db.create_or_update_user(alice)
+        await temp_db.create_or_update_user(bob)
+
+        postings = await temp_db.get_tag_postings([1, 2])
+        assert sorted(map(sorted, postings.values())) == [[1, 2]]
+
+        alice.interests = "бег"
+        await temp_db.create_or_update_user(alice)
+        postings = await temp_db.get_tag_postings([1, 2])
+        assert len(postings) == 1
+
+        assert await temp_db.rebuild_interest_index() == 3
+        assert len(await temp_db.get_tag_postings([1, 2])) == 1
+
+        await temp_db.delete_user(2)
+        assert await temp_db.get_tag_postings([1, 2]) == {}
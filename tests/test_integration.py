@@ -1,10 +1,29 @@
+import asyncio
+import copy
+import json
+import sqlite3
+import time
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
 from datetime import datetime, timedelta
 
+from aiogram import Bot, Dispatcher, F
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.filters import CommandStart
+from aiogram.methods import SendMessage
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from benchmarks.population import DEFAULT_STATUSES, load_population, make_population
+from benchmarks.replay import Replay
+from benchmarks.suite import STAGES, compare, run_suite
+from dispatcher import NotificationDispatcher
 from models import User, ParticipationStatus
 from matching import MatchingService
+from pipeline import MatchingPipeline
 from scheduler import MatchingScheduler
+from webhook import QueuedRequestHandler
+from webhook_harness import make_updates
 
 class TestIntegration:
     """Интеграционные тесты всей системы"""
@@ -28,6 +47,342 @@ class TestIntegration:
         pending = await populated_db.get_pending_participants()
         assert len(pending) == 1  # Charlie
 
+        await scheduler.dispatcher.close()
+
+    @pytest.mark.asyncio
+    async def test_confirmed_matches_use_created_match_ids(self, populated_db):
+        """Тест фазы 2: уведомления получают ID созданных пар без перезапросов"""
+        mock_bot = AsyncMock()
+        scheduler = MatchingScheduler(mock_bot, populated_db)
+
+        await scheduler.start_weekly_matching()
+        await populated_db.confirm_pending_participation(3)
+        mock_bot.send_message.reset_mock()
+
+        with patch.object(populated_db, 'get_user_recent_matches') as recent_mock:
+            await scheduler.create_confirmed_matches()
+            recent_mock.assert_not_called()
+
+        # 4 участника (Alice, Bob, Diana, Charlie) = 2 пары = 4 уведомления
+        assert mock_bot.send_message.call_count == 4
+        for call in mock_bot.send_message.call_args_list:
+            markup = call.kwargs['reply_markup']
+            callback_data = markup.inline_keyboard[0][0].callback_data
+            assert callback_data.startswith("feedback_met_")
+            assert callback_data != "feedback_met_None"
+
+        session = await populated_db.get_current_matching_session()
+        assert session is None
+
+        await scheduler.dispatcher.close()
+
+
+class TestNotificationOutbox:
+    """Тесты outbox уведомлений"""
+
+    @pytest.mark.asyncio
+    async def test_outbox_resumes_after_restart(self, populated_db, mock_bot, drainer):
+        """Тест: неотправленные уведомления досылаются после рестарта ровно один раз"""
+        session_id = await populated_db.create_matching_session()
+        # Без троек третий участник получает сообщение "без пары"
+        service = MatchingService(populated_db, triads=False)
+
+        # Фаза 2 коммитится, но процесс "падает" до рассылки
+        result = await service.create_weekly_matches(session_id)
+        assert len(result.pairs) == 1
+        assert await populated_db.get_current_matching_session() is None
+
+        pending = await populated_db.get_pending_outbox()
+        # 2 уведомления о паре + 1 сообщение пользователю без пары
+        assert sorted(row['kind'] for row in pending) == ['match', 'match', 'no_match']
+
+        # После "рестарта" новый drainer досылает все сообщения
+        assert await drainer.drain() == 3
+        assert mock_bot.send_message.call_count == 3
+        assert await drainer.drain() == 0
+        assert await populated_db.get_pending_outbox() == []
+
+    @pytest.mark.asyncio
+    async def test_deleted_profile_fails_without_retries(self, populated_db, drainer):
+        """Тест: сообщение об удаленной анкете сразу помечается failed с причиной"""
+        session_id = await populated_db.create_matching_session()
+        result = await MatchingService(populated_db, triads=False).create_weekly_matches(session_id)
+        gone_id = result.pairs[0][0]
+        await populated_db.delete_user(gone_id)
+
+        # Доставлено только "без пары"; обе строки пары не ждут повтора
+        assert await drainer.drain() == 1
+        assert await populated_db.get_pending_outbox() == []
+
+        conn = sqlite3.connect(populated_db.db_path)
+        try:
+            rows = dict(conn.execute("""
+                SELECT chat_id, status || ':' || attempts || ':' || error
+                FROM notification_outbox WHERE kind = 'match'
+            """).fetchall())
+        finally:
+            conn.close()
+        partner_id = result.pairs[0][1]
+        assert rows == {gone_id: 'failed:0:recipient_deleted',
+                        partner_id: 'failed:0:partner_deleted'}
+
+    @pytest.mark.asyncio
+    async def test_triad_notification_lists_every_partner(self, populated_db, mock_bot, drainer):
+        """Тест: участник тройки получает анкеты обоих партнеров"""
+        session_id = await populated_db.create_matching_session()
+        service = MatchingService(populated_db, triads=True)
+
+        # Трое участников "всегда" (Alice, Bob, Diana) образуют одну тройку
+        result = await service.create_weekly_matches(session_id)
+        assert len(result.pairs) == 0 and len(result.triples) == 1
+
+        assert await drainer.drain() == 3
+
+        names = {"Alice", "Bob", "Diana"}
+        for call in mock_bot.send_message.call_args_list:
+            text = call.kwargs['text']
+            # В сообщении обе анкеты партнеров, но не своя
+            assert sum(name in text for name in names) == 2
+            assert "втроем" in text
+
+    @pytest.mark.asyncio
+    async def test_profiles_hydrated_once_and_cached(self, populated_db, drainer):
+        """Тест: анкеты порции загружаются одним запросом и дальше берутся из кэша"""
+        session_id = await populated_db.create_matching_session()
+        await MatchingService(populated_db, triads=True).create_weekly_matches(session_id)
+
+        with patch.object(populated_db, 'get_users_by_ids',
+                          wraps=populated_db.get_users_by_ids) as get_users:
+            assert await drainer.drain() == 3
+            # Три участника тройки — один запрос на всю порцию
+            assert get_users.call_count == 1
+
+            # Следующая сессия тем же людям обходится без запросов анкет
+            session_id = await populated_db.create_matching_session()
+            await MatchingService(populated_db, triads=True).create_weekly_matches(session_id)
+            assert await drainer.drain() == 3
+            assert get_users.call_count == 1
+
+
+class TestMatchingPipeline:
+    """Тесты конвейера фазы 2"""
+
+    @staticmethod
+    async def _start_session(db):
+        """Сессия из четырех участников: трое "всегда" и подтвердивший Charlie"""
+        session_id = await db.create_matching_session()
+        await db.create_pending_matches(session_id)
+        await db.confirm_pending_participation(3)
+        return session_id
+
+    @pytest.mark.asyncio
+    async def test_first_pair_sent_before_round_is_saved(self, populated_db, mock_bot, drainer):
+        """Тест: уведомления первой порции уходят до сохранения последней"""
+        session_id = await self._start_session(populated_db)
+        events = []
+        mock_bot.send_message.side_effect = lambda **kwargs: events.append('send')
+        save = populated_db.save_matching_batch
+
+        async def record_save(*args, **kwargs):
+            result = await save(*args, **kwargs)
+            events.append('save')
+            return result
+
+        pipeline = MatchingPipeline(MatchingService(populated_db), drainer, batch_size=1)
+        with patch.object(populated_db, 'save_matching_batch', side_effect=record_save):
+            result = await pipeline.run(session_id)
+
+        # Две пары по одной на порцию и завершающая порция
+        assert len(result.match_ids) == 2 and None not in result.match_ids
+        assert events.count('save') == 3 and events.count('send') == 4
+        last_save = max(i for i, event in enumerate(events) if event == 'save')
+        assert events.index('send') < last_save
+        assert await populated_db.get_current_matching_session() is None
+        assert await populated_db.get_pending_outbox() == []
+
+    @pytest.mark.asyncio
+    async def test_resume_pairs_only_remaining_participants(self, populated_db, mock_bot, drainer):
+        """Тест: после падения посреди фазы 2 сохраненные пары не пересоздаются"""
+        session_id = await self._start_session(populated_db)
+        service = MatchingService(populated_db)
+        save = populated_db.save_matching_batch
+        calls = []
+
+        async def crash_after_first(*args, **kwargs):
+            calls.append(args)
+            if len(calls) > 1:
+                raise RuntimeError("процесс упал")
+            return await save(*args, **kwargs)
+
+        with patch.object(populated_db, 'save_matching_batch', side_effect=crash_after_first):
+            with pytest.raises(RuntimeError):
+                await MatchingPipeline(service, drainer, batch_size=1).run(session_id)
+
+        # Первая пара сохранена, сессия ждет повтора
+        groups = calls[0][0]
+        first_pair = set(groups[0])
+        assert (await populated_db.get_current_matching_session())['status'] != 'completed'
+
+        await drainer.drain()
+        result = await MatchingPipeline(service, drainer, batch_size=1).run(session_id)
+        await drainer.drain()
+
+        repeated = {user_id for group in service.group_ids(result) for user_id in group}
+        assert not repeated & first_pair
+        assert repeated | set(result.unmatched_ids + result.conflicted_ids) == {1, 2, 3, 4} - first_pair
+        # Каждый участник получил ровно одно сообщение
+        recipients = [call.kwargs['chat_id'] for call in mock_bot.send_message.call_args_list]
+        assert sorted(recipients) == [1, 2, 3, 4]
+        assert await populated_db.get_current_matching_session() is None
+
+
+class TestNotificationDispatcher:
+    """Тесты диспетчера рассылки"""
+
+    @pytest.mark.asyncio
+    async def test_retry_after_is_respected(self):
+        """Тест: после TelegramRetryAfter сообщение отправляется повторно"""
+        mock_bot = AsyncMock()
+        mock_bot.send_message.side_effect = [
+            TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "flood", 0),
+            None,
+            None,
+        ]
+        dispatcher = NotificationDispatcher(mock_bot, concurrency=2)
+
+        first = dispatcher.enqueue(1, "first")
+        second = dispatcher.enqueue(2, "second")
+        await dispatcher.join()
+
+        assert await first is True and await second is True
+        assert mock_bot.send_message.call_count == 3
+        assert dispatcher.sent == 2 and dispatcher.failed == 0
+        await dispatcher.close()
+
+    @pytest.mark.asyncio
+    async def test_global_rate_limit(self):
+        """Тест: общий темп рассылки не превышает лимит"""
+        mock_bot = AsyncMock()
+        dispatcher = NotificationDispatcher(mock_bot, concurrency=8, rate=50.0)
+
+        start = time.perf_counter()
+        for chat_id in range(100):
+            dispatcher.enqueue(chat_id, "hello")
+        await dispatcher.join()
+        elapsed = time.perf_counter() - start
+
+        # 50 сообщений уходят всплеском, остальные 50 — со скоростью 50/с
+        assert mock_bot.send_message.call_count == 100
+        assert elapsed >= 0.9
+        await dispatcher.close()
+
+
+class TestWebhook:
+    """Тесты режима вебхука"""
+
+    @pytest.mark.asyncio
+    async def test_queued_webhook_processes_updates(self):
+        """Тест: апдейты из вебхука разбираются воркерами, секрет проверяется"""
+        dp = Dispatcher()
+        processed = []
+
+        @dp.message(CommandStart())
+        async def on_start(message):
+            processed.append(("start", message.from_user.id))
+
+        @dp.callback_query(F.data == "participate_yes")
+        async def on_participate(callback):
+            processed.append(("participate", callback.from_user.id))
+
+        bot = Bot("42:TEST")
+        handler = QueuedRequestHandler(dp, bot, workers=4, secret_token="s3cret")
+        app = web.Application()
+        handler.register(app, path="/webhook")
+
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post("/webhook", json=make_updates(1)[0])
+            assert response.status == 401
+
+            headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+            for update in make_updates(50):
+                response = await client.post("/webhook", json=update, headers=headers)
+                assert response.status == 200
+
+            await handler.join()
+
+        assert len(processed) == 50
+        assert sum(1 for kind, _ in processed if kind == "start") == 10
+        await handler.close()
+
+
+class TestBenchmarkSuite:
+    """Тесты набора бенчмарков"""
+
+    def test_suite_reports_metrics_and_regressions(self):
+        """Тест: прогон сохраняет метрики каждой фазы и находит регрессии"""
+        results = run_suite([60], ["random", "interests"], weeks=3,
+                            trace_memory=False, log=lambda line: None)
+        results = json.loads(json.dumps(results))
+
+        assert [case["strategy"] for case in results["cases"]] == ["random", "interests"]
+        for case in results["cases"]:
+            assert tuple(case["stages"]) == STAGES
+            assert all(stage["queries"] > 0 for stage in case["stages"].values())
+            assert 0.9 <= case["matched_fraction"] <= 1.0
+            assert 0.0 <= case["repeat_pair_rate"] <= 1.0
+
+        assert compare(results, results) == []
+
+        slower = copy.deepcopy(results)
+        slower["cases"][0]["stages"]["create_matches"]["queries"] *= 2
+        slower["cases"][1]["matched_fraction"] -= 0.1
+        assert len(compare(results, slower)) == 2
+
+    def test_replay_runs_weekly_cycles_on_virtual_clock(self, tmp_path):
+        """Тест: симуляция проходит недели по виртуальным часам без повторов в окне"""
+        db_path = str(tmp_path / "replay.db")
+        load_population(db_path, make_population(40, statuses=DEFAULT_STATUSES))
+        replay = Replay(db_path, "maximum", start=datetime(2024, 1, 1, 10, 0))
+        report = asyncio.run(replay.run(6, log=lambda line: None))
+
+        assert len(report["weeks"]) == 6
+        assert all(week["meetings"] > 0 for week in report["weeks"])
+        assert report["recent_repeat_pairs"] == 0
+        assert 0 < report["fairness"]["jain_index"] <= 1
+
+        # Пары создаются по вторникам виртуального времени, есть отзывы
+        conn = sqlite3.connect(db_path)
+        days = [row[0] for row in conn.execute(
+            "SELECT DISTINCT date(created_at, 'unixepoch', 'localtime') "
+            "FROM matches ORDER BY 1"
+        )]
+        feedback = conn.execute(
+            "SELECT COUNT(*) FROM matches WHERE meeting_feedback IS NOT NULL"
+        ).fetchone()[0]
+        conn.close()
+        assert days == [
+            "2024-01-02", "2024-01-09", "2024-01-16",
+            "2024-01-23", "2024-01-30", "2024-02-06",
+        ]
+        assert feedback > 0
+
+    def test_replay_delivers_outbox_to_fake_bot(self, tmp_path):
+        """Тест: с deliver уведомления каждой недели доставляются фиктивному боту"""
+        db_path = str(tmp_path / "replay.db")
+        load_population(db_path, make_population(40, statuses=DEFAULT_STATUSES))
+        replay = Replay(db_path, "maximum", start=datetime(2024, 1, 1, 10, 0), deliver=True)
+        report = asyncio.run(replay.run(2, log=lambda line: None))
+
+        assert all("deliver" in week["timings"] for week in report["weeks"])
+        conn = sqlite3.connect(db_path)
+        statuses = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM notification_outbox GROUP BY status"
+        ))
+        conn.close()
+        # Уведомление о паре или об ее отсутствии получает каждый участник
+        assert statuses == {"sent": sum(week["participants"] for week in report["weeks"])}
+
+
 @pytest.mark.stress
 class TestStressTests:
     """Стресс-тесты для больших объемов данных"""
@@ -53,7 +408,6 @@ class TestStressTests:
         matching_service = MatchingService(temp_db)
 
         # Засекаем время выполнения
-        import time
         start_time = time.time()
 
         matches = await matching_service._create_matches_from_users(users)
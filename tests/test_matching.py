@@ -3,7 +3,9 @@ from unittest.mock import AsyncMock, patch
 import random
 
 from models import User, ParticipationStatus
-from matching import MatchingService, format_user_profile
+from matching import (
+    MatchingService, RecentPairIndex, MaximumMatchingStrategy, format_user_profile
+)
 
 
 class TestMatchingService:
@@ -77,6 +79,7 @@ class TestMatchingService:
         empty_matches = await matching_service._create_matches_from_users([])
         assert len(empty_matches) == 0
 
+
 class TestMatchingAntiRepeat:
     """Тесты против повторного мэтчинга одних и тех же пользователей"""
 
@@ -96,11 +99,11 @@ class TestMatchingAntiRepeat:
         await temp_db.create_match(1, 2)
 
         # Проверяем, что пара считается недавней
-        is_recent = await matching_service._were_matched_recently(1, 2, days=30)
-        assert is_recent is True
+        recent = await matching_service.load_recent_pairs()
+        assert recent.contains(1, 2)
 
         # Создаем пары снова - они не должны повториться
-        with patch.object(matching_service, '_were_matched_recently', return_value=True):
+        with patch.object(matching_service, 'load_recent_pairs', return_value=recent):
             matches = await matching_service._create_matches_from_users(users)
             assert len(matches) == 0  # Пары не создались из-за недавнего мэтчинга
 
@@ -132,11 +135,11 @@ class TestMatchingAntiRepeat:
 
         # Симулируем второй раунд через 35 дней (после окончания блокировки)
         # Для этого мы мокаем метод проверки недавних пар
-        async def mock_were_matched_recently(user1_id, user2_id, days=30):
-            # Возвращаем False, имитируя что прошло достаточно времени
-            return False
+        async def mock_load_recent_pairs():
+            # Недавних пар нет, имитируя что прошло достаточно времени
+            return RecentPairIndex([])
 
-        with patch.object(matching_service, '_were_matched_recently', side_effect=mock_were_matched_recently):
+        with patch.object(matching_service, 'load_recent_pairs', side_effect=mock_load_recent_pairs):
             matches_round2 = await matching_service._create_matches_from_users(users)
             assert len(matches_round2) == 2
 
@@ -174,11 +177,10 @@ class TestMatchingAntiRepeat:
 
         for round_num in range(5):  # 5 раундов
             # Мокаем проверку недавних пар для каждого раунда
-            async def mock_were_matched_recently(user1_id, user2_id, days=30):
-                pair = tuple(sorted([user1_id, user2_id]))
-                return pair in all_pairs  # Блокируем уже использованные пары
+            async def mock_load_recent_pairs():
+                return RecentPairIndex(all_pairs)  # Блокируем уже использованные пары
 
-            with patch.object(matching_service, '_were_matched_recently', side_effect=mock_were_matched_recently):
+            with patch.object(matching_service, 'load_recent_pairs', side_effect=mock_load_recent_pairs):
                 matches = await matching_service._create_matches_from_users(users)
 
                 # Добавляем новые пары
@@ -214,7 +216,8 @@ class TestMatchingAntiRepeat:
     @pytest.mark.asyncio
     async def test_confirmed_participation_workflow(self, matching_service, populated_db):
         """Тест работы с подтвержденным участием"""
-        # Создаем pending записи
+        # Создаем pending записи в активной сессии
+        await populated_db.create_matching_session()
         await populated_db.create_pending_match(1)  # Alice
         await populated_db.create_pending_match(2)  # Bob
         await populated_db.create_pending_match(3)  # Charlie
@@ -240,6 +243,312 @@ class TestMatchingAntiRepeat:
         pending_after = await populated_db.get_pending_participants()
         assert len(pending_after) == 0
 
+
+class TestRecentPairIndex:
+    """Тесты индекса недавних пар"""
+
+    def test_unordered_lookup(self):
+        """Тест поиска пары независимо от порядка пользователей"""
+        index = RecentPairIndex([(1, 2), (5, 3)])
+
+        assert index.contains(1, 2)
+        assert index.contains(2, 1)
+        assert index.contains(3, 5)
+        assert not index.contains(1, 3)
+        assert len(index) == 2
+
+    @pytest.mark.asyncio
+    async def test_single_query_per_run(self, matching_service, temp_db):
+        """Тест: за запуск мэтчинга недавние пары загружаются одним запросом"""
+        users = [
+            User(i, f"user{i}", f"User{i}", None, None, None, ParticipationStatus.ALWAYS)
+            for i in range(1, 11)
+        ]
+        for user in users:
+            await temp_db.create_or_update_user(user)
+        await temp_db.create_match(1, 2)
+
+        with patch.object(temp_db, 'check_recent_match') as check_mock, \
+                patch.object(temp_db, 'get_recent_pairs',
+                             wraps=temp_db.get_recent_pairs) as pairs_mock:
+            result = await matching_service._create_matches_from_users(users)
+
+        check_mock.assert_not_called()
+        assert pairs_mock.call_count == 1
+        for user1, user2 in result.matches:
+            assert {user1.user_id, user2.user_id} != {1, 2}
+
+
+class TestRandomPairingRepair:
+    """Тесты локального поиска для случайной стратегии"""
+
+    def test_repair_removes_conflicts(self):
+        """Тест: обмены партнерами убирают почти все конфликты"""
+        from matching import RandomPairingStrategy
+
+        rng = random.Random(11)
+        ids = list(range(1, 2002))
+        recent = RecentPairIndex(
+            (user_id, rng.randint(1, 2001)) for user_id in ids for _ in range(20)
+        )
+
+        plain = RandomPairingStrategy(rng=random.Random(5), repair=False).pair(ids, recent)
+        strategy = RandomPairingStrategy(rng=random.Random(5))
+        repaired = strategy.pair(ids, recent)
+
+        assert len(plain.conflicted) > 0
+        assert len(repaired.conflicted) < len(plain.conflicted) / 10
+        assert strategy.stats['succeeded'] > 0
+        assert strategy.stats['attempted'] >= strategy.stats['succeeded']
+
+        # Каждый участник ровно в одной роли, недавних пар нет
+        seen = [user_id for pair in repaired.pairs for user_id in pair]
+        seen += repaired.unmatched + repaired.conflicted
+        assert sorted(seen) == ids
+        for user1_id, user2_id in repaired.pairs:
+            assert not recent.contains(user1_id, user2_id)
+
+    def test_repair_respects_budget(self):
+        """Тест: при нулевом бюджете пары не меняются"""
+        from matching import RandomPairingStrategy
+
+        recent = RecentPairIndex([(1, 2), (3, 4)])
+        strategy = RandomPairingStrategy(rng=random.Random(0), max_swaps=0)
+        outcome = strategy.pair([1, 2, 3, 4], recent)
+
+        assert strategy.stats['attempted'] == 0
+        assert len(outcome.pairs) + len(outcome.conflicted) // 2 == 2
+
+
+class TestMaximumMatchingStrategy:
+    """Тесты стратегии максимального паросочетания"""
+
+    def test_avoids_recent_pairs_without_losing_users(self):
+        """Тест: недавние пары исключены, но все участники получают пару"""
+        recent = RecentPairIndex([(1, 2), (3, 4), (5, 6)])
+
+        for seed in range(20):
+            strategy = MaximumMatchingStrategy(rng=random.Random(seed))
+            outcome = strategy.pair([1, 2, 3, 4, 5, 6], recent)
+
+            assert len(outcome.pairs) == 3
+            assert outcome.unmatched == [] and outcome.conflicted == []
+            for user1_id, user2_id in outcome.pairs:
+                assert not recent.contains(user1_id, user2_id)
+
+    def test_unmatched_only_without_valid_partner(self):
+        """Тест: без пары остается только тот, кому некого предложить"""
+        # Пользователь 5 недавно встречался со всеми остальными
+        recent = RecentPairIndex([(5, 1), (5, 2), (5, 3), (5, 4), (1, 2)])
+
+        outcome = MaximumMatchingStrategy().pair([1, 2, 3, 4, 5], recent)
+
+        assert len(outcome.pairs) == 2
+        assert outcome.conflicted == [5]
+        assert outcome.unmatched == []
+
+    def test_odd_blossom_structure(self):
+        """Тест: точный поиск находит паросочетание через нечетный цикл"""
+        ids = list(range(1, 7))
+        allowed = {(1, 2), (2, 3), (1, 3), (3, 4), (4, 5), (5, 6)}
+        recent = RecentPairIndex([
+            (a, b) for a in ids for b in ids
+            if a < b and (a, b) not in allowed
+        ])
+
+        for seed in range(20):
+            strategy = MaximumMatchingStrategy(rng=random.Random(seed))
+            assert len(strategy.pair(ids, recent).pairs) == 3
+
+    def test_long_augmenting_path_above_thousand_users(self):
+        """Тест: больше 1000 участников, пару находят и те, кого жадный проход оставил"""
+        # 1 может встретиться только с 3, 2 — только с 4, а 3 и 4 недавно
+        # виделись; жадный проход обычно отдает 3 и 4 другим, и починить
+        # это можно только путем длины 5: 1 - 3 = x - y = 4 - 2
+        ids = list(range(1, 1203))
+        recent = RecentPairIndex(
+            [(1, other) for other in ids if other not in (1, 3)]
+            + [(2, other) for other in ids if other not in (2, 4)]
+            + [(3, 4)]
+        )
+
+        for seed in range(10):
+            outcome = MaximumMatchingStrategy(rng=random.Random(seed)).pair(ids, recent)
+
+            assert len(outcome.pairs) == 601
+            assert outcome.unmatched == [] and outcome.conflicted == []
+            assert (1, 3) in outcome.pairs and (2, 4) in outcome.pairs
+
+    def test_large_population_is_fast(self):
+        """Тест скорости на 20 000 участников с историей встреч"""
+        import time
+
+        rng = random.Random(7)
+        ids = list(range(1, 20001))
+        recent = RecentPairIndex(
+            (user_id, rng.randint(1, 20000)) for user_id in ids for _ in range(4)
+        )
+
+        start = time.perf_counter()
+        outcome = MaximumMatchingStrategy(rng=rng).pair(ids, recent)
+        elapsed = time.perf_counter() - start
+
+        assert len(outcome.pairs) == 10000
+        assert elapsed < 5.0
+
+
+class TestWeightedMatchingStrategy:
+    """Тесты взвешенного мэтчинга по интересам"""
+
+    def test_tokenize_interests(self):
+        """Тест нормализации интересов в токены"""
+        from interests import tokenize_interests
+
+        assert tokenize_interests("Чтение, программирование и IT") == [
+            "чтение", "програ", "it"
+        ]
+        assert tokenize_interests(None) == []
+
+    def test_pairs_users_with_shared_interests(self):
+        """Тест: пары складываются внутри групп с общими интересами"""
+        pytest.importorskip("scipy")
+        from matching import WeightedMatchingStrategy
+
+        topics = ["шахматы, го", "бег, плавание", "джаз, гитара"]
+        profiles = {
+            user_id: User(user_id, None, f"User{user_id}", None, None,
+                          topics[user_id % 3], ParticipationStatus.ALWAYS)
+            for user_id in range(1, 31)
+        }
+        # Одна пара внутри группы уже встречалась
+        recent = RecentPairIndex([(3, 6)])
+
+        strategy = WeightedMatchingStrategy(rng=random.Random(1))
+        outcome = strategy.pair(list(profiles), recent, profiles)
+
+        assert len(outcome.pairs) == 15
+        for user1_id, user2_id in outcome.pairs:
+            assert user1_id % 3 == user2_id % 3
+            assert not recent.contains(user1_id, user2_id)
+        assert set(strategy.timings) >= {"tokenize", "top_k", "greedy"}
+
+    def test_missing_numpy_fails_on_creation(self, monkeypatch):
+        """Тест: без numpy стратегия не создается, и ошибка подсказывает установку"""
+        import interests
+        from matching import get_matching_strategy
+
+        monkeypatch.setattr(interests, "HAS_NUMPY", False)
+        with pytest.raises(ImportError, match="requirements-weighted.txt"):
+            get_matching_strategy("weighted")
+
+
+class TestSharedInterestStrategy:
+    """Тесты стратегии пар по общим интересам"""
+
+    @pytest.mark.asyncio
+    async def test_pairs_by_tag_index(self, temp_db):
+        """Тест: пары собираются по индексу тегов, остальные — запасной стратегией"""
+        from matching import MatchingService, SharedInterestStrategy
+
+        topics = {1: "шахматы", 2: "джаз", 3: "шахматы", 4: "джаз", 5: None, 6: None}
+        for user_id, interests in topics.items():
+            await temp_db.create_or_update_user(
+                User(user_id, None, f"User{user_id}", None, None, interests,
+                     ParticipationStatus.ALWAYS)
+            )
+
+        strategy = SharedInterestStrategy(rng=random.Random(3))
+        service = MatchingService(temp_db, strategy=strategy)
+        result = await service._pair_users(await temp_db.get_participants())
+
+        pairs = {tuple(sorted((u1.user_id, u2.user_id))) for u1, u2 in result.matches}
+        assert {(1, 3), (2, 4), (5, 6)} == pairs
+        assert strategy.stats == {'interest_pairs': 2, 'fallback_pairs': 1}
+
+    @pytest.mark.asyncio
+    async def test_weekly_matches_use_loaded_tags(self, temp_db):
+        """Тест: фаза 2 берет теги из массивов участников, без анкет"""
+        from matching import MatchingService, SharedInterestStrategy
+
+        topics = {1: "шахматы", 2: "джаз", 3: "шахматы", 4: "джаз"}
+        for user_id, interests in topics.items():
+            await temp_db.create_or_update_user(
+                User(user_id, None, f"User{user_id}", None, None, interests,
+                     ParticipationStatus.ALWAYS)
+            )
+
+        session_id = await temp_db.create_matching_session()
+        service = MatchingService(temp_db, strategy=SharedInterestStrategy(rng=random.Random(3)))
+        with patch.object(temp_db, 'get_tag_postings') as postings_mock, \
+                patch.object(temp_db, 'get_users_by_ids') as profiles_mock:
+            result = await service.create_weekly_matches(session_id)
+
+        postings_mock.assert_not_called()
+        profiles_mock.assert_not_called()
+        assert {tuple(sorted(pair)) for pair in result.pairs} == {(1, 3), (2, 4)}
+        assert len(result.match_ids) == 2 and result.profiles == {}
+
+
+class TestTriads:
+    """Тесты групп из трех человек"""
+
+    @pytest.mark.asyncio
+    async def test_odd_user_joins_pair_as_third(self, temp_db):
+        """Тест: при нечетном числе участников образуется тройка"""
+        from matching import MatchingService
+
+        users = [
+            User(i, None, f"User{i}", None, None, None, ParticipationStatus.ALWAYS)
+            for i in range(1, 6)
+        ]
+        for user in users:
+            await temp_db.create_or_update_user(user)
+
+        service = MatchingService(temp_db, triads=True)
+        result = await service._create_matches_from_users(users)
+
+        assert len(result.matches) == 1 and len(result.triads) == 1
+        assert result.unmatched_users == [] and result.users_with_recent_matches == []
+        assert len(result.triad_ids) == 1
+
+        # Все три пары внутри тройки учитываются как недавние встречи
+        triad = [user.user_id for user in result.triads[0]]
+        recent = await service.load_recent_pairs()
+        assert len(recent) == 4
+        assert recent.contains(triad[0], triad[2]) and recent.contains(triad[1], triad[2])
+
+        # Третий участник может оставить обратную связь
+        assert await temp_db.record_meeting_feedback(
+            result.triad_ids[0], triad[2], "meeting_confirmed"
+        )
+        assert not await temp_db.record_meeting_feedback(
+            result.triad_ids[0], result.matches[0][0].user_id, "meeting_confirmed"
+        )
+
+    def test_form_triads_respects_recent_pairs(self):
+        """Тест: третьим не добавляется тот, кто недавно встречался с парой"""
+        from matching import form_triads
+
+        recent = RecentPairIndex([(5, 1), (5, 4)])
+        pairs, triads, remaining = form_triads([(1, 2), (3, 4)], [5], recent)
+
+        assert triads == [] and remaining == [5]
+
+        pairs, triads, remaining = form_triads([(1, 2), (3, 6)], [5], recent)
+        assert triads == [(3, 6, 5)] and pairs == [(1, 2)] and remaining == []
+
+    def test_result_without_profiles(self):
+        """Тест: результат по ID без анкет отдает понятную ошибку вместо KeyError"""
+        from matching import MatchingResult
+
+        result = MatchingResult()
+        assert result.matches == [] and result.unmatched_users == []
+
+        result.pairs = [(1, 2)]
+        with pytest.raises(ValueError, match="pairs"):
+            result.matches
+
+
 class TestMatchingEdgeCases:
     """Тесты граничных случаев мэтчинга"""
 
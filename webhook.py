@@ -0,0 +1,116 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedRequestHandler(SimpleRequestHandler):
+    """Вебхук-обработчик aiogram с очередью и фиксированным числом воркеров.
+
+    Telegram сразу получает ответ 200, а апдейт попадает в ограниченную
+    очередь, которую разбирают workers воркеров. Когда очередь полна,
+    прием новых запросов притормаживает вместо неограниченного роста
+    числа фоновых задач.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, workers: int = 8,
+                 queue_size: int = 1000, secret_token: Optional[str] = None,
+                 **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True,
+                         secret_token=secret_token, **data)
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks: List[asyncio.Task] = []
+
+    def register(self, app: web.Application, /, path: str, **kwargs: Any) -> None:
+        app.on_startup.append(self._handle_startup)
+        super().register(app, path=path, **kwargs)
+
+    async def _handle_startup(self, app: web.Application):
+        self.start()
+
+    def start(self):
+        """Запустить воркеры обработки апдейтов"""
+        if self._worker_tasks:
+            return
+
+        self._queue = asyncio.Queue(self.queue_size)
+        self._worker_tasks = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers)
+        ]
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        await self._queue.put(update)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def _worker(self):
+        while True:
+            update: Dict[str, Any] = await self._queue.get()
+            try:
+                await self._background_feed_update(bot=self.bot, update=update)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке апдейта {update.get('update_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def join(self):
+        """Дождаться обработки всех принятых апдейтов"""
+        if self._queue is not None:
+            await self._queue.join()
+
+    async def close(self):
+        """Доработать очередь, остановить воркеры и закрыть сессию бота"""
+        await self.join()
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
+        await super().close()
+
+
+def build_webhook_app(dp: Dispatcher, bot: Bot, config: Config) -> web.Application:
+    """Собрать aiohttp-приложение с вебхуком бота"""
+    app = web.Application()
+
+    handler = QueuedRequestHandler(
+        dp, bot,
+        workers=config.webhook_workers,
+        secret_token=config.webhook_secret
+    )
+    handler.register(app, path=config.webhook_path)
+    setup_application(app, dp, bot=bot)
+
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, config: Config):
+    """Зарегистрировать вебхук в Telegram и обслуживать его до остановки"""
+    app = build_webhook_app(dp, bot, config)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, config.webhook_host, config.webhook_port)
+    await site.start()
+
+    await bot.set_webhook(
+        url=config.webhook_url.rstrip("/") + config.webhook_path,
+        secret_token=config.webhook_secret,
+        drop_pending_updates=False
+    )
+    logger.info(f"Вебхук слушает {config.webhook_host}:{config.webhook_port}"
+                f"{config.webhook_path}, воркеров: {config.webhook_workers}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await bot.delete_webhook()
+        await runner.cleanup()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный стенд для режима вебхука.
+
+Отправляет на локально запущенный вебхук синтетические апдейты Telegram
+(/start и нажатия "participate_yes") и печатает задержки ответа.
+
+    BOT_MODE=webhook WEBHOOK_URL=http://localhost:8080 python bot.py
+    python webhook_harness.py --url http://localhost:8080/webhook --count 2000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List, Optional
+
+import aiohttp
+
+
+def make_message_update(update_id: int, user_id: int, text: str = "/start") -> dict:
+    """Синтетический апдейт с текстовым сообщением"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        },
+    }
+
+
+def make_callback_update(update_id: int, user_id: int,
+                         data: str = "participate_yes") -> dict:
+    """Синтетический апдейт с нажатием inline-кнопки"""
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bot"},
+                "text": "☕ Хотите участвовать в мэтчинге на этой неделе?",
+            },
+        },
+    }
+
+
+def make_updates(count: int, first_user_id: int = 1000) -> List[dict]:
+    """Смесь апдейтов: на каждые четыре нажатия кнопки одна команда /start"""
+    updates = []
+    for i in range(count):
+        user_id = first_user_id + i
+        if i % 5 == 0:
+            updates.append(make_message_update(i + 1, user_id))
+        else:
+            updates.append(make_callback_update(i + 1, user_id))
+    return updates
+
+
+async def post_updates(url: str, updates: List[dict], concurrency: int = 50,
+                       secret: Optional[str] = None) -> List[float]:
+    """Отправить апдейты на вебхук, вернуть задержки ответов в секундах"""
+    headers = {}
+    if secret:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def post(update: dict):
+            async with semaphore:
+                start = time.perf_counter()
+                async with session.post(url, json=update) as response:
+                    response.raise_for_status()
+                    await response.read()
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(post(update) for update in updates))
+
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:8080/webhook")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--secret", default=None)
+    args = parser.parse_args()
+
+    updates = make_updates(args.count)
+
+    start = time.perf_counter()
+    latencies = await post_updates(args.url, updates, args.concurrency, args.secret)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"Отправлено апдейтов: {len(latencies)} за {elapsed:.2f} с "
+          f"({len(latencies) / elapsed:.0f} в секунду)")
+    print(f"Задержка: медиана {statistics.median(latencies) * 1000:.1f} мс, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} мс, "
+          f"макс {latencies[-1] * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())